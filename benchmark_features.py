@@ -0,0 +1,113 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 2 - Flow Classification
+Stage: 2 - Data Preprocessing (feature helpers benchmark)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 01/2024
+
+Compare les versions vectorisées de flow_features.py aux anciennes versions
+ligne par ligne, conservées ici comme référence (voir aussi les tests de
+tests/test_flow_features.py).
+Exemple : python benchmark_features.py --rows 1000000
+"""
+
+import argparse
+import ipaddress
+import time
+import numpy as np
+import pandas as pd
+from flow_features import TCP_FLAGS, decode_tcp_flags, map_ip_to_interval
+
+
+def map_ip_to_interval_rowwise(ip):
+    # Ancienne implémentation ligne par ligne
+    try:
+        ip = ipaddress.IPv4Address(ip)
+    except ValueError:
+        return "UnknownNetwork"
+    if ip <= ipaddress.IPv4Address("128.0.0.0"):
+        return "PrivateNetwork"
+    elif ip <= ipaddress.IPv4Address("192.0.0.0"):
+        return "PublicNetwork"
+    elif ip <= ipaddress.IPv4Address("224.0.0.0"):
+        return "MulticastNetwork"
+    else:
+        return "UnknownNetwork"
+
+
+def random_ips(n_rows, n_distinct=20_000, seed=42):
+    # Adresses tirées parmi n_distinct valeurs, plus les bornes et des valeurs invalides
+    rng = np.random.default_rng(seed)
+    pool = np.array(
+        [str(ipaddress.IPv4Address(int(x))) for x in rng.integers(0, 2**32, n_distinct)]
+        + ["128.0.0.0", "192.0.0.0", "224.0.0.0", "not-an-ip", "::1"],
+        dtype=object,
+    )
+    return pd.Series(pool[rng.integers(0, len(pool), n_rows)])
+
+
+def benchmark_ip_classifier(n_rows=1_000_000, n_distinct=20_000, seed=42):
+    # Comparer la version vectorisée à l'ancienne version ligne par ligne
+    ips = random_ips(n_rows, n_distinct, seed)
+
+    start = time.perf_counter()
+    expected = ips.apply(map_ip_to_interval_rowwise)
+    rowwise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = map_ip_to_interval(ips)
+    vectorized_time = time.perf_counter() - start
+
+    if not result.equals(expected):
+        raise ValueError("Les deux versions ne donnent pas le même résultat")
+    print(f"Lignes : {n_rows} ({n_distinct} adresses distinctes)")
+    print(f"Ligne par ligne : {rowwise_time:.3f} s")
+    print(f"Vectorisé : {vectorized_time:.3f} s")
+    print(f"Accélération : x{rowwise_time / vectorized_time:.1f}")
+
+
+def decode_tcp_flags_rowwise(values, prefix):
+    # Ancienne implémentation (un .apply par flag)
+    return {
+        f"{prefix}{flag}": values.apply(
+            lambda x: int(flag in x.split(",")) if pd.notna(x) else 0
+        ).to_numpy()
+        for flag in TCP_FLAGS
+    }
+
+
+def random_tcp_flags(n_rows, seed=42):
+    # Descriptions ISCX, chaîne vide et valeurs manquantes comprises
+    rng = np.random.default_rng(seed)
+    pool = np.array(["F,S,P,A", "S", "S,A", "R", "R,A", "F,A", "N/A", "", None])
+    return pd.Series(pool[rng.integers(0, len(pool), n_rows)])
+
+
+def benchmark_tcp_flags(n_rows=1_000_000, seed=42):
+    # Comparer le décodage en une passe à l'ancien décodage flag par flag
+    values = random_tcp_flags(n_rows, seed)
+
+    start = time.perf_counter()
+    expected = decode_tcp_flags_rowwise(values, "sourceTCPFlag_")
+    rowwise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = decode_tcp_flags(values, "sourceTCPFlag_")
+    vectorized_time = time.perf_counter() - start
+
+    for column, column_values in expected.items():
+        if not np.array_equal(result[column], column_values):
+            raise ValueError(f"Les deux versions diffèrent pour {column}")
+    print(f"Lignes : {n_rows}")
+    print(f"Flag par flag : {rowwise_time:.3f} s")
+    print(f"Une passe : {vectorized_time:.3f} s")
+    print(f"Accélération : x{rowwise_time / vectorized_time:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de flow_features.py")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Nombre de lignes")
+    args = parser.parse_args()
+
+    benchmark_ip_classifier(args.rows)
+    benchmark_tcp_flags(args.rows)
@@ -9,25 +9,25 @@ Date: 01/2024
 import xml.etree.ElementTree as ET
 import pandas as pd
 import ipaddress
-import pickle
 import sys
 import os
 
 # Ajouter le dossier parent au sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from preprocess_df import preprocess_data
+from preprocess_df import preprocess_data, encoder_file
+from flow_encoder import FlowEncoder
+from flow_store import write_flow_store
 
 pd.set_option("display.max_columns", None)
 pd.set_option("display.max_rows", None)
 
 # xml_file = "challenge1/data/benchmark_HTTPWeb_test.xml"
 xml_file = "challenge1/data/benchmark_SSH_test.xml"
-processed_df_file = "data/df_preprocessed.pkl"
-# df_challenge_file = "challenge1/data/df_HTTPWeb.pkl"
-df_challenge_file = "challenge1/data/df_SSH.pkl"
+# df_challenge_dir = "challenge1/data/df_HTTPWeb"
+df_challenge_dir = "challenge1/data/df_SSH"
 
 
-def parse_xml_to_dataframe(file_name):
+def parse_xml_to_dataframe(file_name, encoder):
     print("Parsing", file_name, "XML file...")
 
     # Charger et parser le fichier XML
@@ -55,33 +55,19 @@ def parse_xml_to_dataframe(file_name):
     print(df.head())
 
     # Ici, ajoutez tout prétraitement nécessaire
-    df_preprocessed = preprocess_data(df)
+    df_preprocessed = preprocess_data(df, encoder)
     print("Done preprocessing data in dataframe.")
     print(df_preprocessed.head())
 
     return df_preprocessed
 
 
-# Parsing des fichiers XML
-df_test = parse_xml_to_dataframe(xml_file)
-
-# Charger le jeu de données complet
-with open(processed_df_file, "rb") as file:
-    df_complet = pd.read_pickle(file)
-
-# Charger le jeu de données incomplet
-df_incomplet = df_test
+# Encodeur appris sur les données d'entraînement : il impose les colonnes du
+# jeu de données complet et leur ordre (output_columns_), sans relire ce dernier
+encoder = FlowEncoder.load(encoder_file)
 
-# Obtenir la liste des colonnes manquantes
-missing_columns = set(df_complet.columns) - set(df_incomplet.columns)
-print(missing_columns)
-
-# Ajouter les colonnes manquantes au DataFrame incomplet
-for column in missing_columns:
-    df_incomplet[column] = 0  # Remplir de zéros
-
-# Réorganiser les colonnes pour qu'elles correspondent à celles du jeu de données complet
-df_test = df_incomplet[df_complet.columns]
+# Parsing des fichiers XML
+df_test = parse_xml_to_dataframe(xml_file, encoder)
 
 # Sauvegarder le DataFrame avec les données manquantes
 df_test = df_test.drop(columns=["appName", "origin"], errors="ignore")
@@ -90,5 +76,4 @@ df_test.fillna(
 )  # Remplacez toutes les valeurs NaN par 0 dans l'ensemble du DataFrame
 
 # Sauvegarder le DataFrame avec les features manquantes
-with open(df_challenge_file, "wb") as file:
-    pickle.dump(df_test, file)
+write_flow_store(df_test, df_challenge_dir)
@@ -8,9 +8,14 @@ Date: 01/2024
 @deprecated - On utilise challenge2.ipynb à la place. Utilisation de csv au lien de xml.
 """
 import xml.sax
-import ipaddress
+import os
+import sys
 import pandas as pd
 
+# Ajouter le dossier parent au sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_features import ip_interval
+
 
 class FlowHandler(xml.sax.ContentHandler):
     def __init__(self, file_size):
@@ -128,18 +133,7 @@ class FlowHandler(xml.sax.ContentHandler):
             # breakpoint()
 
     def map_ip_to_interval(self, ip):
-        try:
-            ip = ipaddress.IPv4Address(ip)
-        except ValueError:
-            return "UnknownNetwork"
-        if ip <= ipaddress.IPv4Address("128.0.0.0"):
-            return "PrivateNetwork"
-        elif ip <= ipaddress.IPv4Address("192.0.0.0"):
-            return "PublicNetwork"
-        elif ip <= ipaddress.IPv4Address("224.0.0.0"):
-            return "MulticastNetwork"
-        else:
-            return "UnknownNetwork"
+        return ip_interval(ip)
 
     def map_port_to_interval(self, port):
         port_bins = [0, 1023, 49151, 65535]
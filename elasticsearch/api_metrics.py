@@ -0,0 +1,229 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (metrics)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Mesures de l'API exposées au format texte de Prometheus (route /metrics) :
+durée des requêtes par route, décomposée en temps Elasticsearch (took),
+surcoût réseau et client, et mise en forme de la réponse ; taille des
+réponses, codes de retour, erreurs Elasticsearch et requêtes en cours.
+Les recherches lentes peuvent être journalisées avec leur corps (JSON lines)
+pour repérer les agrégations à précalculer.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+# Bornes des histogrammes : durées (secondes) et tailles (octets)
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+# Journal des recherches lentes ; un chemin relatif part du dossier de ce module
+# (et non du dossier courant du serveur)
+SLOW_QUERY_LOG = "data/slow_queries.jsonl"
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Histogram:
+    # Histogramme cumulatif par valeur d'étiquette (appelé avec le verrou de ApiMetrics)
+
+    def __init__(self, name, help_text, buckets, label="route"):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+
+    def observe(self, label_value, value):
+        series = self.series.setdefault(label_value, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label_value, (counts, total, count) in sorted(self.series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ApiMetrics:
+    """
+    Compteurs et histogrammes de l'API, partagés par tous les threads.
+    Avec slow_query_seconds, chaque recherche plus longue est ajoutée à
+    slow_query_log (une ligne JSON : route, durées, corps de la requête).
+    Les lignes sont formatées hors du verrou et écrites par un thread dédié :
+    aucune requête n'attend le disque.
+    """
+
+    def __init__(
+        self,
+        slow_query_seconds=None,
+        slow_query_log=SLOW_QUERY_LOG,
+        clock=time.perf_counter,
+    ):
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_query_log = os.path.join(MODULE_DIR, slow_query_log)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.slow_queries = queue.SimpleQueue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.latency = Histogram(
+            "api_request_duration_seconds",
+            "Request duration, from routing to the end of the handler.",
+            LATENCY_BUCKETS,
+        )
+        self.es_took = Histogram(
+            "api_es_took_seconds",
+            "Search time reported by Elasticsearch (took).",
+            LATENCY_BUCKETS,
+        )
+        self.es_overhead = Histogram(
+            "api_es_overhead_seconds",
+            "Search round trip minus took: network, HTTP and client decoding.",
+            LATENCY_BUCKETS,
+        )
+        self.serialization = Histogram(
+            "api_serialization_seconds",
+            "Time spent shaping the search result and encoding the JSON response.",
+            LATENCY_BUCKETS,
+        )
+        self.response_size = Histogram(
+            "api_response_size_bytes",
+            "Response body size (streamed responses excluded).",
+            SIZE_BUCKETS,
+        )
+        self.requests = {}
+        self.es_errors = {}
+        self.in_flight = 0
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+        return self.clock()
+
+    def request_finished(self, route, started, status, size=None):
+        elapsed = self.clock() - started
+        with self.lock:
+            self.in_flight -= 1
+            self.latency.observe(route, elapsed)
+            key = (route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if size is not None:
+                self.response_size.observe(route, size)
+
+    def search_done(self, route, elapsed, took_ms, body):
+        # elapsed : aller-retour mesuré côté client ; took_ms : temps annoncé par Elasticsearch
+        took = took_ms / 1000
+        with self.lock:
+            self.es_took.observe(route, took)
+            self.es_overhead.observe(route, max(elapsed - took, 0.0))
+        if self.slow_query_seconds is None or elapsed < self.slow_query_seconds:
+            return
+        record = {
+            "time": time.time(),
+            "route": route,
+            "elapsed": elapsed,
+            "took": took,
+            "body": body,
+        }
+        self._start_writer()
+        self.slow_queries.put(json.dumps(record, default=str) + "\n")
+
+    def _start_writer(self):
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self._write_slow_queries, daemon=True
+                )
+                self.writer.start()
+
+    def _write_slow_queries(self):
+        # Thread d'écriture : les lignes en attente sont écrites ensemble
+        while True:
+            lines = [self.slow_queries.get()]
+            while True:
+                try:
+                    lines.append(self.slow_queries.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            lines = [line for line in lines if line is not None]
+            if lines:
+                os.makedirs(os.path.dirname(self.slow_query_log), exist_ok=True)
+                with open(self.slow_query_log, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            if stop:
+                return
+
+    def close(self):
+        # Écrit les recherches lentes en attente et arrête le thread d'écriture
+        with self.writer_lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            self.slow_queries.put(None)
+            writer.join()
+
+    def search_failed(self, route):
+        with self.lock:
+            self.es_errors[route] = self.es_errors.get(route, 0) + 1
+
+    def serialized(self, route, elapsed):
+        with self.lock:
+            self.serialization.observe(route, elapsed)
+
+    def render(self):
+        # Format texte d'exposition de Prometheus (version 0.0.4)
+        with self.lock:
+            lines = []
+            for histogram in (
+                self.latency,
+                self.es_took,
+                self.es_overhead,
+                self.serialization,
+                self.response_size,
+            ):
+                lines += histogram.render()
+
+            lines += [
+                "# HELP api_requests_total Requests by route and status code.",
+                "# TYPE api_requests_total counter",
+            ]
+            for (route, status), n in sorted(self.requests.items()):
+                lines.append(
+                    f'api_requests_total{{route="{_escape(route)}",status="{status}"}} {n}'
+                )
+
+            lines += [
+                "# HELP api_es_errors_total Failed Elasticsearch searches by route.",
+                "# TYPE api_es_errors_total counter",
+            ]
+            for route, n in sorted(self.es_errors.items()):
+                lines.append(f'api_es_errors_total{{route="{_escape(route)}"}} {n}')
+
+            lines += [
+                "# HELP api_in_flight_requests Requests being handled.",
+                "# TYPE api_in_flight_requests gauge",
+                f"api_in_flight_requests {self.in_flight}",
+            ]
+            return "\n".join(lines) + "\n"
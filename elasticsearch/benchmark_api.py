@@ -0,0 +1,451 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (load-test benchmark)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Banc d'essai de charge des routes de data_access.py, sans cluster.
+Un faux Elasticsearch (serveur HTTP local devant le moteur de flow_engine.py)
+répond aux requêtes de l'API à partir d'un jeu de flux synthétique et
+reproductible (graine fixe) : chaque requête distincte est calculée une fois
+puis rejouée, avec un délai optionnel simulant le temps de recherche. L'API
+(Flask, ou asynchrone avec --server async) tourne dans un autre processus, et
+chaque route reçoit requests requêtes à concurrency clients simultanés. Le
+rapport JSON (p50/p95/p99, requêtes/s par route) peut être comparé à celui
+d'une autre version avec --compare.
+
+Exemple : python benchmark_api.py --requests 500 --concurrency 16 --report data/bench.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+import numpy as np
+import pandas as pd
+import urllib3
+from flow_engine import FlowEngine
+
+# Ajouter le dossier parent au sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_store import write_flow_store
+
+# Routes mesurées (avec des paramètres représentatifs)
+ENDPOINTS = [
+    "/distinct_protocols",
+    "/flows_by_protocol?protocol=tcp_ip",
+    "/flows_count_by_protocol",
+    "/payload_sizes_by_protocol",
+    "/bytes_sizes_by_protocol",
+    "/packets_by_protocol",
+    "/distinct_applications",
+    "/flows_by_application?application=HTTPWeb",
+    "/flows_count_by_application",
+    "/payload_sizes_by_application",
+    "/bytes_sizes_by_application",
+    "/packets_by_application",
+    "/summary_by_protocol",
+    "/summary_by_application",
+    "/summary",
+    "/flows_stream?limit=2000",
+    "/get_flows_and_packets",
+    "/ranked_distribution",
+    "/ranked_distribution?format=png",
+    "/timeline",
+    "/timeline?protocol=tcp_ip&points=50",
+]
+
+N_FLOWS = 50000
+REQUESTS = 200
+CONCURRENCY = 8
+WARMUP = 5
+REPORT_FILE = "data/benchmark_api.json"
+
+# Valeurs catégorielles du jeu synthétique (tirées selon une loi de Zipf)
+PROTOCOLS = ["tcp_ip", "udp_ip", "icmp_ip", "igmp", "ip"]
+APPLICATIONS = [
+    "HTTPWeb",
+    "SSH",
+    "DNS",
+    "SMTP",
+    "FTP",
+    "HTTPImageTransfer",
+    "POP",
+    "IMAP",
+    "SecureWeb",
+    "NetBIOS-IP",
+    "WindowsFileSharing",
+    "MiscApplication",
+    "IRC",
+    "BitTorrent",
+    "Unknown_TCP",
+    "Unknown_UDP",
+    "ICMP",
+    "Telnet",
+    "NTP",
+    "SNMP",
+]
+ORIGINS = [f"TestbedDay{day}.xml" for day in range(1, 8)]
+DIRECTIONS = ["L2R", "R2L", "L2L", "R2R"]
+CAPTURE_START = "2010-06-12T00:00:00"
+
+
+def synthetic_flows(n_flows=N_FLOWS, seed=42):
+    # Colonnes NumPy d'un jeu de flux reproductible
+    rng = np.random.default_rng(seed)
+
+    def categorical(values):
+        weights = 1 / np.arange(1, len(values) + 1)
+        return np.array(values, dtype=object)[
+            rng.choice(len(values), n_flows, p=weights / weights.sum())
+        ]
+
+    source_packets = rng.zipf(1.8, n_flows).clip(max=10**7)
+    destination_packets = rng.zipf(1.8, n_flows).clip(max=10**7)
+    return {
+        "protocolName": categorical(PROTOCOLS),
+        "appName": categorical(APPLICATIONS),
+        "origin": categorical(ORIGINS),
+        "direction": categorical(DIRECTIONS),
+        "totalSourcePackets": source_packets,
+        "totalDestinationPackets": destination_packets,
+        "totalSourceBytes": source_packets * rng.integers(40, 1500, n_flows),
+        "totalDestinationBytes": destination_packets * rng.integers(40, 1500, n_flows),
+        "sourcePayloadBytes": rng.integers(0, 4096, n_flows),
+        "destinationPayloadBytes": rng.integers(0, 65536, n_flows),
+        "sourcePort": rng.integers(1024, 65536, n_flows),
+        "destinationPort": rng.choice([22, 25, 53, 80, 443], n_flows),
+        # Une semaine de capture (dates ISO, comme dans l'index) et 5 % d'attaques
+        "startDateTime": np.datetime_as_string(
+            np.datetime64(CAPTURE_START)
+            + rng.integers(0, 7 * 86400, n_flows).astype("timedelta64[s]"),
+            unit="s",
+        ).astype(object),
+        "Tag": np.where(rng.random(n_flows) < 0.05, "Attack", "Normal").astype(object),
+    }
+
+
+def handle_request(engine, method, path, body):
+    # Route HTTP d'Elasticsearch -> appel du moteur embarqué (flow_engine.py)
+    if path.endswith("/_pit") and method == "POST":
+        return engine.open_point_in_time()
+    if path == "/_pit" and method == "DELETE":
+        return engine.close_point_in_time(**body)
+    if "/_stats" in path:
+        return engine.indices.stats()
+    if method == "GET" and path.count("/") == 1 and path != "/":
+        # indices.get : l'index des flux seul (pas d'index de synthèse)
+        return engine.indices.get()
+    if path.endswith("/_search"):
+        if "_source" in body:
+            body["source"] = body.pop("_source")
+        return engine.search(**body)
+    if path == "/":
+        return {"version": {"number": "8.11.0"}, "tagline": "You Know, for Search"}
+    raise ValueError(f"Unsupported request: {method} {path}")
+
+
+def serve_fake_elasticsearch(port, n_flows, seed, latency):
+    """
+    Faux Elasticsearch sur 127.0.0.1:port. Chaque requête distincte (méthode,
+    chemin, corps) est calculée une seule fois puis rejouée ; latency
+    (secondes) est ajouté à chaque réponse pour simuler le temps de recherche.
+    """
+    directory = tempfile.mkdtemp(prefix="benchmark_flows_")
+    write_flow_store(pd.DataFrame(synthetic_flows(n_flows, seed)), directory)
+    engine = FlowEngine(directory)
+    replay = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # En-têtes et corps sont envoyés séparément : sans TCP_NODELAY,
+        # l'algorithme de Nagle et l'ACK retardé du client ajoutent ~40 ms
+        disable_nagle_algorithm = True
+
+        def respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            path = unquote(urlsplit(self.path).path)
+            key = (self.command, path, raw)
+            with lock:
+                payload = replay.get(key)
+            status = 200
+            if payload is None:
+                try:
+                    body = json.loads(raw) if raw else {}
+                    payload = json.dumps(
+                        handle_request(engine, self.command, path, body), default=str
+                    ).encode("utf-8")
+                    with lock:
+                        replay[key] = payload
+                except Exception as e:
+                    status = 400
+                    payload = json.dumps({"error": str(e)}).encode("utf-8")
+            if latency:
+                time.sleep(latency)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST = do_DELETE = do_HEAD = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def serve_api(port, es_port, cache):
+    # Processus de l'API Flask, connectée au faux Elasticsearch
+    import logging
+    from elasticsearch import Elasticsearch
+    from werkzeug.serving import make_server
+    import data_access
+
+    # Pas de ligne de journal par requête
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    data_access.es = Elasticsearch(hosts=[f"http://127.0.0.1:{es_port}"])
+    if not cache:
+        # Aucune entrée conservée : chaque requête atteint Elasticsearch
+        data_access.cache.max_entries = 0
+    make_server("127.0.0.1", port, data_access.app, threaded=True).serve_forever()
+
+
+def serve_api_async(port, es_port, cache):
+    # Processus de l'API asynchrone (data_access_async.py) servie par hypercorn
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    import data_access_async
+
+    data_access_async.hosts = [f"http://127.0.0.1:{es_port}"]
+    if not cache:
+        data_access_async.cache.max_entries = 0
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    asyncio.run(serve(data_access_async.app, config))
+
+
+# Serveurs mesurables : --server
+SERVERS = {"flask": serve_api, "async": serve_api_async}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(http, url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            http.request("GET", url, retries=False)
+            return
+        except urllib3.exceptions.HTTPError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run_endpoint(http, url, n_requests, concurrency, warmup=WARMUP):
+    """
+    Envoie n_requests requêtes GET sur url avec concurrency clients.
+    Renvoie les latences (secondes), le nombre d'erreurs et la durée totale.
+    """
+    for _ in range(warmup):
+        http.request("GET", url)
+
+    def one_request(_):
+        start = time.perf_counter()
+        response = http.request("GET", url)
+        return time.perf_counter() - start, response.status >= 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one_request, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results])
+    errors = sum(error for _, error in results)
+    return latencies, errors, elapsed
+
+
+def summarize(latencies, errors, elapsed):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": int(errors),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(latencies.mean() * 1000), 3),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(previous, current):
+    # Rapport de la version courante comparé à un rapport précédent
+    print(f"{'route':45} {'p50':>24} {'p99':>24} {'req/s':>24}")
+    for endpoint, result in current["endpoints"].items():
+        before = previous["endpoints"].get(endpoint)
+        if before is None:
+            continue
+        columns = []
+        for key in ("p50_ms", "p99_ms", "requests_per_s"):
+            ratio = result[key] / before[key] if before[key] else float("nan")
+            columns.append(f"{before[key]:.1f}->{result[key]:.1f} x{ratio:.2f}")
+        print(f"{endpoint:45} " + " ".join(f"{column:>24}" for column in columns))
+
+
+def run_benchmark(
+    endpoints=ENDPOINTS,
+    n_requests=REQUESTS,
+    concurrency=CONCURRENCY,
+    n_flows=N_FLOWS,
+    seed=42,
+    es_latency=0.0,
+    cache=False,
+    server="flask",
+):
+    es_port, api_port = free_port(), free_port()
+    processes = [
+        multiprocessing.Process(
+            target=serve_fake_elasticsearch,
+            args=(es_port, n_flows, seed, es_latency),
+            daemon=True,
+        ),
+        # Pas daemon : l'API crée son pool de rendu (render_pool.py)
+        multiprocessing.Process(
+            target=SERVERS[server], args=(api_port, es_port, cache)
+        ),
+    ]
+    for process in processes:
+        process.start()
+
+    http = urllib3.PoolManager(maxsize=concurrency, block=True)
+    base_url = f"http://127.0.0.1:{api_port}"
+    try:
+        wait_until_ready(http, f"http://127.0.0.1:{es_port}/")
+        wait_until_ready(http, f"{base_url}/cache_stats")
+        results = {}
+        for endpoint in endpoints:
+            result = summarize(
+                *run_endpoint(http, base_url + endpoint, n_requests, concurrency)
+            )
+            results[endpoint] = result
+            print(
+                f"{endpoint:45} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                f"p99 {result['p99_ms']:8.2f} ms  {result['requests_per_s']:8.1f} req/s  "
+                f"{result['errors']} erreurs"
+            )
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+    return {
+        "revision": git_revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "requests": n_requests,
+            "concurrency": concurrency,
+            "flows": n_flows,
+            "seed": seed,
+            "es_latency": es_latency,
+            "cache": cache,
+            "server": server,
+        },
+        "endpoints": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Banc d'essai de l'API d'accès aux données"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=REQUESTS, help="Requêtes par route"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=CONCURRENCY, help="Clients simultanés"
+    )
+    parser.add_argument(
+        "--flows", type=int, default=N_FLOWS, help="Taille du jeu de flux synthétique"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--es-latency",
+        type=float,
+        default=0.0,
+        help="Délai (secondes) ajouté à chaque réponse du faux Elasticsearch",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Garder le cache des réponses (mesure des réponses en cache)",
+    )
+    parser.add_argument(
+        "--server",
+        choices=sorted(SERVERS),
+        default="flask",
+        help="API mesurée : Flask (data_access.py) ou asynchrone (data_access_async.py)",
+    )
+    parser.add_argument(
+        "--endpoints",
+        help="Routes mesurées, séparées par des virgules (toutes par défaut)",
+    )
+    parser.add_argument("--report", default=REPORT_FILE, help="Fichier du rapport JSON")
+    parser.add_argument("--compare", help="Rapport JSON d'une version précédente")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        endpoints=args.endpoints.split(",") if args.endpoints else ENDPOINTS,
+        n_requests=args.requests,
+        concurrency=args.concurrency,
+        n_flows=args.flows,
+        seed=args.seed,
+        es_latency=args.es_latency,
+        cache=args.cache,
+        server=args.server,
+    )
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Rapport : {args.report}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_reports(json.load(f), report)
@@ -7,10 +7,18 @@ Date: 10/2023
 """
 
 from elasticsearch import Elasticsearch
-from flask import Flask, jsonify, request
-import matplotlib.pyplot as plt
-import numpy as np
-import base64
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from functools import wraps
+from api_metrics import ApiMetrics
+from flow_engine import FlowEngine
+from flow_rollup import rollup_usable
+from render_pool import RenderPool
+from response_cache import ResponseCache
+import flow_queries as queries
+import argparse
+import json
+import os
+import time
 
 index_name = 'flow_data_index'
 
@@ -22,24 +30,137 @@ es = Elasticsearch(hosts=hosts)
 
 app = Flask("API d'acces aux donnees")
 
-def get_numerical_field(field_name):
-    return f"Integer.parseInt(doc['{field_name}'].value)"
+# Les champs numériques et keyword sont typés par le template de flow_index.py :
+# les agrégations lisent directement les doc values, sans script.
+# Les requêtes sont décrites dans flow_queries.py (communes avec data_access_async.py)
 
-@app.route('/distinct_protocols', methods=['GET'])
-def get_distinct_protocols():
+# Cache des réponses : durée de vie (secondes) et nombre maximal d'entrées
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 256
+
+def index_generation():
+    # L'index de synthèse (s'il existe) fait partie de la génération
+    stats = es.indices.stats(index=[index_name, queries.ROLLUP_INDEX + '*'], metric=['docs', 'indexing'])
+    return queries.index_generation(stats)
+
+cache = ResponseCache(index_generation, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+
+# Mesures exposées sur /metrics ; les recherches de plus de SLOW_QUERY_SECONDS
+# sont journalisées avec leur corps dans SLOW_QUERY_LOG (None : désactivé ;
+# chemin relatif au dossier de api_metrics.py)
+SLOW_QUERY_SECONDS = None
+SLOW_QUERY_LOG = 'data/slow_queries.jsonl'
+
+metrics = ApiMetrics(slow_query_seconds=SLOW_QUERY_SECONDS, slow_query_log=SLOW_QUERY_LOG)
+
+# Rendus PNG (matplotlib) dans un pool de processus, hors des threads Flask
+render_pool = RenderPool()
+
+def route_name():
+    # Motif de la route (ex. /summary_by_<dimension>) : nombre d'étiquettes borné
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = metrics.request_started()
+
+@app.after_request
+def record_request_metrics(response):
+    # Réponses en flux : durée jusqu'au premier octet, taille inconnue
+    size = None if response.is_streamed else response.content_length
+    metrics.request_finished(route_name(), g.pop('metrics_started'), response.status_code, size)
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(exception):
+    # Exception non interceptée : after_request n'a pas été appelé
+    if 'metrics_started' in g:
+        metrics.request_finished(route_name(), g.pop('metrics_started'), 500)
+
+def search(**kwargs):
+    # es.search mesuré : took d'Elasticsearch, surcoût réseau/client, recherches lentes
+    started = time.perf_counter()
+    try:
+        result = es.search(**kwargs)
+    except Exception:
+        metrics.search_failed(route_name())
+        raise
+    metrics.search_done(route_name(), time.perf_counter() - started, result['took'], kwargs)
+    return result
+
+def cached_view(view):
     """
-    Endpoint pour obtenir une liste de tous les protocoles distincts dans l'index.
+    Sert la réponse depuis le cache, indexé par route et paramètres
+    normalisés (triés). Seules les réponses 200 sont conservées, et
+    seulement si la génération de l'index n'a pas changé pendant le calcul.
     """
-    
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        cached, generation = cache.lookup(key)
+        if cached is not None:
+            data, status, mimetype = cached
+            return Response(data, status=status, mimetype=mimetype)
+
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            # Ignorée si l'index a changé pendant le calcul
+            cache.put(key, (response.get_data(), response.status_code, response.mimetype), generation)
+        return response
+
+    return wrapper
+
+# Statistiques lues dans l'index de synthèse de flow_rollup.py quand il est
+# complet et calculé sur l'index des flux actuel (O(groupes) au lieu de
+# O(flux)) ; False : toujours sur l'index des flux
+STATS_FROM_ROLLUP = True
+
+def stats_rollup():
+    if not STATS_FROM_ROLLUP:
+        return False
     try:
-        result = es.search(index=index_name, aggs={'distinct_protocols': {'terms': {'field': 'protocolName.keyword'}}})
-        distinct_protocols = [bucket['key'] for bucket in result['aggregations']['distinct_protocols']['buckets']]
-        return jsonify(distinct_protocols)
+        indices = es.indices.get(index=[index_name, queries.ROLLUP_INDEX], ignore_unavailable=True)
+        return rollup_usable(indices, queries.ROLLUP_INDEX)
+    except Exception:
+        return False
+
+def run_query(query):
+    # Exécute une requête de flow_queries et renvoie sa réponse mise en forme
+    search_kwargs, parse = query
+    try:
+        result = search(**{'index': index_name, **search_kwargs})
+        started = time.perf_counter()
+        response = jsonify(parse(result))
+        metrics.serialized(route_name(), time.perf_counter() - started)
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Endpoint to get the API metrics in the Prometheus text format.
+    """
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """
+    Endpoint to get the response cache statistics (hits, misses, evictions...).
+    """
+    return jsonify(cache.stats())
+
+@app.route('/distinct_protocols', methods=['GET'])
+@cached_view
+def get_distinct_protocols():
+    """
+    Endpoint pour obtenir une liste de tous les protocoles distincts dans l'index.
+    """
+    return run_query(queries.distinct_values('protocolName', stats_rollup()))
+
 @app.route('/flows_by_protocol', methods=['GET'])
+@cached_view
 def get_flows_by_protocol():
     """
     Endpoint to get a list of flows for a given protocol.
@@ -47,250 +168,52 @@ def get_flows_by_protocol():
     protocol = request.args.get('protocol')
     if not protocol:
         return jsonify({"error": "Protocol parameter is missing"}), 400
-    
-    try:
-        result = es.search(index=index_name, query={"match": {"protocolName.keyword": protocol}})
-        flows = [hit['_source'] for hit in result['hits']['hits']]
-        return jsonify(flows)
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
+    return run_query(queries.matching_flows('protocolName', protocol))
+
 @app.route('/flows_count_by_protocol', methods=['GET'])
+@cached_view
 def get_flows_count_by_protocol():
     """
     Endpoint to get the number of flows for each protocol.
     """
-    
-    try:
-        result = es.search(index=index_name, aggs={'protocols_count': {'terms': {'field': 'protocolName.keyword'}}})
-        protocol_counts = {bucket['key']: bucket['doc_count'] for bucket in result['aggregations']['protocols_count']['buckets']}
-        return jsonify(protocol_counts)
+    return run_query(queries.value_counts('protocolName', stats_rollup()))
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/payload_sizes_by_protocol', methods=['GET'])
+@cached_view
 def get_payload_sizes_by_protocol():
     """
     Endpoint to get the source and destination payload size for each protocol.
+    Sizes are the decoded byte lengths computed at ingest (see flow_index.py).
     """
-    mapping = {
-        "properties": {
-            "sourcePayloadAsBase64": {
-                "type": "text",
-                "fielddata": True
-            },
-            "destinationPayloadAsBase64": {
-                "type": "text",
-                "fielddata": True
-            }
-        }
-    }
-    es.indices.put_mapping(index=index_name, body=mapping)
-
-    search_query = {
-        "aggs": {
-            "protocols": {
-                "terms": {
-                    "field": "protocolName.keyword",
-                },
-                "aggs": {
-                    "total_source_payload_size": {
-                        "sum": {
-                            "script": {
-                                "source": "doc['sourcePayloadAsBase64'].size()"
-                            }
-                        }
-                    },
-                    "total_destination_payload_size": {
-                        "sum": {
-                            "script": {
-                                "source": "doc['destinationPayloadAsBase64'].size()"
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    try:
-        result = es.search(index=index_name, body=search_query)
+    return run_query(queries.value_sums('protocolName', queries.LEGACY_SUMS['payload_sizes'], stats_rollup()))
 
-        # Extracting the aggregation results
-        protocol_info = {}
-        for bucket in result['aggregations']['protocols']['buckets']:
-            protocol_name = bucket['key']
-            total_source_payload_size = bucket['total_source_payload_size']['value']
-            total_destination_payload_size = bucket['total_destination_payload_size']['value']
-            protocol_info[protocol_name] = {
-                "total_source_payload_size": total_source_payload_size,
-                "total_destination_payload_size": total_destination_payload_size
-            }
-
-        return jsonify(protocol_info)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/bytes_sizes_by_protocol', methods=['GET'])
+@cached_view
 def get_bytes_sizes_by_protocol():
     """
     Endpoint to get the source and destination bytes size for each protocol.
     """
+    return run_query(queries.value_sums('protocolName', queries.LEGACY_SUMS['bytes_sizes'], stats_rollup()))
 
-    mapping = {
-        "properties": {
-            "totalSourcebytes": {
-                "type": "text",
-                "fielddata": True
-            },
-            "totalDestinationbytes": {
-                "type": "text",
-                "fielddata": True
-            }
-        }
-    }
-    es.indices.put_mapping(index=index_name, body=mapping)
-
-    search_query = {
-        "aggs": {
-            "protocols": {
-                "terms": {
-                    "field": "protocolName.keyword",
-                },
-                "aggs": {
-                    "source_bytes_size": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalSourceBytes")
-                            }
-                        }
-                    },
-                    "destination_bytes_size": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalDestinationBytes")
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    try:
-        result = es.search(index=index_name, aggs=search_query['aggs'])
-
-        # Extracting the aggregation results
-        protocol_info = {}
-        for bucket in result['aggregations']['protocols']['buckets']:
-            protocol_name = bucket['key']
-            source_bytes_size = bucket['source_bytes_size']['value']
-            destination_bytes_size = bucket['destination_bytes_size']['value']
-            protocol_info[protocol_name] = {
-                "source_bytes_size": source_bytes_size,
-                "destination_bytes_size": destination_bytes_size
-            }
-
-        return jsonify(protocol_info)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/packets_by_protocol', methods=['GET'])
+@cached_view
 def get_packets_by_protocol():
     """
     Endpoint to get the total source/destination packets for each protocol.
     """
+    return run_query(queries.value_sums('protocolName', queries.LEGACY_SUMS['packets'], stats_rollup()))
 
-    mapping = {
-        "properties": {
-            "totalSourcePackets": {
-                "type": "text",
-                "fielddata": True
-            },
-            "totalDestinationPackets": {
-                "type": "text",
-                "fielddata": True
-            }
-        }
-    }
-    es.indices.put_mapping(index=index_name, body=mapping)
-
-    search_query = {
-        "aggs": {
-            "protocols": {
-                "terms": {
-                    "field": "protocolName.keyword",
-                },
-                "aggs": {
-                    "total_source_packets": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalSourcePackets")
-                            }
-                        }
-                    },
-                    "total_destination_packets": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalDestinationPackets")
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    try:
-        result = es.search(index="flow_data_index", aggs=search_query["aggs"])
-
-        # Extracting the aggregation results
-        protocol_info = {}
-        for bucket in result['aggregations']['protocols']['buckets']:
-            protocol_name = bucket['key']
-            total_source_packets = bucket['total_source_packets']['value']
-            total_destination_packets = bucket['total_destination_packets']['value']
-            protocol_info[protocol_name] = {
-                "total_source_packets": total_source_packets,
-                "total_destination_packets": total_destination_packets
-            }
-
-        return jsonify(protocol_info)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/distinct_applications', methods=['GET'])
+@cached_view
 def get_distinct_applications():
     """
     Endpoint to get the list of distinct applications.
     """
-    search_query = {
-        "aggs": {
-            "distinct_applications": {
-                "terms": {
-                    "field": "appName.keyword",
-                }
-            }
-        }
-    }
-
-    try:
-        result = es.search(index=index_name, aggs=search_query["aggs"])
-
-        # Extracting the aggregation results
-        distinct_applications = [bucket['key'] for bucket in result['aggregations']['distinct_applications']['buckets']]
+    return run_query(queries.distinct_values('appName', stats_rollup()))
 
-        return jsonify(distinct_applications)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/flows_by_application', methods=['GET'])
+@cached_view
 def get_flows_by_application():
     """
     Endpoint to get the list of flows for a given application.
@@ -300,314 +223,240 @@ def get_flows_by_application():
     if not application_name:
         return jsonify({"error": "Please provide an 'application_name' parameter in the query."}), 400
 
-    search_query = {
-        "query": {
-            "term": {
-                "appName.keyword": application_name
-            }
-        }
-    }
+    return run_query(queries.matching_flows('appName', application_name, with_ids=True))
 
-    try:
-        result = es.search(index=index_name, query=search_query["query"])
-        flows = result.get('hits', {}).get('hits', [])
-
-        # Extract relevant information from the flows
-        flow_data = [{'_id': flow['_id'], '_source': flow['_source']} for flow in flows]
-
-        return jsonify(flow_data)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/flows_count_by_application', methods=['GET'])
+@cached_view
 def get_flows_count_by_application():
     """
     Endpoint to get the number of flows for each application.
     """
-    
-    try:
-        result = es.search(index=index_name, aggs={'applications_count': {'terms': {'field': 'appName.keyword'}}})
-        application_counts = {bucket['key']: bucket['doc_count'] for bucket in result['aggregations']['applications_count']['buckets']}
-        return jsonify(application_counts)
+    return run_query(queries.value_counts('appName', stats_rollup()))
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 @app.route('/payload_sizes_by_application', methods=['GET'])
+@cached_view
 def get_payload_sizes_by_application():
     """
     Endpoint to get the source and destination payload size for each application.
+    Sizes are the decoded byte lengths computed at ingest (see flow_index.py).
     """
-    mapping = {
-        "properties": {
-            "sourcePayloadAsBase64": {
-                "type": "text",
-                "fielddata": True
-            },
-            "destinationPayloadAsBase64": {
-                "type": "text",
-                "fielddata": True
-            }
-        }
-    }
-    es.indices.put_mapping(index=index_name, body=mapping)
-
-    search_query = {
-        "aggs": {
-            "applications": {
-                "terms": {
-                    "field": "appName.keyword",
-                },
-                "aggs": {
-                    "total_source_payload_size": {
-                        "sum": {
-                            "script": {
-                                "source": "doc['sourcePayloadAsBase64'].size()"
-                            }
-                        }
-                    },
-                    "total_destination_payload_size": {
-                        "sum": {
-                            "script": {
-                                "source": "doc['destinationPayloadAsBase64'].size()"
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    try:
-        result = es.search(index=index_name, body=search_query)
-
-        # Extracting the aggregation results
-        application_info = {}
-        for bucket in result['aggregations']['applications']['buckets']:
-            application_name = bucket['key']
-            total_source_payload_size = bucket['total_source_payload_size']['value']
-            total_destination_payload_size = bucket['total_destination_payload_size']['value']
-            application_info[application_name] = {
-                "total_source_payload_size": total_source_payload_size,
-                "total_destination_payload_size": total_destination_payload_size
-            }
-
-        return jsonify(application_info)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return run_query(queries.value_sums('appName', queries.LEGACY_SUMS['payload_sizes'], stats_rollup()))
 
 @app.route('/bytes_sizes_by_application', methods=['GET'])
+@cached_view
 def get_bytes_sizes_by_application():
     """
     Endpoint to get the source and destination bytes size for each application.
     """
-
-    mapping = {
-        "properties": {
-            "totalSourcebytes": {
-                "type": "text",
-                "fielddata": True
-            },
-            "totalDestinationbytes": {
-                "type": "text",
-                "fielddata": True
-            }
-        }
-    }
-    es.indices.put_mapping(index=index_name, body=mapping)
-
-    search_query = {
-        "aggs": {
-            "applications": {
-                "terms": {
-                    "field": "appName.keyword",
-                },
-                "aggs": {
-                    "source_bytes_size": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalSourceBytes")
-                            }
-                        }
-                    },
-                    "destination_bytes_size": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalDestinationBytes")
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    try:
-        result = es.search(index=index_name, body=search_query)
-
-        # Extracting the aggregation results
-        application_info = {}
-        for bucket in result['aggregations']['applications']['buckets']:
-            application_name = bucket['key']
-            source_bytes_size = bucket['source_bytes_size']['value']
-            destination_bytes_size = bucket['destination_bytes_size']['value']
-            application_info[application_name] = {
-                "source_bytes_size": source_bytes_size,
-                "destination_bytes_size": destination_bytes_size
-            }
-
-        return jsonify(application_info)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return run_query(queries.value_sums('appName', queries.LEGACY_SUMS['bytes_sizes'], stats_rollup()))
 
 @app.route('/packets_by_application', methods=['GET'])
+@cached_view
 def get_packets_by_application():
     """
     Endpoint to get the number of packets for each application.
     """
+    return run_query(queries.value_sums('appName', queries.LEGACY_SUMS['packets'], stats_rollup()))
 
-    mapping = {
-        "properties": {
-            "totalSourcePackets": {
-                "type": "text",
-                "fielddata": True
-            },
-            "totalDestinationPackets": {
-                "type": "text",
-                "fielddata": True
-            }
-        }
-    }
-    es.indices.put_mapping(index=index_name, body=mapping)
-
-    search_query = {
-        "aggs": {
-            "applications": {
-                "terms": {
-                    "field": "appName.keyword",
-                },
-                "aggs": {
-                    "total_source_packets": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalSourcePackets")
-                            }
-                        }
-                    },
-                    "total_destination_packets": {
-                        "sum": {
-                            "script": {
-                                "source": get_numerical_field("totalDestinationPackets")
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
+@app.route('/summary_by_<dimension>', methods=['GET'])
+@cached_view
+def get_summary(dimension):
+    """
+    Endpoint to get, in a single aggregation, the flow count and the sums of
+    bytes, packets and payload bytes for each value of a dimension
+    (protocol, application, origin or direction).
+    Parameters:
+    - fields: comma-separated metrics (count and SUMMARY_METRICS keys, all by default)
+    - size: number of values per page (composite aggregation, no truncation)
+    - after: cursor returned as "next" by the previous page
+    """
+    if dimension not in queries.DIMENSION_FIELDS:
+        return jsonify({"error": f"Unknown dimension: {dimension}"}), 404
     try:
-        result = es.search(index=index_name, aggs=search_query["aggs"])
+        fields, size, after = queries.summary_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Extracting the aggregation results
-        application_info = {}
-        for bucket in result['aggregations']['applications']['buckets']:
-            application_name = bucket['key']
-            total_source_packets = bucket['total_source_packets']['value']
-            total_destination_packets = bucket['total_destination_packets']['value']
-            application_info[application_name] = {
-                "total_source_packets": total_source_packets,
-                "total_destination_packets": total_destination_packets
-            }
-
-        return jsonify(application_info)
+    return run_query(queries.summary(dimension, fields, size, after, rollup=stats_rollup()))
 
+@app.route('/summary', methods=['GET'])
+@cached_view
+def get_summaries():
+    """
+    Endpoint to get the first page of every /summary_by_<dimension> at once
+    (same fields and size parameters).
+    """
+    try:
+        fields, size, _ = queries.summary_args(request.args)
+        rollup = stats_rollup()
+        summaries = {}
+        for dimension in queries.DIMENSION_FIELDS:
+            search_kwargs, parse = queries.summary(dimension, fields, size, rollup=rollup)
+            summaries[dimension] = parse(search(**{'index': index_name, **search_kwargs}))
+        return jsonify(summaries)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    
-@app.route('/get_flows_and_packets', methods=['GET'])
-def get_flows_and_packets():
-    # Effectuez une requête Elasticsearch pour obtenir les données
-    search_query = {
-        "aggs": {
-            "total_flows": {
-                "sum": {
-                    "field": "flows_field"  # Remplacez par le nom de votre champ de flux
-                }
-            },
-            "total_packets": {
-                "sum": {
-                    "field": "packets_field"  # Remplacez par le nom de votre champ de paquets
-                }
-            }
-        }
-    }
 
+@app.route('/flows_stream', methods=['GET'])
+def get_flows_stream():
+    """
+    Endpoint to stream the flows matching the filters as NDJSON (one flow per
+    line), read page by page with a point-in-time and search_after: server
+    memory does not depend on the number of flows.
+    Parameters:
+    - protocol, application, origin, direction: filters (see DIMENSION_FIELDS)
+    - fields: comma-separated _source fields (all but payloads by default)
+    - limit: maximum number of flows; if reached, the last line is
+      {"_next": cursor} to resume with cursor=...
+    - cursor: resumes a previous stream; the filters must be sent again, the
+      cursor only holds the point-in-time and the position
+    """
     try:
-        result = es.search(index=index_name, aggs=search_query["aggs"])
-
-        # Extrayez les agrégations de données
-        total_flows = result['aggregations']['total_flows']['value']
-        total_packets = result['aggregations']['total_packets']['value']
+        limit, source, cursor, query = queries.stream_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if cursor is not None:
+        pit_id, search_after = cursor['pit'], cursor['after']
+    else:
+        search_after = None
+        try:
+            pit_id = es.open_point_in_time(index=index_name, keep_alive=queries.STREAM_KEEP_ALIVE)['id']
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def generate(pit_id, search_after):
+        sent = 0
+        # Fermé en sortie (fin, erreur, client déconnecté), sauf si le curseur
+        # _next a été envoyé
+        keep_open = False
+        try:
+            while limit is None or sent < limit:
+                size = queries.STREAM_PAGE_SIZE if limit is None else min(queries.STREAM_PAGE_SIZE, limit - sent)
+                result = search(**queries.stream_page(pit_id, query, search_after, size, source))
+                pit_id = result.get('pit_id', pit_id)
+                hits = result['hits']['hits']
+                if not hits:
+                    break
+                yield queries.ndjson_page(hits)
+                sent += len(hits)
+                search_after = hits[-1]['sort']
+                if len(hits) < size:
+                    break
+            else:
+                # Limite atteinte : le point-in-time reste ouvert pour la suite
+                cursor = {'pit': pit_id, 'after': search_after}
+                yield queries.ndjson_line({'_next': queries.encode_cursor(cursor)})
+                keep_open = True
+        except Exception as e:
+            yield queries.ndjson_line({'_error': str(e)})
+        finally:
+            if not keep_open:
+                try:
+                    es.close_point_in_time(id=pit_id)
+                except Exception:
+                    # Déjà expiré ou fermé : keep_alive le libère de toute façon
+                    pass
+
+    return Response(stream_with_context(generate(pit_id, search_after)), mimetype='application/x-ndjson')
 
-        # Retournez les données en tant que réponse JSON
-        return jsonify({
-            "total_flows": total_flows,
-            "total_packets": total_packets
-        })
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@app.route('/get_flows_and_packets', methods=['GET'])
+@cached_view
+def get_flows_and_packets():
+    # Effectuez une requête Elasticsearch pour obtenir les données
+    return run_query(queries.totals({
+        "total_flows": "flows_field",  # Remplacez par le nom de votre champ de flux
+        "total_packets": "packets_field",  # Remplacez par le nom de votre champ de paquets
+    }))
     
 @app.route('/ranked_distribution', methods=['GET'])
+@cached_view
 def get_ranked_distribution():
-    query = {
-        "size": 1000,  # You can adjust the size based on your data
-        "_source": ["totalSourcePackets", "totalDestinationPackets"]
-    }
-    response = es.search(index=index_name, body=query)
-    flows = []
-    packets = []
-    for hit in response['hits']['hits']:
-        flow = hit['_source']
-        flows.append(flow['totalSourcePackets'] + flow['totalDestinationPackets'])
-        packets.append(flow['totalSourcePackets'])
-
-    # Sort data in descending order
-    flows = sorted(flows, reverse=True)
-    packets = sorted(packets, reverse=True)
-
-    # Calculate the ranks
-    ranks = np.arange(1, len(flows) + 1)
-
-    # Create a log-log plot
-    plt.loglog(packets, flows, marker='o', linestyle='-', color='b')
-
-    # Set labels and title
-    plt.ylabel('#Packets (Log Scale)')
-    plt.xlabel('#Flows (Log Scale)')
-    plt.title('Ranked Distribution of Flows vs. Packets')
-
-    # Save the plot as an image (optional)
-    # plt.savefig('ranked_distribution.png')
-
-    # Convert the plot to a base64 encoded string (optional)
-    import io
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    image_data = base64.b64encode(buf.getvalue()).decode('utf-8')
-
-    # You can return the image data as a response if needed
-    # return jsonify({'image_data': image_data})
+    """
+    Endpoint to get the rank/size distribution of packets per flow over the
+    whole index (percentiles computed by Elasticsearch, no raw documents).
+    Parameters:
+    - format: json (ranks and packet counts, default) or png (log-log plot)
+    The PNG is rendered in a worker process (concurrent requests for the
+    same image share one rendering); the result is cached until the index
+    changes.
+    """
+    output = request.args.get('format', 'json')
+    if output not in ('json', 'png'):
+        return jsonify({"error": "format must be json or png"}), 400
 
-    # Show the plot (this line should be used in development, not in production)
-    plt.show()
+    search_kwargs, parse = queries.ranked_distribution()
+    try:
+        distribution = parse(search(index=index_name, **search_kwargs))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-    return jsonify({'message': 'Ranked distribution plot generated'})
+    if output == 'png':
+        key = ('ranked_distribution', json.dumps(distribution, sort_keys=True))
+        image = render_pool.submit(key, queries.ranked_distribution_png, distribution).result()
+        return Response(image, mimetype='image/png')
+    return jsonify(distribution)
 
+@app.route('/timeline', methods=['GET'])
+@cached_view
+def get_timeline():
+    """
+    Endpoint to get the flow, packet and byte volumes and the attack ratio
+    (Tag) per time interval of startDateTime, computed by a date_histogram
+    (read from the rollup index when the interval is whole hours).
+    Parameters:
+    - protocol, application, origin, direction: filters (see DIMENSION_FIELDS)
+    - from, to: ISO dates (UTC) or epoch milliseconds, to excluded (default: first and last flow)
+    - points: maximum number of intervals (TIMELINE_POINTS by default, at most
+      TIMELINE_MAX_POINTS); the finest interval of TIMELINE_INTERVALS that fits is used
+    """
+    try:
+        filters, start, end, points = queries.timeline_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rollup = stats_rollup() and queries.whole_hours(start, end)
+    if start is None or end is None:
+        search_kwargs, parse = queries.timeline_bounds(filters, start, end, rollup)
+        try:
+            bounds = parse(search(**{'index': index_name, **search_kwargs}))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        if bounds is None:
+            return jsonify(queries.EMPTY_TIMELINE)
+        start, end = bounds
+
+    return run_query(queries.timeline(filters, start, end, points, rollup))
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="API d'accès aux données")
+    parser.add_argument(
+        '--store',
+        help="Servir un stockage colonnaire (ex. data/flow_store) avec le moteur embarqué, sans Elasticsearch",
+    )
+    parser.add_argument(
+        '--slow-query-seconds',
+        type=float,
+        help="Journaliser les recherches plus longues (secondes)",
+    )
+    parser.add_argument(
+        '--slow-query-log',
+        help=f"Journal des recherches lentes (par défaut {SLOW_QUERY_LOG}, dans le dossier de api_metrics.py)",
+    )
+    args = parser.parse_args()
+
+    if args.slow_query_seconds is not None:
+        metrics.slow_query_seconds = args.slow_query_seconds
+    if args.slow_query_log:
+        # Chemin donné en ligne de commande : relatif au dossier courant
+        metrics.slow_query_log = os.path.abspath(args.slow_query_log)
+
+    if args.store:
+        # Mêmes requêtes, exécutées par flow_engine.py (voir elasticsearch_to_df.py pour l'export)
+        es = FlowEngine(args.store)
+        STATS_FROM_ROLLUP = False
+
     app.run(debug=True)
\ No newline at end of file
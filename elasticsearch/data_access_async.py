@@ -0,0 +1,469 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (asynchronous server)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Variante asynchrone (ASGI) de data_access.py : mêmes routes et mêmes
+réponses (requêtes de flow_queries.py), servies par Quart avec un client
+AsyncElasticsearch partagé. Une requête en attente d'Elasticsearch n'occupe
+aucun worker : le débit suit la capacité d'Elasticsearch et non le nombre de
+workers.
+
+Dépendances : pip install quart hypercorn "elasticsearch[async]"
+Lancement : hypercorn data_access_async:app --bind 127.0.0.1:5000
+"""
+
+import asyncio
+import json
+import time
+from functools import wraps
+from elasticsearch import AsyncElasticsearch
+from quart import Quart, Response, g, jsonify, request, stream_with_context
+import flow_queries as queries
+from api_metrics import ApiMetrics
+from flow_rollup import rollup_usable
+from render_pool import RenderPool
+from response_cache import ResponseCache
+
+index_name = "flow_data_index"
+
+# Spécifiez les URL des nœuds Elasticsearch (peut être un seul ou une liste de nœuds)
+hosts = ["http://localhost:9200"]  # Exemple pour un nœud local
+
+# Pool de connexions HTTP par nœud, partagé par toutes les requêtes
+CONNECTIONS_PER_NODE = 32
+
+# Requêtes Elasticsearch simultanées au plus : les suivantes attendent leur tour
+MAX_CONCURRENT_SEARCHES = 16
+
+# Délais (secondes) : requête Elasticsearch, puis requête HTTP complète (504)
+ES_REQUEST_TIMEOUT = 25
+REQUEST_TIMEOUT = 30
+
+# Cache des réponses (voir data_access.py) ; la génération de l'index est
+# relue en tâche de fond toutes les GENERATION_INTERVAL secondes
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 256
+GENERATION_INTERVAL = 1.0
+
+# Recherches journalisées au-delà de SLOW_QUERY_SECONDS (None : désactivé),
+# dans SLOW_QUERY_LOG (chemin relatif au dossier de api_metrics.py)
+SLOW_QUERY_SECONDS = None
+SLOW_QUERY_LOG = "data/slow_queries.jsonl"
+
+app = Quart("API d'acces aux donnees (async)")
+cache = ResponseCache(None, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+metrics = ApiMetrics(
+    slow_query_seconds=SLOW_QUERY_SECONDS, slow_query_log=SLOW_QUERY_LOG
+)
+render_pool = RenderPool()
+
+# Créés au démarrage du serveur, dans sa boucle d'événements
+es = None
+search_slots = None
+generation_task = None
+
+
+async def index_generation():
+    stats = await es.indices.stats(
+        index=[index_name, queries.ROLLUP_INDEX + "*"], metric=["docs", "indexing"]
+    )
+    return queries.index_generation(stats)
+
+
+async def watch_generation():
+    while True:
+        try:
+            cache.set_generation(await index_generation())
+        except Exception:
+            # Elasticsearch indisponible : le cache n'est plus utilisé
+            cache.set_generation(None)
+        await asyncio.sleep(GENERATION_INTERVAL)
+
+
+@app.before_serving
+async def startup():
+    global es, search_slots, generation_task
+    es = AsyncElasticsearch(
+        hosts=hosts,
+        connections_per_node=CONNECTIONS_PER_NODE,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        max_retries=3,
+        retry_on_timeout=True,
+    )
+    search_slots = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+    generation_task = asyncio.create_task(watch_generation())
+
+
+@app.after_serving
+async def shutdown():
+    generation_task.cancel()
+    render_pool.shutdown()
+    metrics.close()
+    await es.close()
+
+
+def route_name():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+async def start_request_metrics():
+    g.metrics_started = metrics.request_started()
+
+
+@app.after_request
+async def record_request_metrics(response):
+    # Voir data_access.record_request_metrics
+    metrics.request_finished(
+        route_name(),
+        g.pop("metrics_started"),
+        response.status_code,
+        response.content_length,
+    )
+    return response
+
+
+@app.teardown_request
+async def record_failed_request_metrics(exception):
+    if "metrics_started" in g:
+        metrics.request_finished(route_name(), g.pop("metrics_started"), 500)
+
+
+async def search(**kwargs):
+    # Toutes les recherches passent par le sémaphore (limite de concurrence) ;
+    # l'attente d'une place n'est pas comptée dans le surcoût client
+    async with search_slots:
+        started = time.perf_counter()
+        try:
+            result = await es.search(**kwargs)
+        except Exception:
+            metrics.search_failed(route_name())
+            raise
+    metrics.search_done(
+        route_name(), time.perf_counter() - started, result["took"], kwargs
+    )
+    return result
+
+
+# Voir data_access.STATS_FROM_ROLLUP
+STATS_FROM_ROLLUP = True
+
+
+async def stats_rollup():
+    if not STATS_FROM_ROLLUP:
+        return False
+    try:
+        indices = await es.indices.get(
+            index=[index_name, queries.ROLLUP_INDEX], ignore_unavailable=True
+        )
+        return rollup_usable(indices, queries.ROLLUP_INDEX)
+    except Exception:
+        return False
+
+
+async def run_query(query):
+    # Exécute une requête de flow_queries et renvoie sa réponse mise en forme
+    search_kwargs, parse = query
+    try:
+        result = await search(**{"index": index_name, **search_kwargs})
+        started = time.perf_counter()
+        response = jsonify(parse(result))
+        metrics.serialized(route_name(), time.perf_counter() - started)
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def with_timeout(view):
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await asyncio.wait_for(view(*args, **kwargs), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            return jsonify({"error": "Request timed out"}), 504
+
+    return wrapper
+
+
+def cached_view(view):
+    # Comme data_access.cached_view ; les réponses en cache ne subissent aucun délai
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        cached, generation = cache.lookup(key)
+        if cached is not None:
+            data, status, mimetype = cached
+            return Response(data, status=status, mimetype=mimetype)
+
+        response = await app.make_response(await view(*args, **kwargs))
+        if response.status_code == 200:
+            data = await response.get_data()
+            cache.put(key, (data, response.status_code, response.mimetype), generation)
+        return response
+
+    return wrapper
+
+
+# Routes d'agrégation sans paramètre : {route: requête(rollup)}
+AGGREGATION_ROUTES = {
+    "/distinct_protocols": lambda rollup: queries.distinct_values(
+        "protocolName", rollup
+    ),
+    "/flows_count_by_protocol": lambda rollup: queries.value_counts(
+        "protocolName", rollup
+    ),
+    "/payload_sizes_by_protocol": lambda rollup: queries.value_sums(
+        "protocolName", queries.LEGACY_SUMS["payload_sizes"], rollup
+    ),
+    "/bytes_sizes_by_protocol": lambda rollup: queries.value_sums(
+        "protocolName", queries.LEGACY_SUMS["bytes_sizes"], rollup
+    ),
+    "/packets_by_protocol": lambda rollup: queries.value_sums(
+        "protocolName", queries.LEGACY_SUMS["packets"], rollup
+    ),
+    "/distinct_applications": lambda rollup: queries.distinct_values("appName", rollup),
+    "/flows_count_by_application": lambda rollup: queries.value_counts(
+        "appName", rollup
+    ),
+    "/payload_sizes_by_application": lambda rollup: queries.value_sums(
+        "appName", queries.LEGACY_SUMS["payload_sizes"], rollup
+    ),
+    "/bytes_sizes_by_application": lambda rollup: queries.value_sums(
+        "appName", queries.LEGACY_SUMS["bytes_sizes"], rollup
+    ),
+    "/packets_by_application": lambda rollup: queries.value_sums(
+        "appName", queries.LEGACY_SUMS["packets"], rollup
+    ),
+    "/get_flows_and_packets": lambda rollup: queries.totals(
+        {"total_flows": "flows_field", "total_packets": "packets_field"}
+    ),
+}
+
+
+def aggregation_view(query):
+    async def view():
+        return await run_query(query(await stats_rollup()))
+
+    return view
+
+
+for rule, query in AGGREGATION_ROUTES.items():
+    app.add_url_rule(
+        rule,
+        rule.strip("/"),
+        cached_view(with_timeout(aggregation_view(query))),
+        methods=["GET"],
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+async def get_metrics():
+    return Response(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.route("/cache_stats", methods=["GET"])
+async def get_cache_stats():
+    return jsonify(cache.stats())
+
+
+@app.route("/flows_by_protocol", methods=["GET"])
+@cached_view
+@with_timeout
+async def get_flows_by_protocol():
+    protocol = request.args.get("protocol")
+    if not protocol:
+        return jsonify({"error": "Protocol parameter is missing"}), 400
+
+    return await run_query(queries.matching_flows("protocolName", protocol))
+
+
+@app.route("/flows_by_application", methods=["GET"])
+@cached_view
+@with_timeout
+async def get_flows_by_application():
+    application_name = request.args.get("application")
+    if not application_name:
+        return (
+            jsonify(
+                {
+                    "error": "Please provide an 'application_name' parameter in the query."
+                }
+            ),
+            400,
+        )
+
+    return await run_query(
+        queries.matching_flows("appName", application_name, with_ids=True)
+    )
+
+
+@app.route("/summary_by_<dimension>", methods=["GET"])
+@cached_view
+@with_timeout
+async def get_summary(dimension):
+    if dimension not in queries.DIMENSION_FIELDS:
+        return jsonify({"error": f"Unknown dimension: {dimension}"}), 404
+    try:
+        fields, size, after = queries.summary_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return await run_query(
+        queries.summary(dimension, fields, size, after, rollup=await stats_rollup())
+    )
+
+
+@app.route("/summary", methods=["GET"])
+@cached_view
+@with_timeout
+async def get_summaries():
+    # Les quatre agrégations sont indépendantes : elles partent en même temps
+    try:
+        fields, size, _ = queries.summary_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    dimensions = list(queries.DIMENSION_FIELDS)
+    rollup = await stats_rollup()
+    summaries = [
+        queries.summary(dimension, fields, size, rollup=rollup)
+        for dimension in dimensions
+    ]
+    try:
+        results = await asyncio.gather(
+            *(
+                search(**{"index": index_name, **search_kwargs})
+                for search_kwargs, _ in summaries
+            )
+        )
+        return jsonify(
+            {
+                dimension: parse(result)
+                for dimension, (_, parse), result in zip(dimensions, summaries, results)
+            }
+        )
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/flows_stream", methods=["GET"])
+async def get_flows_stream():
+    # Voir data_access.get_flows_stream
+    try:
+        limit, source, cursor, query = queries.stream_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if cursor is not None:
+        pit_id, search_after = cursor["pit"], cursor["after"]
+    else:
+        search_after = None
+        try:
+            pit = await es.open_point_in_time(
+                index=index_name, keep_alive=queries.STREAM_KEEP_ALIVE
+            )
+            pit_id = pit["id"]
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @stream_with_context
+    async def generate(pit_id, search_after):
+        sent = 0
+        # Fermé en sortie (fin, erreur, client déconnecté), sauf si le curseur
+        # _next a été envoyé
+        keep_open = False
+        try:
+            while limit is None or sent < limit:
+                size = queries.STREAM_PAGE_SIZE
+                if limit is not None:
+                    size = min(size, limit - sent)
+                result = await search(
+                    **queries.stream_page(pit_id, query, search_after, size, source)
+                )
+                pit_id = result.get("pit_id", pit_id)
+                hits = result["hits"]["hits"]
+                if not hits:
+                    break
+                yield queries.ndjson_page(hits).encode("utf-8")
+                sent += len(hits)
+                search_after = hits[-1]["sort"]
+                if len(hits) < size:
+                    break
+            else:
+                # Limite atteinte : le point-in-time reste ouvert pour la suite
+                cursor = {"pit": pit_id, "after": search_after}
+                yield queries.ndjson_line(
+                    {"_next": queries.encode_cursor(cursor)}
+                ).encode("utf-8")
+                keep_open = True
+        except Exception as e:
+            yield queries.ndjson_line({"_error": str(e)}).encode("utf-8")
+        finally:
+            if not keep_open:
+                try:
+                    await es.close_point_in_time(id=pit_id)
+                except Exception:
+                    # Déjà expiré ou fermé : keep_alive le libère de toute façon
+                    pass
+
+    return Response(generate(pit_id, search_after), mimetype="application/x-ndjson")
+
+
+@app.route("/ranked_distribution", methods=["GET"])
+@cached_view
+@with_timeout
+async def get_ranked_distribution():
+    # Voir data_access.get_ranked_distribution
+    output = request.args.get("format", "json")
+    if output not in ("json", "png"):
+        return jsonify({"error": "format must be json or png"}), 400
+
+    search_kwargs, parse = queries.ranked_distribution()
+    try:
+        distribution = parse(await search(index=index_name, **search_kwargs))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    if output == "png":
+        # Rendu dans le pool de processus : la boucle d'événements n'attend pas
+        key = ("ranked_distribution", json.dumps(distribution, sort_keys=True))
+        image = await asyncio.wrap_future(
+            render_pool.submit(key, queries.ranked_distribution_png, distribution)
+        )
+        return Response(image, mimetype="image/png")
+    return jsonify(distribution)
+
+
+@app.route("/timeline", methods=["GET"])
+@cached_view
+@with_timeout
+async def get_timeline():
+    # Voir data_access.get_timeline
+    try:
+        filters, start, end, points = queries.timeline_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rollup = await stats_rollup() and queries.whole_hours(start, end)
+    if start is None or end is None:
+        search_kwargs, parse = queries.timeline_bounds(filters, start, end, rollup)
+        try:
+            bounds = parse(await search(**{"index": index_name, **search_kwargs}))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        if bounds is None:
+            return jsonify(queries.EMPTY_TIMELINE)
+        start, end = bounds
+
+    return await run_query(queries.timeline(filters, start, end, points, rollup))
+
+
+if __name__ == "__main__":
+    app.run()
@@ -6,64 +6,238 @@ Authors: MONNIER Killian & BAKKARI Ikrame
 Date: 10/2023
 """
 
+import argparse
+import time
+from collections import deque
+from contextlib import contextmanager
 from elasticsearch import Elasticsearch, helpers
-from data_loading import all_flow_data
+from data_loading import iter_flow_records, list_xml_files, xml_files_dir
+from flow_index import put_flow_template
+from flow_rollup import (
+    ROLLUP_INDEX,
+    FlowRollup,
+    create_rollup_index,
+    delete_rollup_index,
+    finish_rollup,
+)
 
-# Spécifiez les URL des nœuds Elasticsearch (peut être un seul ou une liste de nœuds)
-hosts = ["http://localhost:9200"]  # Exemple pour un nœud local
+# Nombre de flux par requête bulk et nombre de threads d'indexation
+CHUNK_SIZE = 2000
+THREAD_COUNT = 4
 
-# Initialisez Elasticsearch en spécifiant les hôtes
-es = Elasticsearch(hosts=hosts)
+# Fréquence de l'affichage de la progression (en documents)
+PROGRESS_EVERY = 100000
 
-# Appliquez les options de transport à l'objet Elasticsearch
-es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
 
-# Spécifiez l'index Elasticsearch et le type de document
-index_name = "flow_data_index"
+def iter_actions(flows, index_name):
+    # Les actions sont produites au fil de la lecture : rien n'est gardé en mémoire
+    for flow in flows:
+        yield {
+            "_op_type": "index",  # Opération d'indexation
+            "_index": index_name,  # Remplacez par le nom de votre index
+            "_source": flow,  # Les données de votre flux
+        }
 
-# Supprimez l'index existant (attention, cela supprime toutes les données de l'index)
-es.indices.delete(
-    index=index_name, ignore=[400, 404]
-)  # Ignore les erreurs 400 et 404 si l'index n'existe pas
 
-# Indexez les données de flux dans Elasticsearch
-actions = []
-
-for flow in all_flow_data:
-    action = {
-        "_op_type": "index",  # Opération d'indexation
-        "_index": index_name,  # Remplacez par le nom de votre index
-        "_source": flow,  # Les données de votre flux
+@contextmanager
+def bulk_load_settings(es, index_name):
+    """
+    Pendant le chargement : pas de rafraîchissement ni de réplique (chaque
+    document n'est indexé qu'une fois, sans segments intermédiaires).
+    Les réglages d'origine sont restaurés à la sortie, même en cas d'erreur.
+    """
+    settings = es.indices.get_settings(
+        index=index_name, include_defaults=True, flat_settings=True
+    )[index_name]
+    original = {
+        key: settings["settings"].get(key, settings["defaults"].get(key))
+        for key in ("index.refresh_interval", "index.number_of_replicas")
     }
-    actions.append(action)
-
-print(f"Nombre d'actions : {len(actions)}")
-
-# Utilisez helpers.bulk() pour indexer les actions en une seule opération
-success, failed = helpers.bulk(
-    es, actions, index=index_name
-)  # Remplacez par le nom de votre index
-
-print(f"Documents indexes avec succes : {success}")
-print(f"Echecs d'indexation : {failed}")
-
-# You can now search and retrieve data from Elasticsearch as needed
-# For example, search for all flows with a source port of 80
-# Note that the port field is stored as a string, so we need to use a string query
-# See https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-query-string-query.html
-
-# Define the query
-# query = {
-#     "query": {
-#         "query_string": {
-#             "query": "port:80"
-#         }
-#     }
-# }
-
-# Execute the query
-# results = es.search(index=index_name, body=query)
-
-# Print the results
-# print("Nombre de résultats: ", results['hits']['total']['value'])
-# print("Premier résultat: ", results['hits']['hits'][0]['_source'])
+    es.indices.put_settings(
+        index=index_name,
+        settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0},
+    )
+    try:
+        yield
+    finally:
+        es.indices.put_settings(index=index_name, settings=original)
+        es.indices.refresh(index=index_name)
+
+
+def index_flows(
+    es,
+    flows,
+    index_name,
+    chunk_size=CHUNK_SIZE,
+    thread_count=THREAD_COUNT,
+    rollup=None,
+):
+    """
+    Indexe les flux (itérable de dictionnaires) avec thread_count connexions
+    bulk parallèles de chunk_size documents. Les documents refusés sont
+    comptés (et le premier affiché) sans interrompre le chargement.
+    Avec rollup (FlowRollup), chaque flux indexé est ajouté à l'index de
+    synthèse, mis à jour au fil du chargement.
+    Renvoie (indexés, refusés).
+    """
+    success = 0
+    rejected = 0
+    start = time.perf_counter()
+
+    # Les résultats arrivent dans l'ordre des actions : les flux en attente de
+    # réponse sont gardés (au plus quelques chunks) pour la synthèse
+    in_flight = deque()
+
+    def tracked(flows):
+        for flow in flows:
+            in_flight.append(flow)
+            yield flow
+
+    if rollup is not None:
+        flows = tracked(flows)
+
+    for ok, info in helpers.parallel_bulk(
+        es,
+        iter_actions(flows, index_name),
+        thread_count=thread_count,
+        chunk_size=chunk_size,
+        raise_on_error=False,
+    ):
+        if rollup is not None:
+            flow = in_flight.popleft()
+            if ok:
+                rollup.add(flow)
+                rollup.maybe_flush(es)
+        if ok:
+            success += 1
+        else:
+            if rejected == 0:
+                print(f"Document refusé : {info}")
+            rejected += 1
+
+        done = success + rejected
+        if done % PROGRESS_EVERY == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{done} documents ({done / elapsed:.0f} doc/s, {rejected} refusés)")
+
+    if rollup is not None:
+        rollup.flush(es)
+        es.indices.refresh(index=rollup.index)
+        if rollup.failed:
+            print(
+                f"Synthèse {rollup.index} incomplète : {rollup.failed} groupes refusés "
+                f"(python flow_rollup.py --rebuild {index_name})"
+            )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{success + rejected} documents en {elapsed:.1f} s "
+        f"({(success + rejected) / max(elapsed, 1e-9):.0f} doc/s)"
+    )
+    return success, rejected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexation des flux XML")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Nombre de flux par requête bulk",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=THREAD_COUNT,
+        help="Nombre de threads d'indexation",
+    )
+    parser.add_argument(
+        "--no-rollup",
+        action="store_true",
+        help=f"Ne pas tenir à jour l'index de synthèse {ROLLUP_INDEX}",
+    )
+    parser.add_argument(
+        "--force-merge",
+        action="store_true",
+        help="Fusionner l'index en un segment après le chargement",
+    )
+    args = parser.parse_args()
+
+    # Spécifiez les URL des nœuds Elasticsearch (peut être un seul ou une liste de nœuds)
+    hosts = ["http://localhost:9200"]  # Exemple pour un nœud local
+
+    # Initialisez Elasticsearch en spécifiant les hôtes
+    es = Elasticsearch(hosts=hosts)
+
+    # Appliquez les options de transport à l'objet Elasticsearch
+    es = es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
+
+    # Spécifiez l'index Elasticsearch et le type de document
+    index_name = "flow_data_index"
+
+    # Supprimez l'index existant (attention, cela supprime toutes les données de l'index)
+    # Après une migration (flow_index.py --swap), le nom est un alias
+    if es.indices.exists_alias(name=index_name):
+        es.indices.delete(index=list(es.indices.get_alias(name=index_name)))
+    es.options(ignore_status=[400, 404]).indices.delete(
+        index=index_name
+    )  # Ignore les erreurs 400 et 404 si l'index n'existe pas
+
+    # Mapping typé et conversion des champs à l'ingestion (voir flow_index.py)
+    put_flow_template(es)
+    es.indices.create(index=index_name)
+
+    # Synthèse par groupe, recréée avec l'index (voir flow_rollup.py) ;
+    # sans synthèse, l'ancienne est supprimée (elle décrit les flux supprimés)
+    rollup = None
+    if args.no_rollup:
+        delete_rollup_index(es)
+    else:
+        create_rollup_index(es)
+        rollup = FlowRollup()
+
+    # Indexez les données de flux dans Elasticsearch
+    # Les flux sont lus en flux depuis les fichiers XML, sans tout charger en mémoire
+    flows = iter_flow_records(list_xml_files(xml_files_dir))
+    with bulk_load_settings(es, index_name):
+        success, failed = index_flows(
+            es,
+            flows,
+            index_name,
+            chunk_size=args.chunk_size,
+            thread_count=args.threads,
+            rollup=rollup,
+        )
+
+    # Synthèse utilisée par l'API seulement si aucun groupe n'a été refusé
+    if rollup is not None and not rollup.failed:
+        finish_rollup(es, index_name)
+
+    if args.force_merge:
+        es.options(request_timeout=3600).indices.forcemerge(
+            index=index_name, max_num_segments=1
+        )
+
+    print(f"Documents indexes avec succes : {success}")
+    print(f"Echecs d'indexation : {failed}")
+
+    # You can now search and retrieve data from Elasticsearch as needed
+    # For example, search for all flows with a source port of 80
+    # Note that the port field is stored as a string, so we need to use a string query
+    # See https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-query-string-query.html
+
+    # Define the query
+    # query = {
+    #     "query": {
+    #         "query_string": {
+    #             "query": "port:80"
+    #         }
+    #     }
+    # }
+
+    # Execute the query
+    # results = es.search(index=index_name, body=query)
+
+    # Print the results
+    # print("Nombre de résultats: ", results['hits']['total']['value'])
+    # print("Premier résultat: ", results['hits']['hits'][0]['_source'])
@@ -7,51 +7,313 @@ Date: 10/2023
 """
 
 import os
+import sys
 import glob
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from lxml import etree
 import pandas as pd
 
+# Ajouter le dossier parent au sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_store import (
+    SCHEMA_FILE,
+    merge_flow_stores,
+    read_flow_store,
+    write_flow_store,
+)
+
+# Nombre de flux par DataFrame produit par iter_flow_chunks
+CHUNK_SIZE = 50000
+
+# Version de l'analyse XML : à incrémenter dès que le résultat de l'analyse
+# change, pour invalider le cache d'analyse
+PARSER_VERSION = 1
+
+# Colonnes converties à la volée dans chaque chunk
+NUMERIC_COLUMNS = [
+    "sourcePort",
+    "destinationPort",
+    "totalSourceBytes",
+    "totalDestinationBytes",
+    "totalSourcePackets",
+    "totalDestinationPackets",
+]
+DATETIME_COLUMNS = ["startDateTime", "stopDateTime"]
+
+# Spécifiez le répertoire contenant les fichiers XML
+xml_files_dir = "data/TRAIN_ENSIBS"
+
+# Cache d'analyse : un stockage colonnaire par fichier XML, indexé par son contenu
+parse_cache_dir = "data/parse_cache"
+MANIFEST_FILE = "manifest.json"
+
+
+def list_xml_files(directory=xml_files_dir):
+    # Tri pour garantir un ordre de lecture stable d'une exécution à l'autre
+    return sorted(glob.glob(os.path.join(directory, "*.xml")))
+
+
+def iter_xml_records(xml_file):
+    """
+    Parcourt un fichier XML en flux (iterparse) et produit un dictionnaire par flux.
+    Chaque élément est libéré dès qu'il a été lu : la mémoire reste bornée
+    quelle que soit la taille du fichier.
+    """
+    context = etree.iterparse(xml_file, events=("end",))
+
+    for _, element in context:
+        parent = element.getparent()
+        # Les flux sont les enfants directs de la racine
+        if parent is None or parent.getparent() is not None:
+            continue
+
+        yield {child.tag: child.text for child in element}
+
+        # Libérer le flux et les frères déjà traités
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+    del context
+
 
 # Définir une fonction pour analyser un fichier XML et le convertir en liste de dictionnaires
 def parse_xml_file(xml_file):
-    flow_data = []
-    tree = etree.parse(xml_file)
-    root = tree.getroot()
+    return list(iter_xml_records(xml_file))
 
-    for flow_element in root:
-        flow_dict = {}
-        for child in flow_element:
-            flow_dict[child.tag] = child.text
-        flow_data.append(flow_dict)
 
-    return flow_data
+def iter_flow_records(xml_files):
+    # Flux bruts (valeurs texte) avec le champ "origin", fichier par fichier
+    for xml_file in xml_files:
+        origin = os.path.basename(xml_file)  # Obtenez le nom du fichier d'origine
+        for flow in iter_xml_records(xml_file):
+            flow["origin"] = origin
+            yield flow
 
 
-# Spécifiez le répertoire contenant les fichiers XML
-xml_files_dir = "data/TRAIN_ENSIBS"
+def records_to_frame(records, origin=None):
+    # Convertir un lot de flux en DataFrame typé
+    df = pd.DataFrame(records)
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+    for column in DATETIME_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+    if origin is not None:
+        df["origin"] = origin
+    return df
+
+
+def iter_file_chunks(xml_file, chunk_size=CHUNK_SIZE, origin=None):
+    # Découper un fichier en DataFrames typés d'au plus chunk_size flux
+    records = []
+    for flow in iter_xml_records(xml_file):
+        records.append(flow)
+        if len(records) == chunk_size:
+            yield records_to_frame(records, origin)
+            records = []
+    if records:
+        yield records_to_frame(records, origin)
+
+
+def iter_flow_chunks(xml_files, chunk_size=CHUNK_SIZE):
+    """
+    Produit des DataFrames typés d'au plus chunk_size flux, avec la colonne "origin".
+    Un chunk ne couvre jamais deux fichiers.
+    """
+    for xml_file in xml_files:
+        origin = os.path.basename(xml_file)
+        yield from iter_file_chunks(xml_file, chunk_size, origin)
+
+
+def load_flow_df(xml_files, chunk_size=CHUNK_SIZE):
+    # Assembler tous les chunks en un seul DataFrame (utilisé pour flow_df.pkl)
+    chunks = list(iter_flow_chunks(xml_files, chunk_size))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _parse_file_chunks(xml_file, directory, chunk_size):
+    """
+    Exécuté dans un processus de travail : chaque chunk du fichier est écrit
+    en stockage colonnaire (catégories codées, colonnes numériques NumPy)
+    dans directory/chunk-XXXXX, sans la colonne "origin". Seuls les chemins
+    des chunks sont renvoyés au parent, jamais les données.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    chunk_dirs = []
+    for i, chunk in enumerate(iter_file_chunks(xml_file, chunk_size)):
+        chunk_dir = os.path.join(directory, f"chunk-{i:05d}")
+        write_flow_store(chunk, chunk_dir)
+        chunk_dirs.append(chunk_dir)
+    return chunk_dirs
+
+
+def iter_flow_frames_parallel(xml_files, n_workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Analyse chaque fichier XML dans un processus séparé (n_workers processus,
+    os.cpu_count() par défaut) et produit un DataFrame par chunk, dans l'ordre
+    de xml_files, avec la colonne "origin". Les chunks transitent par des
+    stockages colonnaires temporaires, lus puis supprimés un par un.
+    """
+    if not xml_files:
+        return
+    with tempfile.TemporaryDirectory(prefix="parse_") as work_dir:
+        file_dirs = [
+            os.path.join(work_dir, f"file-{i:05d}") for i in range(len(xml_files))
+        ]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # executor.map conserve l'ordre des fichiers : la fusion est déterministe
+            results = executor.map(
+                _parse_file_chunks, xml_files, file_dirs, repeat(chunk_size)
+            )
+            for xml_file, chunk_dirs in zip(xml_files, results):
+                for chunk_dir in chunk_dirs:
+                    frame = read_flow_store(chunk_dir)
+                    frame["origin"] = os.path.basename(xml_file)
+                    yield frame
+                    shutil.rmtree(chunk_dir)
+
+
+def load_flow_df_parallel(xml_files, n_workers=None, chunk_size=CHUNK_SIZE):
+    # Équivalent parallèle de load_flow_df
+    frames = list(iter_flow_frames_parallel(xml_files, n_workers, chunk_size))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def file_digest(file_name, block_size=1 << 20):
+    # Empreinte SHA-256 du contenu du fichier, lu par blocs
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_cache_key(digest):
+    return f"{digest}-p{PARSER_VERSION}"
+
+
+def load_flow_df_cached(
+    xml_files, cache_dir=parse_cache_dir, n_workers=1, chunk_size=CHUNK_SIZE
+):
+    """
+    Comme load_flow_df, mais chaque fichier analysé est conservé dans
+    cache_dir sous une clé (empreinte du contenu, PARSER_VERSION). Seuls les
+    fichiers nouveaux ou modifiés sont analysés (en parallèle si n_workers
+    vaut autre chose que 1). Le manifeste écrit dans cache_dir indique pour
+    chaque fichier si le cache a été réutilisé ("reused") ou non ("parsed").
+    Renvoie le DataFrame et le manifeste.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entries = []
+    to_parse = []
+    for xml_file in xml_files:
+        key = parse_cache_key(file_digest(xml_file))
+        store_dir = os.path.join(cache_dir, key)
+        # schema.json est écrit en dernier : sa présence garantit un cache complet
+        reused = os.path.exists(os.path.join(store_dir, SCHEMA_FILE))
+        entries.append(
+            {
+                "file": os.path.basename(xml_file),
+                "key": key,
+                "status": "reused" if reused else "parsed",
+            }
+        )
+        if not reused:
+            to_parse.append((xml_file, store_dir))
+
+    # Analyse des fichiers manquants, écrite dans un dossier temporaire puis
+    # renommée : un cache interrompu n'est jamais réutilisé
+    parse_files = [xml_file for xml_file, _ in to_parse]
+    chunk_dirs = [f"{store_dir}.chunks" for _, store_dir in to_parse]
+    if to_parse and n_workers == 1:
+        results = map(_parse_file_chunks, parse_files, chunk_dirs, repeat(chunk_size))
+        _write_parse_cache(to_parse, results)
+    elif to_parse:
+        # Pas de pool de processus si tous les fichiers sont déjà en cache
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(
+                _parse_file_chunks, parse_files, chunk_dirs, repeat(chunk_size)
+            )
+            _write_parse_cache(to_parse, results)
+
+    # Assemblage dans l'ordre de xml_files
+    frames = []
+    for entry in entries:
+        frame = read_flow_store(os.path.join(cache_dir, entry["key"]))
+        frame["origin"] = entry["file"]
+        entry["n_rows"] = len(frame)
+        frames.append(frame)
+
+    manifest = {"parser_version": PARSER_VERSION, "files": entries}
+    with open(os.path.join(cache_dir, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    flow_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return flow_df, manifest
+
 
-# Obtenez une liste de tous les fichiers XML du répertoire
-xml_files = glob.glob(os.path.join(xml_files_dir, "*.xml"))
+def _write_parse_cache(to_parse, results):
+    # Chunks d'un fichier fusionnés colonne par colonne dans son stockage de cache
+    for (xml_file, store_dir), chunk_dirs in zip(to_parse, results):
+        tmp_dir = f"{store_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if chunk_dirs:
+            merge_flow_stores(chunk_dirs, tmp_dir)
+        else:
+            write_flow_store(pd.DataFrame(), tmp_dir)
+        shutil.rmtree(f"{store_dir}.chunks", ignore_errors=True)
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.replace(tmp_dir, store_dir)
+        print(f"Analysé : {xml_file}")
 
-# Initialisez une liste vide pour stocker toutes les données de flux
-all_flow_data = []
 
-# Parcourez chaque fichier XML et analysez-le
-for xml_file in xml_files:
-    flow_data = parse_xml_file(xml_file)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chargement des fichiers XML")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Nombre de processus d'analyse (0 = un par cœur, 1 = séquentiel)",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"N'analyser que les fichiers nouveaux ou modifiés (cache dans {parse_cache_dir})",
+    )
+    args = parser.parse_args()
 
-    origin = os.path.basename(xml_file)  # Obtenez le nom du fichier d'origine
-    # Ajoutez le champ "origin" à chaque élément de flow_data
-    for flow in flow_data:
-        flow["origin"] = origin
+    # Obtenez une liste de tous les fichiers XML du répertoire
+    xml_files = list_xml_files(xml_files_dir)
 
-    all_flow_data.extend(flow_data)
+    # Convertir en DataFrame
+    if args.cache:
+        flow_df, manifest = load_flow_df_cached(
+            xml_files, n_workers=args.workers or None
+        )
+        reused = sum(entry["status"] == "reused" for entry in manifest["files"])
+        print(f"Fichiers réutilisés depuis le cache : {reused}/{len(xml_files)}")
+    elif args.workers == 1:
+        flow_df = load_flow_df(xml_files)
+    else:
+        flow_df = load_flow_df_parallel(xml_files, n_workers=args.workers or None)
 
-# Convertir en DataFrame
-flow_df = pd.DataFrame(all_flow_data)
+    # Sauvegarder en fichier pickle
+    flow_df.to_pickle("data/flow_df.pkl")
 
-# Sauvegarder en fichier pickle
-flow_df.to_pickle("data/flow_df.pkl")
+    # Et en stockage colonnaire (lu par preprocess_df.py)
+    write_flow_store(flow_df, "data/flow_store")
 
-print("Longueur: ", len(flow_df))
-print(flow_df.head())
+    print("Longueur: ", len(flow_df))
+    print(flow_df.head())
@@ -8,24 +8,41 @@ Date: 10/2023
 @deprecated: Nous utilisons maintenant preprocess_df.py pour encoder les données depuis un fichier pickle (plus rapide).
 """
 
-from elasticsearch import Elasticsearch, helpers
-from datetime import datetime
-from datetime import timedelta
+from elasticsearch import ApiError, Elasticsearch, helpers
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import ipaddress
+import argparse
+import json
 import os
+import queue
 import sys
-
-# Display a warning message
-print(
-    "WARNING: This script will perform operations that may take a significant amount of time. Visit http://localhost:9200/_cat/indices?v to monitor the progress of the indexing operation."
+import threading
+import time
+
+# Ajouter le dossier parent au sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_features import (
+    datetime_parts,
+    decode_tcp_flags,
+    flow_duration,
+    map_ip_to_interval,
 )
 
 pd.set_option("display.max_columns", None)
 pd.set_option("display.max_rows", None)
 
+# Nombre de documents par lot (lecture, encodage et écriture)
+BATCH_SIZE = 5000
+
+# Durée de vie du point-in-time : au-delà, une reprise recommence au début
+KEEP_ALIVE = "30m"
+
+# Point de reprise du ré-encodage
+checkpoint_file = "data/flow_data_enc.checkpoint.json"
 
-def process_df(df):
+
+def process_df(df, date_parts=("year", "month", "day")):
     # Step 2 : Perform conversions on the data
 
     columns_to_convert = [
@@ -46,23 +63,11 @@ def process_df(df):
     df["stopDateTime"] = pd.to_datetime(df["stopDateTime"])
 
     # Calculer la durée entre startDateTime et stopDateTime
-    df["duration"] = df["stopDateTime"] - df["startDateTime"]
-    df["duration"] = df["duration"].apply(lambda x: int(x.total_seconds()))
+    df["duration"] = flow_duration(df["startDateTime"], df["stopDateTime"])
 
     # Step 3: Perform encoding on Categorical Data
 
-    # TODO diviser en 4 numéros
-    # Créer des intervalles pour les adresses IP
-    def map_ip_to_interval(ip):
-        ip = ipaddress.IPv4Address(ip)
-        if ip <= ipaddress.IPv4Address("128.0.0.0"):
-            return "PrivateNetwork"
-        elif ip <= ipaddress.IPv4Address("192.0.0.0"):
-            return "PublicNetwork"
-        elif ip <= ipaddress.IPv4Address("224.0.0.0"):
-            return "MulticastNetwork"
-        else:
-            return "UnknownNetwork"
+    # Les intervalles pour les adresses IP sont calculés par flow_features.map_ip_to_interval
 
     # Créer des intervalles de ports
     port_bins = [0, 1023, 49151, 65535]
@@ -101,7 +106,7 @@ def process_df(df):
     for column in categorical_columns:
         field_name = column.replace("Category", "")
         if column == "sourceCategory" or column == "destinationCategory":
-            df[column] = df[field_name].apply(map_ip_to_interval)
+            df[column] = map_ip_to_interval(df[field_name])
         if column == "sourcePortCategory" or column == "destinationPortCategory":
             df[column] = pd.cut(
                 df[field_name], bins=port_bins, labels=port_labels, include_lowest=True
@@ -128,36 +133,10 @@ def process_df(df):
             )
 
     # Rajouter colonne
-    # Fonction pour extraire l'année
-    def extract_year(dt_list):
-        ret_list = []
-        for dt_str in dt_list:
-            dt_obj = datetime.strptime(str(dt_str), "%Y-%m-%d %H:%M:%S")
-            ret_list.append(dt_obj.year)
-        return ret_list
-
-    # Fonction pour extraire le mois
-    def extract_month(dt_list):
-        ret_list = []
-        for dt_str in dt_list:
-            dt_obj = datetime.strptime(str(dt_str), "%Y-%m-%d %H:%M:%S")
-            ret_list.append(dt_obj.month)
-        return ret_list
-
-    # Fonction pour extraire le jour
-    def extract_day(dt_list):
-        ret_list = []
-        for dt_str in dt_list:
-            dt_obj = datetime.strptime(str(dt_str), "%Y-%m-%d %H:%M:%S")
-            ret_list.append(dt_obj.day)
-        return ret_list
-
-    df["start_year"] = extract_year(df["startDateTime"])
-    df["stop_year"] = extract_year(df["stopDateTime"])
-    df["start_month"] = extract_month(df["startDateTime"])
-    df["stop_month"] = extract_month(df["stopDateTime"])
-    df["start_day"] = extract_day(df["startDateTime"])
-    df["stop_day"] = extract_day(df["stopDateTime"])
+    # Composantes de date (année, mois, jour ; heure et jour de la semaine en option)
+    date_columns = {"startDateTime": "start", "stopDateTime": "stop"}
+    for column, values in datetime_parts(df, date_columns, date_parts).items():
+        df[column] = values
 
     # Step 4: Perform One-Hot Encoding on Categorical Data
     columns_to_encode = ["direction", "protocolName"]
@@ -165,18 +144,22 @@ def process_df(df):
     df = pd.get_dummies(df, columns=columns_to_encode)
 
     # Step 5: Modify the tag
-    df["tag_Attack"] = df["Tag"].apply(lambda x: 1 if x == "Attack" else 0)
+    df["tag_Attack"] = (df["Tag"] == "Attack").astype(np.uint8)
 
     # Step 6: Modify the sourceTCPFlagsDescription and destinationTCPFlagsDescription
     unique_letters = ["F", "S", "R", "P", "A", "N/A"]
+    source_flags = decode_tcp_flags(
+        df["sourceTCPFlagsDescription"], "sourceTCPFlag_", unique_letters
+    )
+    destination_flags = decode_tcp_flags(
+        df["destinationTCPFlagsDescription"], "destinationTCPFlag_", unique_letters
+    )
 
     for letter in unique_letters:
-        df[f"sourceTCPFlag_{letter}"] = df["sourceTCPFlagsDescription"].apply(
-            lambda x: int(letter in x.split(",")) if pd.notna(x) else 0
-        )
-        df[f"destinationTCPFlag_{letter}"] = df["destinationTCPFlagsDescription"].apply(
-            lambda x: int(letter in x.split(",")) if pd.notna(x) else 0
-        )
+        df[f"sourceTCPFlag_{letter}"] = source_flags[f"sourceTCPFlag_{letter}"]
+        df[f"destinationTCPFlag_{letter}"] = destination_flags[
+            f"destinationTCPFlag_{letter}"
+        ]
 
     # Drop the original columns
     columns_to_drop = [
@@ -195,6 +178,8 @@ def process_df(df):
         "sourcePayloadAsUTF",
         "destinationPayloadAsBase64",
         "destinationPayloadAsUTF",
+        "sourcePayloadBytes",
+        "destinationPayloadBytes",
         "sourceTCPFlagsDescription",
         "destinationTCPFlagsDescription",
         "Tag",
@@ -208,7 +193,7 @@ def process_df(df):
     return df
 
 
-def indexing_enc(df_encoded, index_name):
+def indexing_enc(df_encoded, index_name, ids=None):
     # List of columns to keep as strings
     string_columns = ["appName", "origin", "duration"]
 
@@ -230,6 +215,12 @@ def indexing_enc(df_encoded, index_name):
         for flow in flows
     ]
 
+    # Même _id que le document source : réécrire un lot après une reprise
+    # remplace les documents au lieu de les dupliquer
+    if ids is not None:
+        for action, doc_id in zip(actions, ids):
+            action["_id"] = doc_id
+
     # Use helpers.bulk for efficient indexing
     success, failed = helpers.bulk(es, actions, raise_on_error=False)
 
@@ -238,6 +229,8 @@ def indexing_enc(df_encoded, index_name):
         print(f"Failed document: {failure['index']}")
         print(f"Error details: {failure['error']}")
 
+    return success, len(failed)
+
 
 def indexing_csv(df, csv_name):
     # Check if the CSV file already exists
@@ -250,6 +243,341 @@ def indexing_csv(df, csv_name):
         print(f"Data saved to {csv_name}")
 
 
+class StageStats:
+    """
+    Débit d'une étape du pipeline : documents traités et temps passé à
+    travailler (hors attente sur les files), cumulés sur tous ses workers.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, n_docs, seconds):
+        with self.lock:
+            self.docs += n_docs
+            self.busy += seconds
+
+    def report(self, elapsed):
+        per_worker = self.docs / self.busy if self.busy else 0
+        print(
+            f"{self.name:<8} {self.docs} docs, {self.busy:.1f} s de travail, "
+            f"{per_worker:.0f} doc/s par worker, {self.docs / elapsed:.0f} doc/s au total"
+        )
+
+
+class EncodingCheckpoint:
+    """
+    Avancement du ré-encodage, sauvegardé en JSON après chaque lot écrit.
+    Pour chaque tranche, search_after désigne le dernier document d'une suite
+    continue de lots écrits : un lot terminé avant les précédents n'est
+    retenu qu'une fois ceux-ci écrits à leur tour.
+    """
+
+    def __init__(self, file_name, state):
+        self.file_name = file_name
+        self.state = state
+        self.pending = [{} for _ in state["slices"]]
+        self.lock = threading.Lock()
+
+    @classmethod
+    def new(cls, file_name, source_index, target_index, n_slices):
+        state = {
+            "source_index": source_index,
+            "target_index": target_index,
+            "pit_id": None,
+            "completed": False,
+            "slices": [],
+        }
+        checkpoint = cls(file_name, state)
+        checkpoint.reset(n_slices)
+        return checkpoint
+
+    @classmethod
+    def load(cls, file_name):
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, "r") as file:
+            return cls(file_name, json.load(file))
+
+    @property
+    def n_slices(self):
+        return len(self.state["slices"])
+
+    def reset(self, n_slices):
+        # Reprise depuis le début (PIT expiré) : les _id rendent l'écriture idempotente
+        self.state["slices"] = [
+            {"batch": 0, "search_after": None, "docs": 0, "failed": 0}
+            for _ in range(n_slices)
+        ]
+        self.pending = [{} for _ in range(n_slices)]
+
+    def position(self, slice_id):
+        # Prochain lot à lire et curseur search_after correspondant
+        slice_state = self.state["slices"][slice_id]
+        return slice_state["batch"], slice_state["search_after"]
+
+    def batch_done(self, slice_id, batch, search_after, n_docs, n_failed):
+        with self.lock:
+            slice_state = self.state["slices"][slice_id]
+            pending = self.pending[slice_id]
+            pending[batch] = (search_after, n_docs, n_failed)
+            while slice_state["batch"] in pending:
+                search_after, n_docs, n_failed = pending.pop(slice_state["batch"])
+                slice_state["search_after"] = search_after
+                slice_state["docs"] += n_docs
+                slice_state["failed"] += n_failed
+                slice_state["batch"] += 1
+            self.save()
+
+    def update_pit(self, pit_id):
+        # Elasticsearch peut renvoyer un nouvel identifiant de PIT à chaque
+        # réponse : la reprise et la fermeture utilisent le dernier
+        with self.lock:
+            if pit_id is not None and pit_id != self.state["pit_id"]:
+                self.state["pit_id"] = pit_id
+                self.save()
+
+    def save(self):
+        # Écriture atomique : un fichier interrompu n'est jamais relu
+        tmp_file = f"{self.file_name}.tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(tmp_file, self.file_name)
+
+
+def _put(queue_, item, stop):
+    # put() borné qui abandonne si une autre étape a échoué
+    while not stop.is_set():
+        try:
+            queue_.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(queue_, stop):
+    while not stop.is_set():
+        try:
+            return queue_.get(timeout=1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _encode_batch(records):
+    # Exécuté dans un processus encodeur
+    start = time.perf_counter()
+    df_enc = process_df(pd.DataFrame(records))
+    return df_enc, time.perf_counter() - start
+
+
+def _read_slice(slice_id, checkpoint, raw_queue, stop, stats, batch_size):
+    # Lecteur : parcourt une tranche du PIT avec search_after, puis signale
+    # sa fin par None
+    n_slices = checkpoint.n_slices
+    slice_query = {"id": slice_id, "max": n_slices} if n_slices > 1 else None
+    batch, search_after = checkpoint.position(slice_id)
+    pit_id = checkpoint.state["pit_id"]
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        result = es.search(
+            pit={"id": pit_id, "keep_alive": KEEP_ALIVE},
+            slice=slice_query,
+            sort=["_shard_doc"],
+            search_after=search_after,
+            size=batch_size,
+            track_total_hits=False,
+        )
+        # L'identifiant du PIT peut changer d'une réponse à l'autre
+        pit_id = result.get("pit_id", pit_id)
+        checkpoint.update_pit(pit_id)
+        hits = result["hits"]["hits"]
+        stats.add(len(hits), time.perf_counter() - start)
+        if not hits:
+            break
+
+        search_after = hits[-1]["sort"]
+        item = {
+            "slice": slice_id,
+            "batch": batch,
+            "search_after": search_after,
+            "ids": [hit["_id"] for hit in hits],
+            "records": [hit["_source"] for hit in hits],
+        }
+        if not _put(raw_queue, item, stop):
+            return
+        batch += 1
+
+    _put(raw_queue, None, stop)
+
+
+def _dispatch(raw_queue, encoded_queue, executor, stop, n_readers, n_writers):
+    # Soumet chaque lot lu au pool d'encodeurs ; la file encoded_queue étant
+    # bornée, le nombre de lots en cours d'encodage l'est aussi
+    finished = 0
+    while finished < n_readers:
+        item = _get(raw_queue, stop)
+        if item is None:
+            if stop.is_set():
+                return
+            finished += 1
+            continue
+        item["future"] = executor.submit(_encode_batch, item.pop("records"))
+        if not _put(encoded_queue, item, stop):
+            return
+    for _ in range(n_writers):
+        _put(encoded_queue, None, stop)
+
+
+def _write_batches(encoded_queue, checkpoint, stop, encode_stats, write_stats):
+    # Écrivain : attend l'encodage d'un lot puis l'indexe dans l'index cible
+    target_index = checkpoint.state["target_index"]
+    while True:
+        item = _get(encoded_queue, stop)
+        if item is None:
+            return
+        df_enc, encode_time = item["future"].result()
+        encode_stats.add(len(df_enc), encode_time)
+
+        start = time.perf_counter()
+        success, n_failed = indexing_enc(df_enc, target_index, item["ids"])
+        write_stats.add(success, time.perf_counter() - start)
+        checkpoint.batch_done(
+            item["slice"], item["batch"], item["search_after"], success, n_failed
+        )
+
+
+def _run_stage(target, args, stop, errors):
+    # Une exception dans une étape arrête tout le pipeline
+    try:
+        target(*args)
+    except BaseException as error:
+        errors.append(error)
+        stop.set()
+
+
+def _open_pit(checkpoint):
+    # Réutilise le PIT du point de reprise s'il existe encore, sinon en ouvre
+    # un nouveau et recommence toutes les tranches depuis le début
+    pit_id = checkpoint.state["pit_id"]
+    if pit_id is not None:
+        try:
+            result = es.search(pit={"id": pit_id, "keep_alive": KEEP_ALIVE}, size=0)
+            checkpoint.update_pit(result.get("pit_id"))
+            return
+        except ApiError:
+            print("Point-in-time expiré : reprise depuis le début des tranches")
+            checkpoint.reset(checkpoint.n_slices)
+    checkpoint.state["pit_id"] = es.open_point_in_time(
+        index=checkpoint.state["source_index"], keep_alive=KEEP_ALIVE
+    )["id"]
+    checkpoint.save()
+
+
+def run_pipeline(
+    checkpoint, n_encoders=None, n_writers=2, batch_size=BATCH_SIZE, queue_size=4
+):
+    """
+    Ré-encode l'index source dans l'index cible du point de reprise :
+    - un lecteur par tranche du PIT (checkpoint.n_slices threads) ;
+    - un pool de n_encoders processus exécutant process_df ;
+    - n_writers threads d'indexation (helpers.bulk).
+    Les étapes communiquent par des files bornées à queue_size lots.
+    """
+    _open_pit(checkpoint)
+
+    raw_queue = queue.Queue(maxsize=queue_size)
+    encoded_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    read_stats = StageStats("lecture")
+    encode_stats = StageStats("encodage")
+    write_stats = StageStats("écriture")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_encoders) as executor:
+        readers = [
+            threading.Thread(
+                target=_run_stage,
+                args=(
+                    _read_slice,
+                    (slice_id, checkpoint, raw_queue, stop, read_stats, batch_size),
+                    stop,
+                    errors,
+                ),
+            )
+            for slice_id in range(checkpoint.n_slices)
+        ]
+        dispatcher = threading.Thread(
+            target=_run_stage,
+            args=(
+                _dispatch,
+                (
+                    raw_queue,
+                    encoded_queue,
+                    executor,
+                    stop,
+                    len(readers),
+                    n_writers,
+                ),
+                stop,
+                errors,
+            ),
+        )
+        writers = [
+            threading.Thread(
+                target=_run_stage,
+                args=(
+                    _write_batches,
+                    (encoded_queue, checkpoint, stop, encode_stats, write_stats),
+                    stop,
+                    errors,
+                ),
+            )
+            for _ in range(n_writers)
+        ]
+        threads = readers + [dispatcher] + writers
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - start
+
+    for stats in (read_stats, encode_stats, write_stats):
+        stats.report(elapsed)
+    if errors:
+        # Le point de reprise reste sur les derniers lots écrits
+        raise errors[0]
+
+    es.close_point_in_time(id=checkpoint.state["pit_id"])
+    checkpoint.state["completed"] = True
+    checkpoint.save()
+
+
+def new_index_name(enc_index):
+    # Check if the index already exists
+    index_exists = es.indices.exists(index=enc_index)
+
+    # If the index exists, find an available name with a suffix
+    if index_exists:
+        suffix = 1
+        new_enc_index = f"{enc_index}_{suffix}"
+
+        while es.indices.exists(index=new_enc_index):
+            suffix += 1
+            new_enc_index = f"{enc_index}_{suffix}"
+    else:
+        new_enc_index = enc_index
+    return new_enc_index
+
+
 # Specify the Elasticsearch node URLs (can be a single or list of nodes)
 hosts = ["http://localhost:9200"]
 
@@ -257,7 +585,7 @@ hosts = ["http://localhost:9200"]
 es = Elasticsearch(hosts=hosts)
 
 # Appliquez les options de transport à l'objet Elasticsearch
-es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
+es = es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
 
 # Define your Elasticsearch index
 data_index = "flow_data_index"
@@ -265,47 +593,41 @@ data_index = "flow_data_index"
 # Name of the encoded index
 enc_index = "flow_data_enc"
 
-# Check if the index already exists
-index_exists = es.indices.exists(index=enc_index)
 
-# If the index exists, find an available name with a suffix
-if index_exists:
-    suffix = 1
-    new_enc_index = f"{enc_index}_{suffix}"
-
-    while es.indices.exists(index=new_enc_index):
-        suffix += 1
-        new_enc_index = f"{enc_index}_{suffix}"
-else:
-    new_enc_index = enc_index
-
-# Use the new index name for your operations
-print(f"Using index: {new_enc_index}")
-
-# Supprimez l'index existant (attention, cela supprime toutes les données de l'index)
-# es.indices.delete(index=enc_index_name, ignore=[400, 404])
-
-# Initial search request
-result = es.search(index=data_index, query={"match_all": {}}, scroll="2m", size=5000)
-
-# Continue scrolling until no more results
-while len(result["hits"]["hits"]) > 0:
-    # Process the current batch of results and create the DataFrame
-    df = pd.DataFrame(hit["_source"] for hit in result["hits"]["hits"])
-
-    # Process the DataFrame (replace this with your actual processing logic)
-    df_enc = process_df(df)
-
-    # Index the processed DataFrame (replace this with your actual indexing logic)
-    indexing_enc(df_enc, new_enc_index)
-    # indexing_csv(df_enc, "test-11-12.csv")
-    # print(df_enc.head())
-    # break
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ré-encodage de flow_data_index")
+    parser.add_argument("--slices", type=int, default=4, help="Nombre de lecteurs")
+    parser.add_argument(
+        "--encoders",
+        type=int,
+        default=0,
+        help="Nombre de processus encodeurs (0 = un par cœur)",
+    )
+    parser.add_argument("--writers", type=int, default=2, help="Nombre d'écrivains")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignorer le point de reprise et écrire dans un nouvel index",
+    )
+    args = parser.parse_args()
+
+    # Display a warning message
+    print(
+        "WARNING: This script will perform operations that may take a significant amount of time. Visit http://localhost:9200/_cat/indices?v to monitor the progress of the indexing operation."
+    )
+
+    # Reprendre le ré-encodage interrompu plutôt que créer un nouvel index
+    checkpoint = EncodingCheckpoint.load(checkpoint_file)
+    if checkpoint is None or checkpoint.state["completed"] or args.restart:
+        checkpoint = EncodingCheckpoint.new(
+            checkpoint_file, data_index, new_index_name(enc_index), args.slices
+        )
+    else:
+        print(f"Reprise depuis {checkpoint_file}")
 
-    # Use the scroll ID to retrieve the next batch
-    result = es.scroll(scroll_id=result["_scroll_id"], scroll="2m")
+    # Use the new index name for your operations
+    print(f"Using index: {checkpoint.state['target_index']}")
 
-# Close the scroll
-es.clear_scroll(scroll_id=result["_scroll_id"])
+    run_pipeline(checkpoint, n_encoders=args.encoders or None, n_writers=args.writers)
 
-print("Data encoding completed.")
+    print("Data encoding completed.")
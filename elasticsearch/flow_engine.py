@@ -0,0 +1,558 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (embedded columnar engine)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Moteur de requêtes embarqué : exécute les requêtes de flow_queries.py sur un
+stockage colonnaire (flow_store, ouvert en mmap) au lieu d'Elasticsearch.
+FlowEngine expose le sous-ensemble du client Elasticsearch utilisé par
+data_access.py (search, point-in-time, indices.stats) et renvoie des
+réponses de même forme : les routes donnent les mêmes résultats, sans
+cluster (python data_access.py --store data/flow_store).
+
+Les filtres sur les dimensions utilisent des index bitmap (un bitmap
+compressé par valeur) ; les agrégations sont des réductions NumPy par
+groupe (bincount sur les codes des catégories ou des intervalles de temps).
+Différences connues avec Elasticsearch : les percentiles sont exacts (HDR
+approché côté Elasticsearch) et, si le stockage n'a pas de colonne _id,
+l'identifiant d'un flux est son numéro de ligne.
+"""
+
+import fnmatch
+import os
+import sys
+import threading
+from bisect import bisect_right
+import numpy as np
+import pandas as pd
+import flow_queries as queries
+
+# Ajouter le dossier parent au sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flow_store import SCHEMA_FILE, FlowStore
+
+# Dimensions indexées par bitmap
+INDEXED_FIELDS = ["protocolName", "appName", "origin", "direction"]
+
+# Champs date (texte ISO dans le stockage exporté), lus en millisecondes
+DATE_FIELDS = ["startDateTime", "stopDateTime"]
+
+# Bornes d'une requête range (NaN : jamais retenu)
+RANGE_OPERATORS = {
+    "gte": np.greater_equal,
+    "gt": np.greater,
+    "lte": np.less_equal,
+    "lt": np.less,
+}
+
+# Unités de fixed_interval (date_histogram), en millisecondes
+INTERVAL_UNITS = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+
+# Nombre de résultats exact au-delà duquel Elasticsearch renvoie "gte"
+TRACK_TOTAL_HITS = 10000
+
+
+def _json_value(value):
+    # Valeur NumPy -> valeur JSON de _source (None : champ absent)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        # Entiers stockés en flottants à cause des valeurs manquantes
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def _source_fields(columns, source):
+    # Projection _source (True, False, liste ou {"includes", "excludes"})
+    if source is None or source is True:
+        return list(columns)
+    if source is False:
+        return []
+    if isinstance(source, (list, tuple, str)):
+        source = {"includes": [source] if isinstance(source, str) else source}
+    includes = source.get("includes") or ["*"]
+    excludes = source.get("excludes") or []
+    return [
+        name
+        for name in columns
+        if any(fnmatch.fnmatchcase(name, p) for p in includes)
+        and not any(fnmatch.fnmatchcase(name, p) for p in excludes)
+    ]
+
+
+def _interval_millis(interval):
+    # "3h" -> 10800000
+    number = interval.rstrip("smhd")
+    return int(number) * INTERVAL_UNITS[interval[len(number) :]]
+
+
+class BitmapIndex:
+    """
+    Un bitmap (np.packbits, 1 bit par flux) pour chaque valeur d'une colonne
+    catégorielle : un filtre term est un ET logique de bitmaps.
+    """
+
+    def __init__(self, codes, categories):
+        self.n_rows = len(codes)
+        self.positions = {value: code for code, value in enumerate(categories)}
+        self.bitmaps = [np.packbits(codes == code) for code in range(len(categories))]
+
+    def bitmap(self, value):
+        code = self.positions.get(value)
+        if code is None:
+            return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        return self.bitmaps[code]
+
+
+class _Indices:
+    # es.indices : statistiques (génération du cache) et description de l'index
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def get(self, index=None, **ignored):
+        # Pas d'index de synthèse : les statistiques sont calculées sur le stockage
+        return {
+            self.engine.index_name: {
+                "aliases": {},
+                "mappings": {},
+                "settings": {"index": {"uuid": self.engine.uuid}},
+            }
+        }
+
+    def stats(self, index=None, metric=None):
+        engine = self.engine
+        n_rows = len(engine.store)
+        return {
+            "_all": {
+                "primaries": {
+                    "docs": {"count": n_rows, "deleted": 0},
+                    "indexing": {"index_total": n_rows, "delete_total": 0},
+                }
+            },
+            "indices": {engine.index_name: {"uuid": engine.uuid}},
+        }
+
+
+class FlowEngine:
+    """
+    Client compatible Elasticsearch (pour les requêtes de flow_queries.py)
+    sur le stockage colonnaire directory.
+    """
+
+    def __init__(self, directory, indexed_fields=INDEXED_FIELDS):
+        self.store = FlowStore(directory)
+        self.index_name = os.path.basename(os.path.normpath(directory))
+        # Change si le stockage est réécrit : invalide le cache des réponses
+        mtime = os.path.getmtime(os.path.join(directory, SCHEMA_FILE))
+        self.uuid = f"{os.path.abspath(directory)}@{mtime}"
+        self.indexed_fields = [f for f in indexed_fields if self.is_category(f)]
+        self.indices = _Indices(self)
+        self.bitmap_indexes = {}
+        self.date_values = {}
+        self.lock = threading.Lock()
+
+    def is_category(self, field):
+        column = self.store.schema.get(field)
+        return column is not None and column["kind"] == "category"
+
+    def bitmap_index(self, field):
+        # Construit au premier usage, partagé par les threads du serveur
+        with self.lock:
+            if field not in self.bitmap_indexes:
+                self.bitmap_indexes[field] = BitmapIndex(
+                    self.store.array(field), self.store.categories(field)
+                )
+            return self.bitmap_indexes[field]
+
+    def dates(self, field):
+        # Millisecondes depuis l'epoch (float64, NaN si absente ou invalide),
+        # dates sans fuseau lues en UTC comme dans l'index ; calculées au premier usage
+        with self.lock:
+            if field not in self.date_values:
+                dates = pd.to_datetime(
+                    self.store.series(field), errors="coerce", utc=True
+                )
+                millis = (dates.asi8 // 1000000).astype(np.float64)
+                millis[np.asarray(dates.isna())] = np.nan
+                self.date_values[field] = millis
+            return self.date_values[field]
+
+    def values(self, field, runtime_mappings=None):
+        """
+        Valeurs numériques de field (float64, NaN si absent), ou None si le
+        champ n'existe pas. Seul le champ runtime de
+        flow_queries.ranked_distribution est reconnu.
+        """
+        runtime = (runtime_mappings or {}).get(field)
+        if runtime is not None:
+            script = runtime["script"]
+            if script["source"] != queries.TOTAL_PACKETS_SCRIPT:
+                raise ValueError(f"Unsupported runtime field: {field}")
+            total = np.zeros(len(self.store))
+            for name in script["params"]["fields"]:
+                values = self.values(name)
+                if values is not None:
+                    total += np.nan_to_num(values)
+            return total
+
+        column = self.store.schema.get(field)
+        if column is None:
+            return None
+        if field in DATE_FIELDS:
+            return self.dates(field)
+        if column["kind"] != "array":
+            raise ValueError(f"Field {field} is not numeric")
+        return self.store.array(field).astype(np.float64, copy=False)
+
+    def mask(self, query):
+        # Masque des flux retenus (None : tous) pour match_all, term, range
+        # (bornes numériques ou epoch_millis) et bool/filter
+        if not query or "match_all" in query:
+            return None
+        if "term" in query or "range" in query:
+            filters = [query]
+        elif "bool" in query and set(query["bool"]) <= {"filter", "must"}:
+            filters = query["bool"].get("filter", []) + query["bool"].get("must", [])
+        else:
+            raise ValueError(f"Unsupported query: {query}")
+        if not filters:
+            return None
+
+        bitmap = None
+        keep = None
+        for condition in filters:
+            if "range" in condition:
+                ((field, bounds),) = condition["range"].items()
+                values = self.values(field)
+                if values is None:
+                    matches = np.zeros(len(self.store), dtype=bool)
+                else:
+                    matches = np.ones(len(self.store), dtype=bool)
+                    for operator, compare in RANGE_OPERATORS.items():
+                        if operator in bounds:
+                            matches &= compare(values, float(bounds[operator]))
+                keep = matches if keep is None else keep & matches
+                continue
+            if "term" not in condition:
+                raise ValueError(f"Unsupported filter: {condition}")
+            ((field, value),) = condition["term"].items()
+            if isinstance(value, dict):
+                value = value["value"]
+            if field in self.indexed_fields:
+                values = self.bitmap_index(field).bitmap(value)
+                bitmap = values if bitmap is None else bitmap & values
+                continue
+            if field not in self.store.schema:
+                matches = np.zeros(len(self.store), dtype=bool)
+            else:
+                matches = self.store.series(field) == value
+            keep = matches if keep is None else keep & matches
+
+        if bitmap is not None:
+            matches = np.unpackbits(bitmap, count=len(self.store)).astype(bool)
+            keep = matches if keep is None else keep & matches
+        return keep
+
+    def group_codes(self, field):
+        # Codes (-1 : valeur manquante) et valeurs d'une dimension catégorielle
+        if not self.is_category(field):
+            raise ValueError(f"Field {field} is not a keyword dimension")
+        return self.store.array(field), self.store.categories(field)
+
+    def metric(self, aggregation, codes, n_groups, keep, runtime_mappings):
+        """
+        Métrique (sum, min, max ou percentiles) ou agrégation filter par
+        groupe : codes attribue un groupe à chaque flux retenu (None : un
+        seul groupe). Renvoie la liste des résultats, un par groupe.
+        """
+        if "sum" in aggregation:
+            values = self.values(aggregation["sum"]["field"], runtime_mappings)
+            if values is None:
+                return [{"value": 0.0}] * n_groups
+            values = np.nan_to_num(values if keep is None else values[keep])
+            if codes is None:
+                return [{"value": float(values.sum())}]
+            sums = np.bincount(codes, weights=values, minlength=n_groups)
+            return [{"value": float(value)} for value in sums[:n_groups]]
+
+        if "min" in aggregation or "max" in aggregation:
+            kind = "min" if "min" in aggregation else "max"
+            values = self.values(aggregation[kind]["field"], runtime_mappings)
+            if values is None:
+                return [{"value": None}] * n_groups
+            if keep is not None:
+                values = values[keep]
+            reduce = np.min if kind == "min" else np.max
+            results = []
+            groups = (
+                [values]
+                if codes is None
+                else [values[codes == group] for group in range(n_groups)]
+            )
+            for group_values in groups:
+                group_values = group_values[~np.isnan(group_values)]
+                value = float(reduce(group_values)) if len(group_values) else None
+                results.append({"value": value})
+            return results
+
+        if "filter" in aggregation:
+            # Flux du groupe qui vérifient aussi le filtre, puis sous-agrégations
+            rows = np.arange(len(self.store))
+            if keep is not None:
+                rows = rows[keep]
+            matches = self.mask(aggregation["filter"])
+            if matches is not None:
+                selected = matches[rows]
+                rows = rows[selected]
+                if codes is not None:
+                    codes = codes[selected]
+            counts = (
+                [len(rows)] if codes is None else np.bincount(codes, minlength=n_groups)
+            )
+            metrics = {
+                name: self.metric(sub, codes, n_groups, rows, runtime_mappings)
+                for name, sub in aggregation.get("aggs", {}).items()
+            }
+            return [
+                {
+                    "doc_count": int(counts[group]),
+                    **{name: results[group] for name, results in metrics.items()},
+                }
+                for group in range(n_groups)
+            ]
+
+        if "percentiles" in aggregation:
+            spec = aggregation["percentiles"]
+            percents = spec.get("percents", [1, 5, 25, 50, 75, 95, 99])
+            values = self.values(spec["field"], runtime_mappings)
+            if values is None:
+                values = np.empty(0)
+            elif keep is not None:
+                values = values[keep]
+            results = []
+            groups = (
+                [values]
+                if codes is None
+                else [values[codes == group] for group in range(n_groups)]
+            )
+            for group_values in groups:
+                group_values = group_values[~np.isnan(group_values)]
+                if len(group_values):
+                    found = np.percentile(group_values, percents, method="inverted_cdf")
+                else:
+                    found = [None] * len(percents)
+                pairs = [
+                    (p, None if v is None else float(v))
+                    for p, v in zip(percents, found)
+                ]
+                if spec.get("keyed", True):
+                    results.append({"values": {str(float(p)): v for p, v in pairs}})
+                else:
+                    results.append(
+                        {"values": [{"key": p, "value": v} for p, v in pairs]}
+                    )
+            return results
+
+        raise ValueError(f"Unsupported aggregation: {aggregation}")
+
+    def grouped(self, field, aggregations, keep, runtime_mappings):
+        # Nombre de flux et sous-agrégations pour chaque valeur de field
+        codes, categories = self.group_codes(field)
+        if keep is not None:
+            codes = codes[keep]
+        present = codes >= 0
+        codes = codes[present]
+        keep_present = present if keep is None else np.flatnonzero(keep)[present]
+        counts = np.bincount(codes, minlength=len(categories))
+        metrics = {
+            name: self.metric(
+                aggregation, codes, len(categories), keep_present, runtime_mappings
+            )
+            for name, aggregation in aggregations.items()
+        }
+        return categories, counts, metrics
+
+    def bucket(self, key, group, counts, metrics):
+        bucket = {"key": key, "doc_count": int(counts[group])}
+        for name, results in metrics.items():
+            bucket[name] = results[group]
+        return bucket
+
+    def aggregate(self, aggregation, keep, runtime_mappings):
+        sub_aggregations = aggregation.get("aggs", {})
+        if "terms" in aggregation:
+            spec = aggregation["terms"]
+            categories, counts, metrics = self.grouped(
+                spec["field"], sub_aggregations, keep, runtime_mappings
+            )
+            # Ordre d'Elasticsearch : nombre de flux (ou métrique de "order")
+            # décroissant, puis valeur
+            ranking = counts
+            if "order" in spec:
+                ((name, direction),) = spec["order"].items()
+                if direction != "desc" or name not in metrics:
+                    raise ValueError(f"Unsupported terms order: {spec['order']}")
+                ranking = [result["value"] for result in metrics[name]]
+            groups = sorted(
+                (group for group in range(len(categories)) if counts[group] > 0),
+                key=lambda group: (-ranking[group], categories[group]),
+            )
+            size = spec.get("size", 10)
+            return {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": int(sum(counts[g] for g in groups[size:])),
+                "buckets": [
+                    self.bucket(categories[g], g, counts, metrics)
+                    for g in groups[:size]
+                ],
+            }
+
+        if "composite" in aggregation:
+            spec = aggregation["composite"]
+            ((name, source),) = spec["sources"][0].items()
+            categories, counts, metrics = self.grouped(
+                source["terms"]["field"], sub_aggregations, keep, runtime_mappings
+            )
+            groups = sorted(
+                (group for group in range(len(categories)) if counts[group] > 0),
+                key=lambda group: categories[group],
+            )
+            keys = [categories[group] for group in groups]
+            start = bisect_right(keys, spec["after"][name]) if "after" in spec else 0
+            page = groups[start : start + spec.get("size", 10)]
+            result = {
+                "buckets": [
+                    self.bucket({name: categories[g]}, g, counts, metrics) for g in page
+                ]
+            }
+            if page:
+                result["after_key"] = {name: categories[page[-1]]}
+            return result
+
+        if "date_histogram" in aggregation:
+            spec = aggregation["date_histogram"]
+            if spec.get("min_doc_count", 0) != 0:
+                raise ValueError(f"Unsupported date_histogram: {spec}")
+            interval = _interval_millis(spec["fixed_interval"])
+            rows = np.arange(len(self.store))
+            if keep is not None:
+                rows = rows[keep]
+            values = self.values(spec["field"])
+            if values is None:
+                rows, keys = rows[:0], np.empty(0, dtype=np.int64)
+            else:
+                values = values[rows]
+                present = ~np.isnan(values)
+                rows = rows[present]
+                keys = (values[present] // interval).astype(np.int64)
+
+            # Intervalles vides compris, de la première à la dernière clé
+            # (étendues à extended_bounds)
+            ends = [int(keys.min()), int(keys.max())] if len(keys) else []
+            bounds = spec.get("extended_bounds", {})
+            ends += [
+                int(bounds[end]) // interval for end in ("min", "max") if end in bounds
+            ]
+            if not ends:
+                return {"buckets": []}
+            first, last = min(ends), max(ends)
+            codes = keys - first
+            n_groups = last - first + 1
+            counts = np.bincount(codes, minlength=n_groups)
+            metrics = {
+                name: self.metric(sub, codes, n_groups, rows, runtime_mappings)
+                for name, sub in sub_aggregations.items()
+            }
+            return {
+                "buckets": [
+                    self.bucket((first + group) * interval, group, counts, metrics)
+                    for group in range(n_groups)
+                ]
+            }
+
+        if sub_aggregations and "filter" not in aggregation:
+            raise ValueError(f"Unsupported aggregation: {aggregation}")
+        return self.metric(aggregation, None, 1, keep, runtime_mappings)[0]
+
+    def sources(self, rows, source):
+        # _source des flux rows (champs absents omis, comme dans l'index)
+        fields = [f for f in _source_fields(self.store.columns, source) if f != "_id"]
+        columns = {name: self.store.series(name, rows) for name in fields}
+        documents = []
+        for i in range(len(rows)):
+            document = {}
+            for name, values in columns.items():
+                value = _json_value(values[i])
+                if value is not None:
+                    document[name] = value
+            documents.append(document)
+        return documents
+
+    def ids(self, rows):
+        if "_id" in self.store.schema:
+            return [str(value) for value in self.store.series("_id", rows)]
+        return [str(row) for row in rows]
+
+    def search(
+        self,
+        index=None,
+        query=None,
+        aggs=None,
+        size=10,
+        sort=None,
+        search_after=None,
+        source=None,
+        pit=None,
+        track_total_hits=None,
+        runtime_mappings=None,
+        **ignored,
+    ):
+        keep = self.mask(query)
+        n_matches = len(self.store) if keep is None else int(np.count_nonzero(keep))
+
+        rows = np.arange(len(self.store)) if keep is None else np.flatnonzero(keep)
+        if sort is not None:
+            if sort != ["_shard_doc"]:
+                raise ValueError(f"Unsupported sort: {sort}")
+            # Point-in-time : le numéro de ligne sert de clé de tri
+            if search_after:
+                rows = rows[rows > search_after[0]]
+        rows = rows[:size]
+
+        hits = []
+        for hit_id, document, row in zip(
+            self.ids(rows), self.sources(rows, source), rows
+        ):
+            hit = {"_index": self.index_name, "_id": hit_id, "_source": document}
+            if sort is not None:
+                hit["sort"] = [int(row)]
+            hits.append(hit)
+
+        result = {"took": 0, "timed_out": False, "hits": {"hits": hits}}
+        if track_total_hits is not False:
+            limit = TRACK_TOTAL_HITS if track_total_hits is None else track_total_hits
+            if limit is True or n_matches <= limit:
+                result["hits"]["total"] = {"value": n_matches, "relation": "eq"}
+            else:
+                result["hits"]["total"] = {"value": limit, "relation": "gte"}
+        if pit is not None:
+            result["pit_id"] = pit["id"]
+        if aggs:
+            result["aggregations"] = {
+                name: self.aggregate(aggregation, keep, runtime_mappings)
+                for name, aggregation in aggs.items()
+            }
+        return result
+
+    def open_point_in_time(self, index=None, keep_alive=None):
+        # Le stockage ne change pas : le point-in-time est le stockage lui-même
+        return {"id": self.uuid}
+
+    def close_point_in_time(self, id=None):
+        return {"succeeded": True, "num_freed": 1}
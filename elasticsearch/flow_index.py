@@ -0,0 +1,220 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 2 - Data indexing in Elasticsearch (typed index template)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Mapping typé des flux ISCX. Le template s'applique à tout index
+flow_data_index* et lui associe un pipeline d'ingestion qui convertit les
+valeurs texte du XML (ports, octets, paquets) en entiers, supprime les
+champs vides et ajoute la taille décodée des payloads, quel que soit le
+programme qui indexe. Les agrégations peuvent
+ainsi utiliser directement les doc values au lieu de scripts painless.
+"""
+
+import argparse
+import time
+from elasticsearch import Elasticsearch
+
+# Nom du template, du pipeline d'ingestion et motif des index concernés
+TEMPLATE_NAME = "flow_data_template"
+PIPELINE_NAME = "flow_data_coerce"
+INDEX_PATTERNS = ["flow_data_index*"]
+
+LONG_FIELDS = [
+    "sourcePort",
+    "destinationPort",
+    "totalSourceBytes",
+    "totalDestinationBytes",
+    "totalSourcePackets",
+    "totalDestinationPackets",
+]
+IP_FIELDS = ["source", "destination"]
+DATE_FIELDS = ["startDateTime", "stopDateTime"]
+KEYWORD_FIELDS = [
+    "appName",
+    "direction",
+    "protocolName",
+    "sourceTCPFlagsDescription",
+    "destinationTCPFlagsDescription",
+    "Tag",
+    "origin",
+    "sensorInterfaceId",
+    "startTime",
+]
+PAYLOAD_FIELDS = [
+    "sourcePayloadAsBase64",
+    "sourcePayloadAsUTF",
+    "destinationPayloadAsBase64",
+    "destinationPayloadAsUTF",
+]
+
+# Taille décodée (en octets) des payloads base64, calculée à l'ingestion
+PAYLOAD_SIZE_FIELDS = {
+    "sourcePayloadAsBase64": "sourcePayloadBytes",
+    "destinationPayloadAsBase64": "destinationPayloadBytes",
+}
+
+# Formats de date rencontrés : XML ISCX ("2010-06-14T07:16:00") et pandas
+DATE_FORMAT = "strict_date_optional_time||yyyy-MM-dd HH:mm:ss||epoch_millis"
+
+
+def flow_mappings():
+    properties = {}
+    for field in LONG_FIELDS:
+        properties[field] = {"type": "long"}
+    for field in IP_FIELDS:
+        # Adresses invalides ignorées (champ non indexé) plutôt que document refusé
+        properties[field] = {"type": "ip", "ignore_malformed": True}
+    for field in DATE_FIELDS:
+        properties[field] = {
+            "type": "date",
+            "format": DATE_FORMAT,
+            "ignore_malformed": True,
+        }
+    for field in KEYWORD_FIELDS:
+        properties[field] = {"type": "keyword"}
+    for field in PAYLOAD_FIELDS:
+        # Payloads conservés dans _source mais jamais recherchés ni agrégés
+        properties[field] = {"type": "text", "index": False}
+    for field in PAYLOAD_SIZE_FIELDS.values():
+        properties[field] = {"type": "long"}
+    return {"dynamic": True, "properties": properties}
+
+
+# Conversion au moment de l'ingestion : "53932" -> 53932, champs vides supprimés
+COERCE_SCRIPT = """
+for (field in params.long_fields) {
+    def value = ctx[field];
+    if (value instanceof String) {
+        try {
+            ctx[field] = Long.parseLong(value.trim());
+        } catch (NumberFormatException e) {
+            ctx.remove(field);
+        }
+    }
+}
+for (field in params.optional_fields) {
+    if (ctx[field] instanceof String && ctx[field].trim().isEmpty()) {
+        ctx.remove(field);
+    }
+}
+// Octets décodés d'un payload base64 : 3 octets pour 4 caractères, hors
+// remplissage "=" et espaces (sans expression régulière, désactivées par défaut)
+for (entry in params.payload_sizes.entrySet()) {
+    def value = ctx[entry.getKey()];
+    if (value instanceof String) {
+        long n = 0;
+        for (int i = 0; i < value.length(); i++) {
+            char c = value.charAt(i);
+            if (c != (char) '=' && !Character.isWhitespace(c)) {
+                n++;
+            }
+        }
+        ctx[entry.getValue()] = n * 3 / 4;
+    }
+}
+"""
+
+
+def payload_size(value):
+    # Équivalent Python du calcul fait par le pipeline (len(base64.b64decode(value)))
+    n = sum(1 for c in value if c != "=" and not c.isspace())
+    return n * 3 // 4
+
+
+def coerce_pipeline():
+    return {
+        "description": "Conversion des champs des flux ISCX vers le mapping typé",
+        "processors": [
+            {
+                "script": {
+                    "lang": "painless",
+                    "source": COERCE_SCRIPT,
+                    "params": {
+                        "long_fields": LONG_FIELDS,
+                        "optional_fields": IP_FIELDS + DATE_FIELDS,
+                        "payload_sizes": PAYLOAD_SIZE_FIELDS,
+                    },
+                }
+            }
+        ],
+    }
+
+
+def put_flow_template(es):
+    # Installe (ou met à jour) le pipeline puis le template : idempotent
+    es.ingest.put_pipeline(id=PIPELINE_NAME, **coerce_pipeline())
+    es.indices.put_index_template(
+        name=TEMPLATE_NAME,
+        index_patterns=INDEX_PATTERNS,
+        priority=100,
+        template={
+            "settings": {"index.default_pipeline": PIPELINE_NAME},
+            "mappings": flow_mappings(),
+        },
+    )
+
+
+def migrate_index(es, source, dest, swap=False, poll_interval=5):
+    """
+    Recopie source dans dest (typé par le template, converti par le pipeline).
+    Avec swap=True, l'index source est ensuite supprimé et son nom devient un
+    alias de dest : les programmes qui utilisent l'ancien nom continuent de
+    fonctionner.
+    """
+    put_flow_template(es)
+    es.indices.create(index=dest)
+
+    task = es.reindex(
+        source={"index": source},
+        dest={"index": dest},
+        wait_for_completion=False,
+    )["task"]
+    while True:
+        status = es.tasks.get(task_id=task)
+        progress = status["task"]["status"]
+        print(f"Migration : {progress['created']}/{progress['total']} documents")
+        if status["completed"]:
+            break
+        time.sleep(poll_interval)
+
+    failures = status.get("response", {}).get("failures", [])
+    if failures:
+        raise RuntimeError(f"{len(failures)} documents non migrés : {failures[0]}")
+
+    es.indices.refresh(index=dest)
+    if swap:
+        es.indices.delete(index=source)
+        es.indices.put_alias(index=dest, name=source)
+        print(f"{source} est maintenant un alias de {dest}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mapping typé des flux")
+    parser.add_argument(
+        "--migrate",
+        metavar="INDEX",
+        help="Recopier un index existant (mapping dynamique) dans un index typé",
+    )
+    parser.add_argument("--dest", help="Nom de l'index typé (par défaut : INDEX_typed)")
+    parser.add_argument(
+        "--swap",
+        action="store_true",
+        help="Supprimer l'ancien index et réutiliser son nom comme alias",
+    )
+    args = parser.parse_args()
+
+    # Spécifiez les URL des nœuds Elasticsearch (peut être un seul ou une liste de nœuds)
+    hosts = ["http://localhost:9200"]  # Exemple pour un nœud local
+    es = Elasticsearch(hosts=hosts)
+    es = es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
+
+    if args.migrate:
+        migrate_index(
+            es, args.migrate, args.dest or f"{args.migrate}_typed", swap=args.swap
+        )
+    else:
+        put_flow_template(es)
+        print(f"Template {TEMPLATE_NAME} installé pour {INDEX_PATTERNS}")
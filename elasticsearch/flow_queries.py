@@ -0,0 +1,653 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (shared queries)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Requêtes Elasticsearch de l'API, partagées par le serveur Flask
+(data_access.py) et le serveur asynchrone (data_access_async.py). Chaque
+fonction renvoie les arguments de es.search() et la fonction qui met en forme
+la réponse : les deux serveurs envoient exactement les mêmes requêtes et
+renvoient exactement les mêmes résultats.
+"""
+
+import base64
+import io
+import json
+from datetime import datetime, timezone
+from matplotlib.figure import Figure
+from flow_rollup import COUNT_FIELD, ROLLUP_INDEX, ROLLUP_TIME_FIELD
+
+# Dimensions (nom dans l'URL -> champ) et métriques additionnables
+DIMENSION_FIELDS = {
+    "protocol": "protocolName",
+    "application": "appName",
+    "origin": "origin",
+    "direction": "direction",
+}
+SUMMARY_METRICS = {
+    "source_bytes": "totalSourceBytes",
+    "destination_bytes": "totalDestinationBytes",
+    "source_packets": "totalSourcePackets",
+    "destination_packets": "totalDestinationPackets",
+    "source_payload_bytes": "sourcePayloadBytes",
+    "destination_payload_bytes": "destinationPayloadBytes",
+}
+SUMMARY_PAGE_SIZE = 1000
+
+# Lecture en flux des flux : taille des pages et durée de vie du point-in-time
+STREAM_PAGE_SIZE = 1000
+STREAM_KEEP_ALIVE = "5m"
+
+# Payloads exclus par défaut (volumineux) ; fields= permet de les demander
+STREAM_EXCLUDES = ["*PayloadAs*"]
+
+# Sommes des routes historiques : {route: {nom dans la réponse: champ}}
+LEGACY_SUMS = {
+    "payload_sizes": {
+        "total_source_payload_size": "sourcePayloadBytes",
+        "total_destination_payload_size": "destinationPayloadBytes",
+    },
+    "bytes_sizes": {
+        "source_bytes_size": "totalSourceBytes",
+        "destination_bytes_size": "totalDestinationBytes",
+    },
+    "packets": {
+        "total_source_packets": "totalSourcePackets",
+        "total_destination_packets": "totalDestinationPackets",
+    },
+}
+
+
+# Distribution rang/taille : part des flux au-dessus de chaque point, de 1
+# (tous les flux) à 1e-6, dix points par décade
+RANK_FRACTIONS = [10 ** (-k / 10) for k in range(61)]
+
+# Paquets par flux, calculés pour la seule agrégation de /ranked_distribution
+TOTAL_PACKETS_SCRIPT = """
+long packets = 0;
+for (field in params.fields) {
+    if (doc[field].size() > 0) {
+        packets += doc[field].value;
+    }
+}
+emit(packets);
+"""
+
+
+# Séries temporelles de /timeline : date des flux, nombre de points par défaut
+# et maximal, intervalles candidats (millisecondes, du plus fin au plus large)
+TIMELINE_FIELD = "startDateTime"
+TIMELINE_POINTS = 200
+TIMELINE_MAX_POINTS = 1000
+HOUR_MS = 3600 * 1000
+TIMELINE_INTERVALS = [
+    1000,
+    5 * 1000,
+    10 * 1000,
+    30 * 1000,
+    60 * 1000,
+    5 * 60 * 1000,
+    10 * 60 * 1000,
+    30 * 60 * 1000,
+    HOUR_MS,
+    3 * HOUR_MS,
+    6 * HOUR_MS,
+    12 * HOUR_MS,
+    24 * HOUR_MS,
+    7 * 24 * HOUR_MS,
+]
+TIMELINE_SUMS = {
+    "source_packets": "totalSourcePackets",
+    "destination_packets": "totalDestinationPackets",
+    "source_bytes": "totalSourceBytes",
+    "destination_bytes": "totalDestinationBytes",
+}
+
+# Valeur de Tag des flux d'attaque
+ATTACK_TAG = "Attack"
+
+# Réponse de /timeline quand aucun flux ne correspond
+EMPTY_TIMELINE = {"interval": None, "from": None, "to": None, "points": []}
+
+
+def encode_cursor(value):
+    # Curseur opaque transmis au client
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+
+
+def _terms(field, aggs=None, rollup=False):
+    # Agrégation terms ; sur le rollup, un document compte pour COUNT_FIELD flux
+    terms = {"terms": {"field": field}}
+    if rollup:
+        terms["terms"]["order"] = {COUNT_FIELD: "desc"}
+        aggs = {**(aggs or {}), COUNT_FIELD: {"sum": {"field": COUNT_FIELD}}}
+    if aggs:
+        terms["aggs"] = aggs
+    return terms
+
+
+def _flow_count(bucket, rollup):
+    if rollup:
+        return int(bucket[COUNT_FIELD]["value"])
+    return bucket["doc_count"]
+
+
+def _aggregation_search(aggs, rollup):
+    # Recherche sans documents, sur l'index des flux ou sur le rollup
+    search = {"size": 0, "aggs": aggs}
+    if rollup:
+        search["index"] = ROLLUP_INDEX
+    return search
+
+
+def distinct_values(field, rollup=False):
+    # Liste des valeurs distinctes de field (terms, 10 valeurs par défaut)
+    search = _aggregation_search({"values": _terms(field, rollup=rollup)}, rollup)
+
+    def parse(result):
+        return [bucket["key"] for bucket in result["aggregations"]["values"]["buckets"]]
+
+    return search, parse
+
+
+def value_counts(field, rollup=False):
+    # Nombre de flux pour chaque valeur de field
+    search = _aggregation_search({"values": _terms(field, rollup=rollup)}, rollup)
+
+    def parse(result):
+        return {
+            bucket["key"]: _flow_count(bucket, rollup)
+            for bucket in result["aggregations"]["values"]["buckets"]
+        }
+
+    return search, parse
+
+
+def value_sums(field, sums, rollup=False):
+    # Sommes {nom: champ} pour chaque valeur de field
+    aggs = {name: {"sum": {"field": f}} for name, f in sums.items()}
+    search = _aggregation_search({"values": _terms(field, aggs, rollup)}, rollup)
+
+    def parse(result):
+        return {
+            bucket["key"]: {name: bucket[name]["value"] for name in sums}
+            for bucket in result["aggregations"]["values"]["buckets"]
+        }
+
+    return search, parse
+
+
+def matching_flows(field, value, with_ids=False):
+    # Flux dont field vaut value (10 premiers, comme les routes historiques)
+    search = {"query": {"term": {field: value}}}
+
+    def parse(result):
+        hits = result["hits"]["hits"]
+        if with_ids:
+            return [{"_id": hit["_id"], "_source": hit["_source"]} for hit in hits]
+        return [hit["_source"] for hit in hits]
+
+    return search, parse
+
+
+def totals(sums):
+    # Sommes globales {nom: champ}
+    search = {
+        "size": 0,
+        "aggs": {name: {"sum": {"field": f}} for name, f in sums.items()},
+    }
+
+    def parse(result):
+        return {name: result["aggregations"][name]["value"] for name in sums}
+
+    return search, parse
+
+
+def summary_args(args):
+    """
+    Valide les paramètres de /summary_by_<dimension> (fields, size, after).
+    Lève ValueError avec un message destiné au client.
+    """
+    fields = args.get("fields")
+    if fields:
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [f for f in fields if f != "count" and f not in SUMMARY_METRICS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        fields = ["count"] + list(SUMMARY_METRICS)
+
+    try:
+        size = int(args.get("size", SUMMARY_PAGE_SIZE))
+    except ValueError:
+        size = 0
+    if not 1 <= size <= SUMMARY_PAGE_SIZE:
+        raise ValueError(f"size must be between 1 and {SUMMARY_PAGE_SIZE}")
+
+    after = None
+    if args.get("after"):
+        try:
+            after = decode_cursor(args["after"])
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    return fields, size, after
+
+
+def summary(dimension, fields, size=SUMMARY_PAGE_SIZE, after=None, rollup=False):
+    """
+    Nombre de flux et sommes des métriques fields pour chaque valeur de la
+    dimension, en une seule agrégation composite paginée (pas de troncature).
+    Avec rollup=True, les mêmes résultats sont lus dans l'index de synthèse.
+    """
+    composite = {
+        "size": size,
+        "sources": [{dimension: {"terms": {"field": DIMENSION_FIELDS[dimension]}}}],
+    }
+    if after is not None:
+        composite["after"] = after
+    aggs = {
+        metric: {"sum": {"field": SUMMARY_METRICS[metric]}}
+        for metric in fields
+        if metric != "count"
+    }
+    if rollup and "count" in fields:
+        aggs[COUNT_FIELD] = {"sum": {"field": COUNT_FIELD}}
+    search = _aggregation_search(
+        {"summary": {"composite": composite, "aggs": aggs}}, rollup
+    )
+    search["track_total_hits"] = False
+
+    def parse(result):
+        aggregation = result["aggregations"]["summary"]
+        buckets = {}
+        for bucket in aggregation["buckets"]:
+            values = {}
+            for metric in fields:
+                if metric == "count":
+                    values["count"] = _flow_count(bucket, rollup)
+                else:
+                    values[metric] = int(bucket[metric]["value"])
+            buckets[bucket["key"][dimension]] = values
+
+        # Page suivante seulement si celle-ci est pleine
+        after_key = aggregation.get("after_key")
+        full = len(aggregation["buckets"]) == size
+        return {
+            "dimension": dimension,
+            "buckets": buckets,
+            "next": encode_cursor(after_key) if after_key and full else None,
+        }
+
+    return search, parse
+
+
+def ranked_distribution():
+    """
+    Distribution rang/taille des paquets par flux sur tout l'index : pour
+    chaque rang (échelle logarithmique), nombre total de paquets et nombre de
+    paquets source du flux de ce rang. Percentiles HDR (précision relative
+    de 0,1 %) plutôt que les documents eux-mêmes.
+    """
+    percents = sorted({round(100 * (1 - fraction), 6) for fraction in RANK_FRACTIONS})
+    hdr = {"number_of_significant_value_digits": 3}
+    search = {
+        "size": 0,
+        "track_total_hits": True,
+        "runtime_mappings": {
+            "totalPackets": {
+                "type": "long",
+                "script": {
+                    "source": TOTAL_PACKETS_SCRIPT,
+                    "params": {
+                        "fields": ["totalSourcePackets", "totalDestinationPackets"]
+                    },
+                },
+            }
+        },
+        "aggs": {
+            "total_packets": {
+                "percentiles": {
+                    "field": "totalPackets",
+                    "percents": percents,
+                    "keyed": False,
+                    "hdr": hdr,
+                }
+            },
+            "source_packets": {
+                "percentiles": {
+                    "field": "totalSourcePackets",
+                    "percents": percents,
+                    "keyed": False,
+                    "hdr": hdr,
+                }
+            },
+        },
+    }
+
+    def parse(result):
+        flows = result["hits"]["total"]["value"]
+        aggregations = result["aggregations"]
+        # Du plus gros flux (rang 1) au plus petit ; valeurs None si index vide
+        percentiles = zip(
+            reversed(aggregations["total_packets"]["values"]),
+            reversed(aggregations["source_packets"]["values"]),
+        )
+        points = {}
+        for total, source in percentiles:
+            if total["value"] is None or source["value"] is None:
+                continue
+            rank = max(1, round((1 - total["key"] / 100) * flows))
+            points.setdefault(
+                rank,
+                {
+                    "rank": rank,
+                    "total_packets": int(total["value"]),
+                    "source_packets": int(source["value"]),
+                },
+            )
+        return {"flows": flows, "points": list(points.values())}
+
+    return search, parse
+
+
+def ranked_distribution_png(distribution):
+    # Figure sans pyplot (backend Agg) : aucun état global, utilisable dans un thread
+    figure = Figure()
+    axes = figure.subplots()
+    points = distribution["points"]
+    axes.loglog(
+        [point["source_packets"] for point in points],
+        [point["total_packets"] for point in points],
+        marker="o",
+        linestyle="-",
+        color="b",
+    )
+    axes.set_ylabel("#Packets (Log Scale)")
+    axes.set_xlabel("#Flows (Log Scale)")
+    axes.set_title("Ranked Distribution of Flows vs. Packets")
+    buf = io.BytesIO()
+    figure.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _epoch_millis(value, name):
+    # Date ISO (UTC si sans fuseau, comme les dates de l'index) ou epoch en ms
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or epoch milliseconds")
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return round(date.timestamp() * 1000)
+
+
+def _iso(millis):
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+
+
+def _interval_label(interval):
+    # 3600000 -> "1h" (format de fixed_interval)
+    for unit, millis in (
+        ("d", 24 * HOUR_MS),
+        ("h", HOUR_MS),
+        ("m", 60000),
+        ("s", 1000),
+    ):
+        if interval % millis == 0:
+            return f"{interval // millis}{unit}"
+    return f"{interval}ms"
+
+
+def timeline_args(args):
+    """
+    Valide les paramètres de /timeline. Renvoie (filters, start, end, points) :
+    filtres {champ: valeur} sur les dimensions, bornes en millisecondes
+    (start incluse, end exclue, None si absente) et nombre maximal de points.
+    Lève ValueError.
+    """
+    filters = {
+        field: args[dimension]
+        for dimension, field in DIMENSION_FIELDS.items()
+        if dimension in args
+    }
+    start = _epoch_millis(args["from"], "from") if args.get("from") else None
+    end = _epoch_millis(args["to"], "to") if args.get("to") else None
+    if start is not None and end is not None and start >= end:
+        raise ValueError("from must be before to")
+
+    try:
+        points = int(args.get("points", TIMELINE_POINTS))
+    except ValueError:
+        points = 0
+    if not 1 <= points <= TIMELINE_MAX_POINTS:
+        raise ValueError(f"points must be between 1 and {TIMELINE_MAX_POINTS}")
+    return filters, start, end, points
+
+
+def whole_hours(*bounds):
+    # Bornes utilisables sur le rollup (résolution d'une heure)
+    return all(bound is None or bound % HOUR_MS == 0 for bound in bounds)
+
+
+def _timeline_query(filters, start, end, field):
+    conditions = [{"term": {f: value}} for f, value in filters.items()]
+    bounds = {}
+    if start is not None:
+        bounds["gte"] = start
+    if end is not None:
+        bounds["lt"] = end
+    if bounds:
+        conditions.append({"range": {field: {**bounds, "format": "epoch_millis"}}})
+    return {"bool": {"filter": conditions}}
+
+
+def timeline_bounds(filters, start=None, end=None, rollup=False):
+    """
+    Première et dernière date des flux retenus (min/max), pour les bornes de
+    /timeline absentes. Le parse renvoie (start, end) ou None si aucun flux ;
+    sur le rollup, end est la fin de la dernière heure.
+    """
+    field = ROLLUP_TIME_FIELD if rollup else TIMELINE_FIELD
+    search = _aggregation_search(
+        {"first": {"min": {"field": field}}, "last": {"max": {"field": field}}},
+        rollup,
+    )
+    search["query"] = _timeline_query(filters, start, end, field)
+    search["track_total_hits"] = False
+
+    def parse(result):
+        first = result["aggregations"]["first"]["value"]
+        last = result["aggregations"]["last"]["value"]
+        if first is None:
+            return None
+        return (
+            int(first) if start is None else start,
+            int(last) + (HOUR_MS if rollup else 1) if end is None else end,
+        )
+
+    return search, parse
+
+
+def timeline_interval(start, end, points):
+    # Intervalle le plus fin qui donne au plus points intervalles entre start et end
+    for interval in TIMELINE_INTERVALS:
+        if (end - 1) // interval - start // interval < points:
+            return interval
+    interval = TIMELINE_INTERVALS[-1]
+    multiple = 2
+    while (end - 1) // (interval * multiple) - start // (interval * multiple) >= points:
+        multiple += 1
+    return interval * multiple
+
+
+def timeline(filters, start, end, points=TIMELINE_POINTS, rollup=False):
+    """
+    Nombre de flux, paquets, octets et part des attaques (Tag) par intervalle
+    entre start et end (millisecondes, end exclue), en une agrégation
+    date_histogram : au plus points points, intervalles vides compris.
+    Le rollup n'est lu que si l'intervalle et les bornes sont des heures
+    entières (sa résolution) ; sinon, l'index des flux.
+    """
+    interval = timeline_interval(start, end, points)
+    rollup = rollup and whole_hours(interval, start, end)
+    field = ROLLUP_TIME_FIELD if rollup else TIMELINE_FIELD
+
+    aggs = {name: {"sum": {"field": f}} for name, f in TIMELINE_SUMS.items()}
+    attacks = {"filter": {"term": {"Tag": ATTACK_TAG}}}
+    if rollup:
+        aggs[COUNT_FIELD] = {"sum": {"field": COUNT_FIELD}}
+        attacks["aggs"] = {COUNT_FIELD: {"sum": {"field": COUNT_FIELD}}}
+    aggs["attacks"] = attacks
+    histogram = {
+        "date_histogram": {
+            "field": field,
+            "fixed_interval": _interval_label(interval),
+            "min_doc_count": 0,
+            "extended_bounds": {"min": start, "max": end - 1},
+        },
+        "aggs": aggs,
+    }
+    search = _aggregation_search({"timeline": histogram}, rollup)
+    search["query"] = _timeline_query(filters, start, end, field)
+    search["track_total_hits"] = False
+
+    def parse(result):
+        points = []
+        for bucket in result["aggregations"]["timeline"]["buckets"]:
+            flows = _flow_count(bucket, rollup)
+            attacks = _flow_count(bucket["attacks"], rollup)
+            points.append(
+                {
+                    "time": _iso(bucket["key"]),
+                    "flows": flows,
+                    "packets": int(
+                        bucket["source_packets"]["value"]
+                        + bucket["destination_packets"]["value"]
+                    ),
+                    "bytes": int(
+                        bucket["source_bytes"]["value"]
+                        + bucket["destination_bytes"]["value"]
+                    ),
+                    "attacks": attacks,
+                    "attack_ratio": attacks / flows if flows else 0.0,
+                }
+            )
+        # Période couverte par les points (bornes alignées sur l'intervalle)
+        return {
+            "interval": _interval_label(interval),
+            "from": _iso(start // interval * interval),
+            "to": _iso(((end - 1) // interval + 1) * interval),
+            "points": points,
+        }
+
+    return search, parse
+
+
+def stream_args(args):
+    """
+    Valide les paramètres de /flows_stream. Renvoie (limit, source, cursor,
+    query) ; cursor vaut None pour un nouveau flux. Lève ValueError.
+    """
+    limit = None
+    if "limit" in args:
+        try:
+            limit = int(args["limit"])
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+
+    fields = args.get("fields")
+    if fields:
+        source = {"includes": [f.strip() for f in fields.split(",") if f.strip()]}
+    else:
+        source = {"excludes": STREAM_EXCLUDES}
+
+    cursor = None
+    if args.get("cursor"):
+        try:
+            cursor = stream_cursor(decode_cursor(args["cursor"]))
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("Invalid cursor")
+
+    # La requête est toujours reconstruite à partir des filtres validés :
+    # le curseur ne transporte que le point-in-time et la position
+    filters = [
+        {"term": {field: args[dimension]}}
+        for dimension, field in DIMENSION_FIELDS.items()
+        if dimension in args
+    ]
+    return limit, source, cursor, {"bool": {"filter": filters}}
+
+
+def stream_cursor(value):
+    """
+    Valide un curseur décodé de /flows_stream : {"pit": identifiant du
+    point-in-time, "after": valeurs de tri (_shard_doc) du dernier flux}.
+    Lève ValueError (ou KeyError, TypeError) si ce n'est pas le cas.
+    """
+    pit, after = value["pit"], value["after"]
+    if not isinstance(pit, str) or not pit:
+        raise ValueError("Invalid cursor")
+    if not isinstance(after, list) or not after:
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in after):
+        raise ValueError("Invalid cursor")
+    return {"pit": pit, "after": after}
+
+
+def stream_page(pit_id, query, search_after, size, source):
+    # Une page de /flows_stream (point-in-time + search_after)
+    return {
+        "pit": {"id": pit_id, "keep_alive": STREAM_KEEP_ALIVE},
+        "query": query,
+        "sort": ["_shard_doc"],
+        "search_after": search_after,
+        "size": size,
+        "source": source,
+        "track_total_hits": False,
+    }
+
+
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def ndjson_page(hits):
+    # Une seule chaîne par page plutôt qu'une écriture par flux
+    return "".join(
+        _encode_json({"_id": hit["_id"], **hit.get("_source", {})}) + "\n"
+        for hit in hits
+    )
+
+
+def ndjson_line(value):
+    return _encode_json(value) + "\n"
+
+
+def index_generation(stats):
+    """
+    Génération de l'index d'après es.indices.stats(metric=["docs", "indexing"]) :
+    change à chaque écriture, suppression ou recréation de l'index (l'uuid
+    change), ce qui invalide le cache des réponses.
+    """
+    primaries = stats["_all"]["primaries"]
+    uuids = sorted(index["uuid"] for index in stats["indices"].values())
+    return (
+        uuids,
+        primaries["docs"]["count"],
+        primaries["docs"]["deleted"],
+        primaries["indexing"]["index_total"],
+        primaries["indexing"]["delete_total"],
+    )
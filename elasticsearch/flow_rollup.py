@@ -0,0 +1,315 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 2 - Data indexing in Elasticsearch (rollup summaries)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Index de synthèse (rollup) des flux : un document par groupe (protocole,
+application, origine, direction, Tag, heure de début) avec le nombre de flux
+et les sommes des octets, paquets et tailles de payload. Il est mis à jour
+par data_indexing.py au fil de l'indexation ; les statistiques de l'API
+(data_access.py) sont alors calculées sur quelques milliers de groupes au
+lieu de tous les flux, tant que la synthèse est complète et correspond à
+l'index des flux (rollup_usable).
+"""
+
+import argparse
+import hashlib
+import uuid
+from datetime import datetime, timezone
+from elasticsearch import Elasticsearch, helpers
+from flow_index import PAYLOAD_SIZE_FIELDS, payload_size
+
+ROLLUP_INDEX = "flow_rollup"
+
+# Clés des groupes et granularité temporelle (début du flux, à l'heure près)
+GROUP_FIELDS = ["protocolName", "appName", "origin", "direction", "Tag"]
+TIME_FIELD = "startDateTime"
+ROLLUP_TIME_FIELD = "timestamp"
+ROLLUP_INTERVAL = "1h"
+
+# Nombre de flux du groupe et champs additionnés
+COUNT_FIELD = "flows"
+SUM_FIELDS = [
+    "totalSourceBytes",
+    "totalDestinationBytes",
+    "totalSourcePackets",
+    "totalDestinationPackets",
+    "sourcePayloadBytes",
+    "destinationPayloadBytes",
+]
+
+# Groupes envoyés à Elasticsearch dès que ce nombre de flux est atteint
+FLUSH_EVERY = 100000
+
+# Ajoute les compteurs d'un lot au document du groupe (créé au besoin). Chaque
+# lot (flush) a un identifiant, retenu dans batches : un lot rejoué (requête
+# bulk renvoyée après un délai dépassé) ne modifie pas le document une 2e fois
+ROLLUP_SCRIPT = """
+if (ctx._source.batches != null && ctx._source.batches.contains(params.batch)) {
+    ctx.op = 'noop';
+} else {
+    for (entry in params.group.entrySet()) {
+        ctx._source[entry.getKey()] = entry.getValue();
+    }
+    for (entry in params.add.entrySet()) {
+        def current = ctx._source[entry.getKey()];
+        ctx._source[entry.getKey()] = (current == null ? 0L : current) + entry.getValue();
+    }
+    if (ctx._source.batches == null) {
+        ctx._source.batches = [];
+    }
+    ctx._source.batches.add(params.batch);
+}
+"""
+
+
+def rollup_mappings():
+    properties = {field: {"type": "keyword"} for field in GROUP_FIELDS}
+    properties[ROLLUP_TIME_FIELD] = {"type": "date"}
+    properties[COUNT_FIELD] = {"type": "long"}
+    for field in SUM_FIELDS:
+        properties[field] = {"type": "long"}
+    # Synthèse incomplète tant que finish_rollup() n'a pas été appelé
+    return {"dynamic": False, "_meta": {"complete": False}, "properties": properties}
+
+
+def create_rollup_index(es, index=ROLLUP_INDEX):
+    # Recrée l'index de synthèse (vide), en même temps que l'index des flux
+    delete_rollup_index(es, index)
+    es.indices.create(index=index, mappings=rollup_mappings())
+
+
+def delete_rollup_index(es, index=ROLLUP_INDEX):
+    # Chargement sans synthèse : l'ancienne ne correspond plus aux flux
+    es.options(ignore_status=[400, 404]).indices.delete(index=index)
+
+
+def finish_rollup(es, source_index, index=ROLLUP_INDEX):
+    """
+    Marque la synthèse complète pour l'index des flux source_index (alias
+    accepté) : son uuid est enregistré dans le _meta de la synthèse, qui
+    n'est utilisée par l'API que tant que l'index des flux est le même.
+    """
+    settings = es.indices.get_settings(index=source_index, name="index.uuid")
+    (source,) = settings.values()
+    es.indices.put_mapping(
+        index=index,
+        meta={"complete": True, "source_uuid": source["settings"]["index"]["uuid"]},
+    )
+
+
+def rollup_usable(indices, index=ROLLUP_INDEX):
+    """
+    La synthèse peut-elle remplacer l'index des flux ? indices : réponse de
+    es.indices.get(index=[index des flux, index], ignore_unavailable=True).
+    Elle doit exister, être complète et avoir été calculée sur ce même index
+    des flux (uuid), et non sur un index supprimé et recréé depuis.
+    """
+    rollup = indices.get(index)
+    sources = [info for name, info in indices.items() if name != index]
+    if rollup is None or len(sources) != 1:
+        return False
+    meta = rollup.get("mappings", {}).get("_meta", {})
+    uuid = sources[0].get("settings", {}).get("index", {}).get("uuid")
+    return meta.get("complete") is True and meta.get("source_uuid") == uuid
+
+
+def _to_long(value):
+    # Même conversion que le pipeline d'ingestion (flow_index.COERCE_SCRIPT)
+    if isinstance(value, int):
+        return value
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def time_bucket(value):
+    # Début de l'heure du flux, au format ISO ("2010-06-13T23:00:00")
+    try:
+        start = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    return start.replace(minute=0, second=0, microsecond=0).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+
+
+def group_id(group):
+    # Identifiant stable d'un groupe : les mises à jour successives s'additionnent
+    key = "\x1f".join("" if value is None else str(value) for value in group)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class FlowRollup:
+    """
+    Compteurs par groupe des flux indexés depuis le dernier flush(). Les
+    flux sont ajoutés un par un (valeurs texte du XML, comme à l'indexation).
+    Les groupes refusés par Elasticsearch sont comptés dans failed : la
+    synthèse est alors incomplète (voir rebuild_rollup).
+    """
+
+    def __init__(self, index=ROLLUP_INDEX, flush_every=FLUSH_EVERY):
+        self.index = index
+        self.flush_every = flush_every
+        self.groups = {}
+        self.pending = 0
+        self.total = 0
+        # Identifiant des lots : <chargement>-<numéro du flush>
+        self.run_id = uuid.uuid4().hex[:12]
+        self.batches = 0
+        self.failed = 0
+
+    def add(self, flow):
+        group = tuple(flow.get(field) for field in GROUP_FIELDS) + (
+            time_bucket(flow[TIME_FIELD]) if flow.get(TIME_FIELD) else None,
+        )
+        counters = self.groups.get(group)
+        if counters is None:
+            counters = self.groups[group] = dict.fromkeys([COUNT_FIELD] + SUM_FIELDS, 0)
+        counters[COUNT_FIELD] += 1
+        for field in SUM_FIELDS:
+            value = flow.get(field)
+            if value is not None:
+                value = _to_long(value)
+                if value is not None:
+                    counters[field] += value
+        for payload, field in PAYLOAD_SIZE_FIELDS.items():
+            if isinstance(flow.get(payload), str):
+                counters[field] += payload_size(flow[payload])
+        self.pending += 1
+
+    def actions(self, batch):
+        for group, counters in self.groups.items():
+            fields = dict(zip(GROUP_FIELDS + [ROLLUP_TIME_FIELD], group))
+            yield {
+                "_op_type": "update",
+                "_index": self.index,
+                "_id": group_id(group),
+                "scripted_upsert": True,
+                "upsert": {},
+                "script": {
+                    "lang": "painless",
+                    "source": ROLLUP_SCRIPT,
+                    "params": {
+                        "batch": batch,
+                        "group": {k: v for k, v in fields.items() if v is not None},
+                        "add": counters,
+                    },
+                },
+            }
+
+    def flush(self, es):
+        """
+        Ajoute les compteurs en attente à l'index de synthèse. Le client ne
+        renvoie pas les requêtes (max_retries=0) et une erreur n'interrompt
+        pas le chargement : les groupes refusés sont comptés (et le premier
+        affiché), comme les documents refusés de data_indexing.index_flows.
+        """
+        if self.groups:
+            self.batches += 1
+            batch = f"{self.run_id}-{self.batches}"
+            for ok, info in helpers.streaming_bulk(
+                es.options(max_retries=0, retry_on_timeout=False),
+                self.actions(batch),
+                raise_on_error=False,
+                raise_on_exception=False,
+            ):
+                if not ok:
+                    if self.failed == 0:
+                        print(f"Groupe de synthèse refusé : {info}")
+                    self.failed += 1
+        self.total += self.pending
+        self.groups = {}
+        self.pending = 0
+
+    def maybe_flush(self, es):
+        if self.pending >= self.flush_every:
+            self.flush(es)
+
+
+def rebuild_rollup(es, source_index, index=ROLLUP_INDEX, page_size=1000):
+    """
+    Recalcule l'index de synthèse à partir de l'index des flux (agrégation
+    composite paginée), par exemple après un chargement sans synthèse.
+    Renvoie le nombre de groupes.
+    """
+    create_rollup_index(es, index)
+    sources = [
+        {field: {"terms": {"field": field, "missing_bucket": True}}}
+        for field in GROUP_FIELDS
+    ]
+    sources.append(
+        {
+            ROLLUP_TIME_FIELD: {
+                "date_histogram": {
+                    "field": TIME_FIELD,
+                    "fixed_interval": ROLLUP_INTERVAL,
+                    "missing_bucket": True,
+                }
+            }
+        }
+    )
+    composite = {"size": page_size, "sources": sources}
+    n_groups = 0
+    failed = 0
+    while True:
+        result = es.search(
+            index=source_index,
+            size=0,
+            track_total_hits=False,
+            aggs={
+                "groups": {
+                    "composite": composite,
+                    "aggs": {f: {"sum": {"field": f}} for f in SUM_FIELDS},
+                }
+            },
+        )
+        aggregation = result["aggregations"]["groups"]
+        rollup = FlowRollup(index)
+        for bucket in aggregation["buckets"]:
+            key = bucket["key"]
+            timestamp = key[ROLLUP_TIME_FIELD]
+            if timestamp is not None:
+                timestamp = datetime.fromtimestamp(
+                    timestamp / 1000, tz=timezone.utc
+                ).strftime("%Y-%m-%dT%H:%M:%S")
+            group = tuple(key[field] for field in GROUP_FIELDS) + (timestamp,)
+            rollup.groups[group] = {COUNT_FIELD: bucket["doc_count"]}
+            for field in SUM_FIELDS:
+                rollup.groups[group][field] = int(bucket[field]["value"])
+        rollup.flush(es)
+        n_groups += len(aggregation["buckets"])
+        failed += rollup.failed
+
+        if "after_key" not in aggregation or len(aggregation["buckets"]) < page_size:
+            break
+        composite["after"] = aggregation["after_key"]
+
+    es.indices.refresh(index=index)
+    if failed:
+        print(f"{index} : {failed} groupes refusés, synthèse incomplète")
+    else:
+        finish_rollup(es, source_index, index)
+    return n_groups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index de synthèse des flux")
+    parser.add_argument(
+        "--rebuild",
+        metavar="INDEX",
+        default="flow_data_index",
+        help="Index des flux à partir duquel recalculer la synthèse",
+    )
+    args = parser.parse_args()
+
+    # Spécifiez les URL des nœuds Elasticsearch (peut être un seul ou une liste de nœuds)
+    hosts = ["http://localhost:9200"]  # Exemple pour un nœud local
+    es = Elasticsearch(hosts=hosts)
+    es = es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
+
+    n_groups = rebuild_rollup(es, args.rebuild)
+    print(f"{ROLLUP_INDEX} : {n_groups} groupes calculés à partir de {args.rebuild}")
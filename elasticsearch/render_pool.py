@@ -0,0 +1,76 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (image rendering)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+
+Rendu des images de l'API (matplotlib) hors du thread de la requête : le
+rendu tient le GIL pendant toute sa durée et bloquerait les autres requêtes
+du serveur. Il s'exécute dans un pool de processus, et les requêtes qui
+demandent la même image pendant son rendu attendent le même résultat au
+lieu de la recalculer. L'image rendue est ensuite conservée par le cache
+des réponses (ResponseCache) jusqu'au changement de génération de l'index.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Processus de rendu (créés au premier rendu)
+RENDER_WORKERS = 2
+
+
+def _exit_with_parent():
+    # Initialiseur des processus de rendu : ils s'arrêtent avec le serveur,
+    # même arrêté sans shutdown() (SIGTERM)
+    parent = multiprocessing.parent_process()
+
+    def watch():
+        parent.join()
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class RenderPool:
+    def __init__(self, max_workers=RENDER_WORKERS):
+        self.max_workers = max_workers
+        self.executor = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        """
+        Rend function(*args) dans le pool ; key identifie l'image (requête et
+        données). Renvoie un concurrent.futures.Future, partagé par tous les
+        appels de même key tant que le rendu n'est pas terminé.
+        """
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            if self.executor is None:
+                # spawn : pas de fork d'un serveur multithread
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_exit_with_parent,
+                )
+            future = self.executor.submit(function, *args)
+            self.pending[key] = future
+        # Hors du verrou : le rappel s'exécute tout de suite si le rendu est fini
+        future.add_done_callback(lambda _: self._done(key, future))
+        return future
+
+    def _done(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,147 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 1 - Flow Classification
+Stage: 3 - Data access via REST API (response cache)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 10/2023
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# put() sans génération : conservée sous la génération courante
+_CURRENT = object()
+
+
+class ResponseCache:
+    """
+    Cache LRU des réponses de l'API : au plus max_entries entrées, chacune
+    valable ttl secondes. Tout le cache est invalidé dès que la génération
+    de l'index (renvoyée par generation()) change ; elle n'est relue qu'une
+    fois toutes les generation_interval secondes (même après un échec), hors
+    du verrou du cache, si bien qu'une réponse en cache est servie sans
+    attendre Elasticsearch.
+    Avec generation=None, la génération est fournie de l'extérieur par
+    set_generation() (serveur asynchrone).
+    Une réponse calculée après lookup() est conservée par put() seulement si
+    la génération vue par lookup() est toujours la génération courante : une
+    réponse calculée sur l'ancien index n'est jamais servie sous le nouveau.
+    """
+
+    def __init__(
+        self,
+        generation,
+        ttl=300,
+        max_entries=256,
+        generation_interval=1.0,
+        clock=time.monotonic,
+    ):
+        self.generation = generation
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation_interval = generation_interval
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.current_generation = None
+        self.checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def _check_generation(self, now):
+        # Appelé sans self.lock : la lecture de la génération (requête à
+        # Elasticsearch) ne bloque pas les autres requêtes. Une seule lecture
+        # à la fois ; pendant ce temps, la génération courante reste servie.
+        if self.generation is None or not self._generation_due(now):
+            return
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if not self._generation_due(now):
+                return
+            try:
+                generation = self.generation()
+            except Exception:
+                # Génération inconnue (Elasticsearch indisponible) : rien n'est
+                # servi, nouvel essai dans generation_interval secondes
+                generation = None
+            with self.lock:
+                self.checked_at = now
+                self._set_generation(generation)
+        finally:
+            self.refresh_lock.release()
+
+    def _generation_due(self, now):
+        checked_at = self.checked_at
+        return checked_at is None or now - checked_at >= self.generation_interval
+
+    def _set_generation(self, generation):
+        if generation is None or generation != self.current_generation:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.current_generation = generation
+
+    def set_generation(self, generation):
+        # None : génération inconnue, rien n'est servi ni conservé
+        with self.lock:
+            self._set_generation(generation)
+
+    def lookup(self, key):
+        # (réponse ou None, génération courante au moment de la recherche)
+        now = self.clock()
+        self._check_generation(now)
+        with self.lock:
+            generation = self.current_generation
+            entry = self.entries.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None, generation
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], generation
+
+    def get(self, key):
+        return self.lookup(key)[0]
+
+    def put(self, key, value, generation=_CURRENT):
+        # generation : celle renvoyée par lookup() avant le calcul de value
+        with self.lock:
+            if self.current_generation is None:
+                return
+            if generation is not _CURRENT and generation != self.current_generation:
+                self.stale_puts += 1
+                return
+            self.entries[key] = (self.clock(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked_at = None
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "generation": self.current_generation,
+            }
@@ -4,46 +4,219 @@ Subproject: 2 - Flow Classification
 Stage: 1 - Data Collection
 Authors: MONNIER Killian & BAKKARI Ikrame
 Date: 01/2024
+
+Export de l'index Elasticsearch en stockage colonnaire. L'index est lu à
+travers un point-in-time (PIT) : chaque tranche (slice) est parcourue avec
+search_after par son propre thread, et chaque lot de documents est écrit
+directement en chunk colonnaire (flow_store). Le temps d'export est linéaire
+en nombre de documents : aucun DataFrame global n'est recopié à chaque lot.
 """
 
-import numpy as np
+import argparse
+import glob
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from elasticsearch import Elasticsearch
-
-# Initialisation de la connexion Elasticsearch
-es = Elasticsearch(hosts=["http://localhost:9200"])
+from flow_store import (
+    SCHEMA_FILE,
+    merge_flow_stores,
+    read_flow_store,
+    write_flow_store,
+)
 
 # Définir le nom de l'index
 index_name = "flow_data_index"
 
-# Apply transport options to the Elasticsearch object
-es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
+# Dossier des chunks exportés : <export_dir>/slice-XX/chunk-XXXXX
+export_dir = "data/flow_export"
+
+# Stockage colonnaire final (lu par preprocess_df.py) et pickle optionnel
+flow_store_dir = "data/flow_store"
+pickle_file = "data/flow_df.pkl"
+
+# Nombre de documents par requête (et donc par chunk)
+BATCH_SIZE = 10000
+
+# Durée de vie du point-in-time entre deux requêtes
+KEEP_ALIVE = "2m"
+
+# Les payloads (base64 et UTF) sont volumineux et inutiles au prétraitement ;
+# leurs tailles (sourcePayloadBytes, ...) sont exportées (moteur de flow_engine.py)
+PAYLOAD_FIELDS = ["*PayloadAs*"]
+
+
+def source_filter(fields=None, with_payloads=False):
+    # Projection _source : champs demandés, sinon tout sauf les payloads
+    if fields:
+        return {"includes": list(fields)}
+    if with_payloads:
+        return True
+    return {"excludes": PAYLOAD_FIELDS}
+
+
+def export_slice(
+    es, pit_id, slice_id, n_slices, directory, source=True, batch_size=BATCH_SIZE
+):
+    """
+    Parcourt la tranche slice_id du point-in-time avec search_after et écrit
+    chaque lot dans directory/slice-XX/chunk-XXXXX. Renvoie le nombre de
+    documents exportés.
+    """
+    slice_dir = os.path.join(directory, f"slice-{slice_id:02d}")
+    os.makedirs(slice_dir, exist_ok=True)
+    # Une tranche unique n'est pas acceptée par Elasticsearch (max > 1)
+    slice_query = {"id": slice_id, "max": n_slices} if n_slices > 1 else None
+
+    n_docs = 0
+    n_chunks = 0
+    search_after = None
+    while True:
+        result = es.search(
+            pit={"id": pit_id, "keep_alive": KEEP_ALIVE},
+            slice=slice_query,
+            # _shard_doc : ordre de parcours le moins coûteux, stable dans le PIT
+            sort=["_shard_doc"],
+            search_after=search_after,
+            size=batch_size,
+            source=source,
+            track_total_hits=False,
+        )
+        hits = result["hits"]["hits"]
+        if not hits:
+            break
+
+        df = pd.DataFrame([hit.get("_source", {}) for hit in hits])
+        write_flow_store(df, os.path.join(slice_dir, f"chunk-{n_chunks:05d}"))
+        n_docs += len(hits)
+        n_chunks += 1
+        search_after = hits[-1]["sort"]
+        # L'identifiant du PIT peut changer d'une réponse à l'autre
+        pit_id = result.get("pit_id", pit_id)
+
+    return n_docs
+
+
+def export_index(
+    es,
+    index=index_name,
+    directory=export_dir,
+    n_slices=4,
+    source=True,
+    batch_size=BATCH_SIZE,
+):
+    """
+    Exporte index dans directory avec n_slices lecteurs parallèles.
+    Le contenu précédent de directory est remplacé.
+    Renvoie le nombre de documents exportés.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    pit_id = es.open_point_in_time(index=index, keep_alive=KEEP_ALIVE)["id"]
+    try:
+        with ThreadPoolExecutor(max_workers=n_slices) as executor:
+            counts = executor.map(
+                lambda slice_id: export_slice(
+                    es, pit_id, slice_id, n_slices, directory, source, batch_size
+                ),
+                range(n_slices),
+            )
+            counts = list(counts)
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+    for slice_id, count in enumerate(counts):
+        print(f"Tranche {slice_id} : {count} documents")
+    return sum(counts)
+
+
+def list_export_chunks(directory=export_dir):
+    # Chunks complets (schema.json écrit en dernier), tranche par tranche
+    schemas = glob.glob(os.path.join(directory, "slice-*", "chunk-*", SCHEMA_FILE))
+    return sorted(os.path.dirname(schema) for schema in schemas)
+
+
+def read_export(directory=export_dir, columns=None):
+    # Assembler les chunks exportés en un seul DataFrame (une seule concaténation)
+    frames = [
+        read_flow_store(chunk, columns) for chunk in list_export_chunks(directory)
+    ]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
 
-# Préparer la requête
-query = {"match_all": {}}
+def merge_export(directory=export_dir, store_dir=flow_store_dir):
+    """
+    Assemble les chunks exportés dans store_dir, colonne par colonne
+    (merge_flow_stores) : aucun DataFrame de toutes les données n'est
+    construit. Le stockage précédent n'est remplacé qu'une fois le nouveau
+    complet. Renvoie le nombre de chunks assemblés.
+    """
+    chunks = list_export_chunks(directory)
+    tmp_dir = f"{store_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    merge_flow_stores(chunks, tmp_dir)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    return len(chunks)
 
-# Initialiser la recherche de récupération des données depuis Elasticsearch
-result = es.search(index=index_name, query=query, scroll="2m", size=10000)
 
-# Initialiser un DataFrame vide pour stocker toutes les données
-all_data = pd.DataFrame()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export de l'index Elasticsearch")
+    parser.add_argument(
+        "--slices", type=int, default=4, help="Nombre de lecteurs parallèles"
+    )
+    parser.add_argument(
+        "--fields",
+        nargs="+",
+        help="Champs _source à exporter (par défaut : tous sauf les payloads)",
+    )
+    parser.add_argument(
+        "--with-payloads",
+        action="store_true",
+        help="Exporter aussi les payloads (base64 et UTF)",
+    )
+    parser.add_argument(
+        "--no-merge",
+        action="store_true",
+        help=f"Ne pas assembler les chunks dans {flow_store_dir}",
+    )
+    parser.add_argument(
+        "--pickle",
+        action="store_true",
+        help=f"Écrire aussi {pickle_file} (charge toutes les données en mémoire)",
+    )
+    args = parser.parse_args()
 
-# Récupérer les données par lots
-while len(result["hits"]["hits"]) > 0:
-    # Créer un DataFrame pour le lot actuel
-    df = pd.DataFrame(hit["_source"] for hit in result["hits"]["hits"])
+    # Initialisation de la connexion Elasticsearch
+    es = Elasticsearch(hosts=["http://localhost:9200"])
 
-    # Concaténer le lot actuel au DataFrame global
-    all_data = pd.concat([all_data, df], ignore_index=True)
+    # Apply transport options to the Elasticsearch object
+    es = es.options(request_timeout=60, max_retries=5, retry_on_timeout=True)
 
-    # Utiliser l'ID de scroll pour récupérer le prochain lot
-    result = es.scroll(scroll_id=result["_scroll_id"], scroll="2m")
+    start = time.perf_counter()
+    n_docs = export_index(
+        es,
+        n_slices=args.slices,
+        source=source_filter(args.fields, args.with_payloads),
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Export : {n_docs} documents en {elapsed:.1f} s ({n_docs / elapsed:.0f} doc/s)"
+    )
 
-# Enregistrer le DataFrame global dans un fichier pickle
-all_data.to_pickle("data/flow_df.pkl")
+    if not args.no_merge:
+        # Stockage colonnaire (lu par preprocess_df.py), colonne par colonne
+        n_chunks = merge_export(export_dir, flow_store_dir)
+        print(f"{n_chunks} chunks assemblés dans {flow_store_dir}")
 
-# Vérification
-print("Nombre total d'enregistrements:", len(all_data))
+        if args.pickle:
+            # Enregistrer le DataFrame global dans un fichier pickle
+            read_flow_store(flow_store_dir).to_pickle(pickle_file)
 
-# pd.set_option("display.max_columns", None)
-# pd.set_option("display.max_rows", None)
+    # Vérification
+    print("Nombre total d'enregistrements:", n_docs)
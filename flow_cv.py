@@ -0,0 +1,291 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 2 - Flow Classification
+Stage: 3 - Classification (parallel cross-validation)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 01/2024
+
+Validation croisée parallèle des classificateurs de classification.ipynb.
+La matrice des caractéristiques est écrite une seule fois dans un fichier
+.npy ouvert en mmap (lecture seule) par chaque processus : les folds
+s'exécutent dans un pool de processus sans copie ni sérialisation de la
+matrice. Les lignes y sont rangées par fold et écrites deux fois de suite,
+si bien que les lignes d'apprentissage d'un fold (toutes sauf son test)
+forment une tranche contiguë : chaque fold apprend sur une vue du fichier,
+sans copie propre au processus. Les processeurs sont répartis entre les
+folds et, pour les classificateurs qui ont un paramètre n_jobs (forêts), les
+arbres d'un fold.
+Les mesures de chaque fold (accuracy, précision, rappel, F1, aire sous la
+courbe ROC calculée sur les probabilités) sont renvoyées dans un DataFrame,
+une ligne par fold, avec les durées d'apprentissage et de prédiction.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import (
+    accuracy_score,
+    f1_score,
+    precision_score,
+    recall_score,
+    roc_auc_score,
+)
+from sklearn.model_selection import StratifiedKFold
+from flow_store import FlowStore
+
+# Mesures calculées pour chaque fold, et durées (secondes)
+METRICS = ["accuracy", "precision", "recall", "f1", "roc_auc"]
+TIMINGS = ["fit_seconds", "predict_seconds"]
+
+# Lignes copiées par bloc dans la matrice partagée (mémoire bornée)
+COPY_BLOCK_ROWS = 65536
+
+# Matrice et étiquettes partagées, ouvertes une fois par processus du pool
+_shared = {}
+
+
+def plan_jobs(classifier, n_splits, n_jobs=None):
+    """
+    Répartit n_jobs processeurs (os.cpu_count() par défaut) entre les folds,
+    indépendants, puis entre les arbres d'un même fold si le classificateur
+    a un paramètre n_jobs. Renvoie (processus du pool, n_jobs par fold).
+    Avec la disposition par fold (fold_layout), un processus ne copie pas
+    ses lignes d'apprentissage : la mémoire d'un fold est celle du modèle.
+    Sinon (découpage dont les tests ne partitionnent pas les lignes), chaque
+    processus copie les siennes, soit fold_workers x n_train x colonnes x
+    itemsize octets en plus de la matrice partagée.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    fold_workers = min(n_splits, n_jobs)
+    tree_jobs = 1
+    if "n_jobs" in classifier.get_params():
+        # Arrondi : un léger surplus de threads vaut mieux que des cœurs inoccupés
+        tree_jobs = max(1, round(n_jobs / fold_workers))
+        if "n_estimators" in classifier.get_params():
+            tree_jobs = min(tree_jobs, classifier.get_params()["n_estimators"])
+    return fold_workers, tree_jobs
+
+
+def fold_layout(splits, n_rows):
+    """
+    Ordre des lignes de la matrice partagée : les lignes de test de chaque
+    fold à la suite. Renvoie (order, bounds), les lignes de test du fold k
+    occupant [bounds[k], bounds[k + 1]) dans cet ordre, ou None si les
+    ensembles de test ne partitionnent pas les lignes (ShuffleSplit...) ou
+    si un fold n'apprend pas sur toutes les autres lignes.
+    """
+    order = np.concatenate([test_index for _, test_index in splits])
+    if len(order) != n_rows or np.bincount(order, minlength=n_rows).max() != 1:
+        return None
+    for train_index, test_index in splits:
+        if len(train_index) + len(test_index) != n_rows:
+            return None
+    bounds = np.cumsum([0] + [len(test_index) for _, test_index in splits])
+    return order, bounds
+
+
+def fold_slices(bounds, fold):
+    """
+    Tranches (apprentissage, test) du fold fold (à partir de 0) dans la
+    matrice partagée de fold_layout, écrite deux fois de suite : les lignes
+    qui suivent le test puis celles qui le précèdent sont contiguës.
+    """
+    n_rows = bounds[-1]
+    start, stop = int(bounds[fold]), int(bounds[fold + 1])
+    return slice(stop, n_rows + start), slice(start, stop)
+
+
+def write_shared_matrix(X, path, dtype=np.float32, order=None):
+    """
+    Écrit X (DataFrame ou tableau) dans le fichier .npy path, par blocs de
+    lignes. float32 est le type utilisé en interne par les arbres de
+    scikit-learn : les processus n'ont pas à convertir la matrice.
+    Avec order (fold_layout), les lignes sont écrites dans cet ordre, deux
+    fois de suite (2 x len(X) lignes).
+    """
+    n_rows = len(X)
+    copies = 1 if order is None else 2
+    shape = (copies * n_rows,) + tuple(X.shape[1:])
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    for start in range(0, n_rows, COPY_BLOCK_ROWS):
+        stop = min(start + COPY_BLOCK_ROWS, n_rows)
+        rows = slice(start, stop) if order is None else order[start:stop]
+        block = X.iloc[rows] if isinstance(X, (pd.DataFrame, pd.Series)) else X[rows]
+        block = np.asarray(block, dtype=dtype)
+        for copy in range(copies):
+            matrix[copy * n_rows + start : copy * n_rows + stop] = block
+    matrix.flush()
+    del matrix
+
+
+def _open_shared(directory):
+    # Initialiseur du pool : mmap en lecture seule, partagé via le cache de pages
+    _shared["X"] = np.load(os.path.join(directory, "X.npy"), mmap_mode="r")
+    _shared["y"] = np.load(os.path.join(directory, "y.npy"), mmap_mode="r")
+
+
+def fold_metrics(y_true, y_pred, y_score):
+    # Aire sous la courbe ROC indéfinie (NaN) si le fold ne contient qu'une classe
+    if len(np.unique(y_true)) < 2:
+        roc_auc = np.nan
+    else:
+        roc_auc = roc_auc_score(y_true, y_score)
+    return {
+        "accuracy": accuracy_score(y_true, y_pred),
+        "precision": precision_score(y_true, y_pred, zero_division=0),
+        "recall": recall_score(y_true, y_pred, zero_division=0),
+        "f1": f1_score(y_true, y_pred, zero_division=0),
+        "roc_auc": roc_auc,
+    }
+
+
+def _run_fold(classifier, fold, train_index, test_index):
+    """
+    Un fold dans un processus du pool : seules ses lignes sont lues.
+    train_index et test_index sont des tranches de la matrice partagée
+    (fold_slices) : l'apprentissage et la prédiction lisent des vues du
+    mmap, sans copie. Avec des tableaux d'indices (découpage hors
+    fold_layout), X[train_index] copie les lignes d'apprentissage dans le
+    processus (voir plan_jobs).
+    """
+    X, y = _shared["X"], _shared["y"]
+    y_test = np.asarray(y[test_index])
+
+    started = time.perf_counter()
+    classifier.fit(X[train_index], y[train_index])
+    fit_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    proba = classifier.predict_proba(X[test_index])
+    predict_seconds = time.perf_counter() - started
+
+    # Classe positive : la dernière de classes_ (1 pour tag_Attack)
+    y_score = proba[:, -1]
+    y_pred = classifier.classes_[proba.argmax(axis=1)]
+    row = {
+        "fold": fold,
+        "n_train": len(y[train_index]),
+        "n_test": len(y_test),
+        **fold_metrics(y_test, y_pred, y_score),
+        "fit_seconds": fit_seconds,
+        "predict_seconds": predict_seconds,
+    }
+    return row, (y_pred, y_score)
+
+
+def cross_validate(
+    classifier,
+    X,
+    y,
+    cv=None,
+    n_jobs=None,
+    dtype=np.float32,
+    return_predictions=False,
+):
+    """
+    Validation croisée de classifier sur (X, y) : un fold par tâche du pool
+    de processus (plan_jobs), sur une matrice partagée en mmap rangée par
+    fold (fold_layout) quand les ensembles de test partitionnent les lignes.
+    cv : découpage de scikit-learn (StratifiedKFold(n_splits=5) par défaut).
+    Renvoie un DataFrame (une ligne par fold : fold, n_train, n_test,
+    METRICS, TIMINGS, tree_jobs) et, avec return_predictions=True, les
+    prédictions hors fold (fold, y_true, y_pred, y_score) indexées comme X.
+    """
+    cv = cv if cv is not None else StratifiedKFold(n_splits=5)
+    y_values = np.asarray(y)
+    splits = list(cv.split(np.zeros(len(y_values)), y_values))
+    fold_workers, tree_jobs = plan_jobs(classifier, len(splits), n_jobs)
+    classifier = clone(classifier)
+    if "n_jobs" in classifier.get_params():
+        classifier.set_params(n_jobs=tree_jobs)
+
+    layout = fold_layout(splits, len(y_values))
+    if layout is None:
+        order = None
+        tasks = splits
+    else:
+        order, bounds = layout
+        tasks = [fold_slices(bounds, fold) for fold in range(len(splits))]
+
+    with tempfile.TemporaryDirectory(prefix="flow_cv_") as directory:
+        write_shared_matrix(X, os.path.join(directory, "X.npy"), dtype, order)
+        if order is None:
+            np.save(os.path.join(directory, "y.npy"), y_values)
+        else:
+            np.save(os.path.join(directory, "y.npy"), np.tile(y_values[order], 2))
+
+        with ProcessPoolExecutor(
+            max_workers=fold_workers,
+            initializer=_open_shared,
+            initargs=(directory,),
+        ) as executor:
+            futures = [
+                executor.submit(_run_fold, classifier, fold, train_index, test_index)
+                for fold, (train_index, test_index) in enumerate(tasks, start=1)
+            ]
+            results = [future.result() for future in futures]
+
+    table = pd.DataFrame([row for row, _ in results])
+    table["tree_jobs"] = tree_jobs
+    if not return_predictions:
+        return table
+
+    folds = np.zeros(len(y_values), dtype=int)
+    y_pred = y_values.copy()
+    y_score = np.full(len(y_values), np.nan)
+    for (_, test_index), (row, (fold_pred, fold_score)) in zip(splits, results):
+        folds[test_index] = row["fold"]
+        y_pred[test_index] = fold_pred
+        y_score[test_index] = fold_score
+    predictions = pd.DataFrame(
+        {"fold": folds, "y_true": y_values, "y_pred": y_pred, "y_score": y_score},
+        index=y.index if isinstance(y, pd.Series) else None,
+    )
+    return table, predictions
+
+
+def summarize_cv(table):
+    # Moyenne et écart type de chaque mesure et durée sur les folds
+    return table[METRICS + TIMINGS].agg(["mean", "std"]).T
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validation croisée parallèle")
+    parser.add_argument(
+        "--store",
+        default="data/df_preprocessed",
+        help="Stockage colonnaire des flux prétraités",
+    )
+    parser.add_argument("--app", default="SSH", help="Application (appName) évaluée")
+    parser.add_argument("--folds", type=int, default=5, help="Nombre de folds")
+    parser.add_argument(
+        "--jobs", type=int, help="Processeurs utilisés (tous par défaut)"
+    )
+    parser.add_argument("--output", help="Fichier CSV des mesures par fold")
+    args = parser.parse_args()
+
+    # Même préparation et même classificateur que classification.ipynb
+    df = FlowStore(args.store).to_frame(filters={"appName": args.app})
+    df = df.drop(columns=["appName", "origin"], axis=1)
+    df.fillna(0, inplace=True)
+    X = df.drop(["tag_Attack"], axis=1)
+    y = df["tag_Attack"]
+    classifier = RandomForestClassifier(n_estimators=100, max_depth=20, random_state=42)
+
+    start = time.perf_counter()
+    table = cross_validate(
+        classifier, X, y, cv=StratifiedKFold(n_splits=args.folds), n_jobs=args.jobs
+    )
+    elapsed = time.perf_counter() - start
+
+    print(table.to_string(index=False))
+    print(summarize_cv(table))
+    print(f"{args.app} : {len(df)} flux, {args.folds} folds en {elapsed:.1f} s")
+    if args.output:
+        table.to_csv(args.output, index=False)
@@ -0,0 +1,145 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 2 - Flow Classification
+Stage: 2 - Data Preprocessing (one-hot encoder)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 01/2024
+"""
+
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+
+class FlowEncoder:
+    """
+    Encodeur one-hot appris une seule fois sur les données d'entraînement.
+
+    fit() retient le vocabulaire de chaque colonne, les colonnes conservées
+    telles quelles (passthrough_) et donc la liste complète des colonnes de
+    sortie (output_columns_ : passthrough_ puis les indicateurs, mêmes noms
+    que pd.get_dummies). transform() écrit directement dans une matrice uint8
+    préallouée : les valeurs inconnues ou manquantes donnent une ligne de
+    zéros, si bien que le jeu de test a toujours exactement les colonnes du
+    jeu d'entraînement, dans le même ordre.
+    """
+
+    def __init__(self, columns, categories=None, passthrough=None):
+        self.columns = list(columns)
+        self.categories_ = categories
+        # None : encodeur sauvegardé sans la liste (ordre de df conservé)
+        self.passthrough_ = passthrough
+
+    @property
+    def fitted(self):
+        return self.categories_ is not None
+
+    @property
+    def feature_names_(self):
+        return [
+            f"{column}_{category}"
+            for column in self.columns
+            for category in self.categories_[column]
+        ]
+
+    @property
+    def output_columns_(self):
+        return list(self.passthrough_ or []) + self.feature_names_
+
+    def fit(self, df, passthrough=None):
+        # passthrough : colonnes conservées, celles de df hors columns par défaut
+        if passthrough is None:
+            passthrough = [
+                column for column in df.columns if column not in self.columns
+            ]
+        self.passthrough_ = list(passthrough)
+        self.categories_ = {}
+        for column in self.columns:
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Comme get_dummies : toutes les catégories, même absentes
+                categories = series.cat.categories.tolist()
+            else:
+                categories = sorted(series.dropna().unique().tolist())
+            self.categories_[column] = categories
+        return self
+
+    def transform(self, df):
+        # Matrice (n_flux, n_features) en uint8, dans l'ordre de feature_names_
+        n_features = sum(len(categories) for categories in self.categories_.values())
+        matrix = np.zeros((len(df), n_features), dtype=np.uint8)
+        rows = np.arange(len(df))
+
+        offset = 0
+        for column in self.columns:
+            categories = self.categories_[column]
+            # Code -1 pour les valeurs inconnues ou manquantes
+            codes = pd.Categorical(df[column], categories=categories).codes
+            known = codes >= 0
+            matrix[rows[known], offset + codes[known]] = 1
+            offset += len(categories)
+
+        return matrix
+
+    def transform_frame(self, df):
+        """
+        DataFrame de sortie dans l'ordre de output_columns_ : les colonnes
+        conservées puis les indicateurs. Les colonnes de df inconnues à
+        l'apprentissage sont ignorées, les colonnes conservées absentes de df
+        (colonnes facultatives, métadonnées comme origin) sont ajoutées vides
+        (NaN). Seules les colonnes conservées sont copiées ; la matrice uint8
+        devient un seul bloc du DataFrame, sans copie (concat avec copy=False).
+        """
+        if self.passthrough_ is None:
+            kept = df[[column for column in df.columns if column not in self.columns]]
+        else:
+            kept = df.reindex(columns=self.passthrough_)
+        encoded = pd.DataFrame(
+            self.transform(df), columns=self.feature_names_, index=df.index, copy=False
+        )
+        return pd.concat([kept, encoded], axis=1, copy=False)
+
+    def fit_transform_frame(self, df):
+        return self.fit(df).transform_frame(df)
+
+    def unknown_categories(self, df):
+        # Valeurs de df absentes du vocabulaire appris, par colonne
+        unknown = {}
+        for column in self.columns:
+            values = set(df[column].dropna().unique()) - set(self.categories_[column])
+            if values:
+                unknown[column] = sorted(values)
+        return unknown
+
+    def digest(self):
+        # Empreinte du vocabulaire appris (clé des caches de prétraitement)
+        state = json.dumps(
+            [self.columns, self.categories_, self.passthrough_], sort_keys=True
+        )
+        return hashlib.sha256(state.encode("utf-8")).hexdigest()
+
+    def save(self, file_name):
+        with open(file_name, "w") as file:
+            json.dump(
+                {
+                    "columns": self.columns,
+                    "categories": self.categories_,
+                    "passthrough": self.passthrough_,
+                    "output_columns": self.output_columns_,
+                },
+                file,
+            )
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, "r") as file:
+            state = json.load(file)
+        encoder = cls(state["columns"], state["categories"], state.get("passthrough"))
+        # Liste complète sauvegardée : elle doit être celle que l'encodeur produit
+        if (
+            "output_columns" in state
+            and state["output_columns"] != encoder.output_columns_
+        ):
+            raise ValueError(f"Colonnes de sortie incohérentes dans {file_name}")
+        return encoder
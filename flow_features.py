@@ -0,0 +1,207 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 2 - Flow Classification
+Stage: 2 - Data Preprocessing (shared feature helpers)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 01/2024
+"""
+
+import bisect
+import ipaddress
+import re
+import numpy as np
+import pandas as pd
+
+# Intervalles pour les adresses IP : une adresse est classée dans le premier
+# intervalle dont la borne supérieure (incluse) est >= à l'adresse
+IP_THRESHOLDS = np.array(
+    [
+        int(ipaddress.IPv4Address("128.0.0.0")),
+        int(ipaddress.IPv4Address("192.0.0.0")),
+        int(ipaddress.IPv4Address("224.0.0.0")),
+    ],
+    dtype=np.uint32,
+)
+IP_LABELS = ["PrivateNetwork", "PublicNetwork", "MulticastNetwork", "UnknownNetwork"]
+UNKNOWN_NETWORK = len(IP_LABELS) - 1
+
+# Même syntaxe que ipaddress.IPv4Address : 4 octets décimaux, sans zéro initial
+_OCTET = r"(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+IPV4_PATTERN = rf"^{_OCTET}\.{_OCTET}\.{_OCTET}\.{_OCTET}\Z"
+_IPV4_REGEX = re.compile(IPV4_PATTERN)
+
+# Flags TCP des descriptions ISCX ("F,S,P,A", "N/A", ...)
+TCP_FLAGS = ["F", "S", "R", "P", "A", "N/A"]
+
+# Composantes de date disponibles pour datetime_parts (attributs de .dt)
+DATETIME_PARTS = ["year", "month", "day", "hour", "dayofweek"]
+
+
+def ipv4_to_uint32(values):
+    """
+    Convertit des adresses IPv4 (chaînes "a.b.c.d") en tableau uint32.
+    Renvoie aussi un masque des valeurs valides ; les valeurs invalides valent 0.
+    """
+    values = pd.Series(values, copy=False)
+    addresses = np.zeros(len(values), dtype=np.uint32)
+    valid = np.zeros(len(values), dtype=bool)
+    if len(values) == 0:
+        return addresses, valid
+
+    # Les adresses se répètent beaucoup : on ne convertit que les valeurs distinctes
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+    is_str = uniques.map(lambda x: isinstance(x, str)).to_numpy(dtype=bool)
+    octets = uniques[is_str].str.extract(IPV4_PATTERN)
+    matched = octets.notna().all(axis=1).to_numpy()
+
+    unique_addresses = np.zeros(len(uniques), dtype=np.uint32)
+    unique_valid = np.zeros(len(uniques), dtype=bool)
+    parsed = octets[matched].astype(np.uint32).to_numpy()
+    str_positions = np.flatnonzero(is_str)[matched]
+    unique_addresses[str_positions] = (
+        (parsed[:, 0] << 24) | (parsed[:, 1] << 16) | (parsed[:, 2] << 8) | parsed[:, 3]
+    )
+    unique_valid[str_positions] = True
+
+    # factorize code -1 pour les valeurs manquantes
+    present = codes >= 0
+    addresses[present] = unique_addresses[codes[present]]
+    valid[present] = unique_valid[codes[present]]
+    return addresses, valid
+
+
+def ip_interval_codes(values):
+    # Indice dans IP_LABELS de l'intervalle de chaque adresse
+    addresses, valid = ipv4_to_uint32(values)
+    codes = np.searchsorted(IP_THRESHOLDS, addresses, side="left")
+    codes[~valid] = UNKNOWN_NETWORK
+    return codes
+
+
+def map_ip_to_interval(values):
+    """
+    Version vectorisée de map_ip_to_interval : renvoie, pour chaque adresse,
+    le nom de son intervalle. Les valeurs invalides ou non IPv4 sont classées
+    en "UnknownNetwork".
+    """
+    labels = np.array(IP_LABELS, dtype=object)[ip_interval_codes(values)]
+    index = values.index if isinstance(values, pd.Series) else None
+    return pd.Series(labels, index=index, dtype=object)
+
+
+def ip_interval(ip):
+    # Version scalaire, pour les traitements flux par flux (parseur SAX)
+    match = _IPV4_REGEX.match(ip) if isinstance(ip, str) else None
+    if match is None:
+        return IP_LABELS[UNKNOWN_NETWORK]
+    a, b, c, d = (int(octet) for octet in match.groups())
+    address = (a << 24) | (b << 16) | (c << 8) | d
+    return IP_LABELS[bisect.bisect_left(IP_THRESHOLDS.tolist(), address)]
+
+
+def tcp_flags_bitmask(values, flags=TCP_FLAGS, separator=","):
+    """
+    Masque uint8 des flags présents dans chaque valeur (bit i pour flags[i]).
+    - separator="," : valeurs "F,S,P,A" (ISCX), un flag est un jeton exact ;
+    - separator=None : valeurs ".AP.SF" (challenge 2), un flag est présent
+      s'il apparaît dans la chaîne.
+    Les valeurs manquantes donnent 0.
+    """
+    if len(flags) > 8:
+        raise ValueError("At most 8 flags fit in a uint8 bitmask")
+
+    # Peu de combinaisons distinctes : chaque chaîne n'est découpée qu'une fois
+    codes, uniques = pd.factorize(values)
+    # Dernière case pour le code -1 (valeur manquante)
+    unique_masks = np.zeros(len(uniques) + 1, dtype=np.uint8)
+    for i, value in enumerate(uniques):
+        tokens = value.split(separator) if separator else value
+        for bit, flag in enumerate(flags):
+            if flag in tokens:
+                unique_masks[i] |= 1 << bit
+    return unique_masks[codes]
+
+
+def decode_tcp_flags(values, prefix, flags=TCP_FLAGS, separator=",", dtype=np.int64):
+    # Colonnes indicatrices {prefix + flag: tableau 0/1}, dans l'ordre de flags
+    mask = tcp_flags_bitmask(values, flags, separator)
+    return {
+        f"{prefix}{flag}": ((mask >> bit) & 1).astype(dtype)
+        for bit, flag in enumerate(flags)
+    }
+
+
+def flow_duration(start, stop):
+    """
+    Durée stop - start en secondes entières, tronquée vers zéro comme
+    int(timedelta.total_seconds()), calculée en nanosecondes entières.
+    Renvoie des int64, ou des float64 (NaN) si une des dates est manquante.
+    """
+    delta = (stop - start).to_numpy(dtype="timedelta64[ns]")
+    missing = np.isnat(delta)
+    nanoseconds = delta.view(np.int64)
+    # // arrondit vers -inf : on divise la valeur absolue puis on remet le signe
+    seconds = np.abs(nanoseconds) // 1_000_000_000 * np.sign(nanoseconds)
+    if missing.any():
+        seconds = seconds.astype(np.float64)
+        seconds[missing] = np.nan
+    return pd.Series(seconds, index=stop.index)
+
+
+def datetime_parts(df, columns, parts):
+    """
+    Composantes de date des colonnes datetime64 de df, via les accesseurs .dt.
+    columns associe chaque colonne à son préfixe ({"startDateTime": "start"}),
+    parts liste des éléments de DATETIME_PARTS. Renvoie {préfixe_partie: Series}
+    dans l'ordre partie par partie (start_year, stop_year, start_month, ...),
+    en int64 (float64 si une date est manquante).
+    """
+    features = {}
+    for part in parts:
+        if part not in DATETIME_PARTS:
+            raise ValueError(f"Unknown datetime part: {part}")
+        for column, prefix in columns.items():
+            values = getattr(df[column].dt, part)
+            if not values.isna().any():
+                values = values.astype(np.int64)
+            features[f"{prefix}_{part}"] = values
+    return features
+
+
+def compact_dtypes(df, schema, report=False):
+    """
+    Convertit les colonnes de df selon un schéma déclaré
+    {colonne: "indicator" | "count" | "category"} :
+    - indicator : uint8 (valeurs 0/1) ;
+    - count : plus petit entier sûr (non signé si aucune valeur négative),
+      inchangé s'il reste des valeurs manquantes ;
+    - category : pandas Categorical.
+    Les colonnes absentes de df sont ignorées. Avec report=True, affiche
+    l'occupation mémoire avant et après la conversion.
+    """
+    if report:
+        before = df.memory_usage(deep=True).sum()
+
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        if kind == "indicator":
+            df[column] = df[column].astype(np.uint8)
+        elif kind == "count":
+            if df[column].isna().any():
+                continue
+            downcast = "unsigned" if (df[column] >= 0).all() else "integer"
+            df[column] = pd.to_numeric(df[column], downcast=downcast)
+        elif kind == "category":
+            df[column] = df[column].astype("category")
+        else:
+            raise ValueError(f"Unknown column kind: {kind}")
+
+    if report:
+        after = df.memory_usage(deep=True).sum()
+        print(
+            f"Mémoire du DataFrame : {before / 1e6:.1f} Mo -> {after / 1e6:.1f} Mo "
+            f"(x{before / max(after, 1):.1f})"
+        )
+    return df
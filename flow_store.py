@@ -0,0 +1,399 @@
+"""
+Project: AD4IDS - Anomaly Detection for Intrusion Detection Systems
+Subproject: 2 - Flow Classification
+Stage: 2 - Data Preprocessing (columnar dataset cache)
+Authors: MONNIER Killian & BAKKARI Ikrame
+Date: 01/2024
+
+Stockage colonnaire des DataFrames de flux, à la place des fichiers pickle.
+Chaque colonne est un fichier .npy dans un dossier, décrit par schema.json :
+- colonnes numériques, booléennes et dates : tableau NumPy brut ;
+- colonnes catégorielles (appName, origin, ...) : codes entiers + catégories ;
+- colonnes texte (payloads) : octets UTF-8 concaténés + positions de début.
+Les fichiers sont ouverts en mmap (copie à l'écriture) : seules les colonnes
+et les lignes demandées sont réellement lues, et les modifications faites
+sur le DataFrame ne sont jamais écrites sur le disque.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+SCHEMA_FILE = "schema.json"
+
+
+def _smallest_code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _write_text(series, directory, file_name):
+    # Chaînes encodées en UTF-8 et concaténées, NaN conservés via un masque
+    values = series.to_numpy(dtype=object)
+    nulls = pd.isna(values)
+    encoded = [
+        b"" if null else str(value).encode("utf-8")
+        for value, null in zip(values, nulls)
+    ]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    np.save(os.path.join(directory, f"{file_name}.data.npy"), data)
+    np.save(os.path.join(directory, f"{file_name}.offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{file_name}.nulls.npy"), nulls)
+
+
+def write_flow_store(df, directory):
+    """
+    Écrit df dans le dossier directory, une colonne par fichier.
+    Les colonnes texte dont moins de la moitié des valeurs sont distinctes
+    sont stockées comme catégories (codes + vocabulaire trié).
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+
+    for position, name in enumerate(df.columns):
+        series = df[name]
+        # Les noms de colonnes peuvent contenir "/" (sourceTCPFlag_N/A)
+        file_name = f"{position:04d}"
+        column = {"name": name, "file": file_name}
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            column["kind"] = "category"
+            column["categorical"] = True
+            categories = series.cat.categories.tolist()
+            codes = series.cat.codes.to_numpy()
+        elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            codes, uniques = pd.factorize(series, sort=True)
+            if 2 * len(uniques) > len(series):
+                column["kind"] = "text"
+                _write_text(series, directory, file_name)
+                columns.append(column)
+                continue
+            column["kind"] = "category"
+            column["categorical"] = False
+            categories = uniques.tolist()
+        else:
+            column["kind"] = "array"
+            values = series.to_numpy()
+            # Les dtypes datetime64 dépicklés portent des métadonnées que .npy ignore
+            values = values.view(np.dtype(values.dtype.str))
+            np.save(os.path.join(directory, f"{file_name}.npy"), values)
+            columns.append(column)
+            continue
+
+        column["categories"] = categories
+        codes = codes.astype(_smallest_code_dtype(len(categories)))
+        np.save(os.path.join(directory, f"{file_name}.npy"), codes)
+        columns.append(column)
+
+    schema = {"version": STORE_VERSION, "n_rows": len(df), "columns": columns}
+    with open(os.path.join(directory, SCHEMA_FILE), "w") as file:
+        json.dump(schema, file)
+
+
+class FlowStore:
+    """
+    Lecture d'un dossier écrit par write_flow_store. Les colonnes sont
+    ouvertes en mmap à la demande ; to_frame() applique la projection sur les
+    colonnes et le filtrage des lignes sur les colonnes catégorielles.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SCHEMA_FILE), "r") as file:
+            schema = json.load(file)
+        if schema["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported flow store version: {schema['version']}")
+        self.n_rows = schema["n_rows"]
+        self.schema = {column["name"]: column for column in schema["columns"]}
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def columns(self):
+        return list(self.schema)
+
+    def _load(self, file_name):
+        values = np.load(os.path.join(self.directory, file_name), mmap_mode="c")
+        # Vue ndarray simple sur le mmap, sans copie
+        return values.view(np.ndarray)
+
+    def array(self, name):
+        # Tableau mmap de la colonne (codes pour les colonnes catégorielles)
+        column = self.schema[name]
+        if column["kind"] == "text":
+            raise ValueError(f"Column {name} is stored as text")
+        return self._load(f"{column['file']}.npy")
+
+    def categories(self, name):
+        return self.schema[name]["categories"]
+
+    def mask(self, filters):
+        """
+        Masque des lignes retenues par filters, un dictionnaire
+        {colonne: valeur ou liste de valeurs}.
+        Seuls les codes des colonnes filtrées sont lus ; une colonne stockée
+        comme texte (valeurs presque toutes distinctes) est décodée.
+        """
+        keep = np.ones(self.n_rows, dtype=bool)
+        for name, values in filters.items():
+            if isinstance(values, str) or not isinstance(values, (list, tuple, set)):
+                values = [values]
+            if self.schema[name]["kind"] == "text":
+                keep &= np.isin(self._text(self.schema[name], None), list(values))
+                continue
+            categories = self.categories(name)
+            wanted = [
+                categories.index(value) for value in values if value in categories
+            ]
+            keep &= np.isin(self.array(name), wanted)
+        return keep
+
+    def _text(self, column, rows):
+        data = self._load(f"{column['file']}.data.npy")
+        offsets = self._load(f"{column['file']}.offsets.npy")
+        nulls = self._load(f"{column['file']}.nulls.npy")
+        if rows is None:
+            rows = range(self.n_rows)
+
+        values = np.empty(len(rows), dtype=object)
+        for i, row in enumerate(rows):
+            if not nulls[row]:
+                values[i] = data[offsets[row] : offsets[row + 1]].tobytes().decode()
+        return values
+
+    def series(self, name, rows=None, categorical=False):
+        """
+        Valeurs de la colonne name (toutes les lignes, ou seulement rows).
+        Les colonnes texte stockées comme catégories sont renvoyées en objets
+        Python, sauf si categorical=True (plus compact).
+        """
+        column = self.schema[name]
+        if column["kind"] == "text":
+            return self._text(column, rows)
+
+        values = self.array(name)
+        if rows is not None:
+            values = values[rows]
+        if column["kind"] != "category":
+            return values
+
+        if column["categorical"] or categorical:
+            values = pd.Categorical.from_codes(values, categories=column["categories"])
+            if rows is not None:
+                values = values.remove_unused_categories()
+            return values
+
+        # Code -1 pour les valeurs manquantes : dernière case à None
+        lookup = np.empty(len(column["categories"]) + 1, dtype=object)
+        lookup[:-1] = column["categories"]
+        return lookup[values]
+
+    def to_frame(self, columns=None, filters=None, categorical=False):
+        """
+        Construit un DataFrame avec les colonnes demandées (toutes par défaut).
+        Sans filtre, les colonnes numériques référencent directement les
+        fichiers mmap (aucune copie) : le DataFrame a un bloc par colonne,
+        sans consolidation. Les filtres, les colonnes texte ou catégorielles
+        et les opérations pandas qui consolident les blocs (df.values...)
+        copient les valeurs en mémoire.
+        """
+        if columns is None:
+            columns = self.columns
+        rows = None
+        if filters:
+            rows = np.flatnonzero(self.mask(filters))
+        if not columns:
+            return pd.DataFrame(
+                index=pd.RangeIndex(self.n_rows if rows is None else len(rows))
+            )
+        data = [
+            pd.Series(self.series(name, rows, categorical), name=name, copy=False)
+            for name in columns
+        ]
+        return pd.concat(data, axis=1, copy=False)
+
+
+def read_flow_store(directory, columns=None, filters=None, categorical=False):
+    return FlowStore(directory).to_frame(columns, filters, categorical)
+
+
+def _merged_categories(stores, name):
+    # Union des vocabulaires, triée comme pd.factorize(sort=True) si possible
+    categories = []
+    seen = set()
+    for store in stores:
+        if name in store.schema:
+            for value in store.categories(name):
+                if value not in seen:
+                    seen.add(value)
+                    categories.append(value)
+    try:
+        return sorted(categories)
+    except TypeError:
+        return categories
+
+
+def _merge_text(stores, name, directory, file_name):
+    # Octets UTF-8 copiés chunk par chunk dans les fichiers mmap de la colonne
+    n_rows = sum(len(store) for store in stores)
+    encoded = []
+    for store in stores:
+        column = store.schema.get(name)
+        if column is None:
+            encoded.append(None)
+        elif column["kind"] == "text":
+            encoded.append(
+                (
+                    store._load(f"{column['file']}.data.npy"),
+                    store._load(f"{column['file']}.offsets.npy"),
+                    store._load(f"{column['file']}.nulls.npy"),
+                )
+            )
+        else:
+            values = store.series(name)
+            nulls = pd.isna(values)
+            parts = [
+                b"" if null else str(value).encode("utf-8")
+                for value, null in zip(values, nulls)
+            ]
+            offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+            np.cumsum([len(part) for part in parts], out=offsets[1:])
+            data = np.frombuffer(b"".join(parts), dtype=np.uint8)
+            encoded.append((data, offsets, nulls))
+
+    n_bytes = sum(len(part[0]) for part in encoded if part is not None)
+    data = np.lib.format.open_memmap(
+        os.path.join(directory, f"{file_name}.data.npy"),
+        mode="w+",
+        dtype=np.uint8,
+        shape=(n_bytes,),
+    )
+    offsets = np.lib.format.open_memmap(
+        os.path.join(directory, f"{file_name}.offsets.npy"),
+        mode="w+",
+        dtype=np.int64,
+        shape=(n_rows + 1,),
+    )
+    nulls = np.lib.format.open_memmap(
+        os.path.join(directory, f"{file_name}.nulls.npy"),
+        mode="w+",
+        dtype=bool,
+        shape=(n_rows,),
+    )
+    offsets[0] = 0
+    row = byte = 0
+    for store, part in zip(stores, encoded):
+        n = len(store)
+        if part is None:
+            offsets[row + 1 : row + n + 1] = byte
+            nulls[row : row + n] = True
+        else:
+            part_data, part_offsets, part_nulls = part
+            data[byte : byte + len(part_data)] = part_data
+            offsets[row + 1 : row + n + 1] = part_offsets[1:] + byte
+            nulls[row : row + n] = part_nulls
+            byte += len(part_data)
+        row += n
+    for array in (data, offsets, nulls):
+        array.flush()
+
+
+def merge_flow_stores(sources, directory):
+    """
+    Concatène les stockages sources (dans l'ordre) dans le dossier directory,
+    colonne par colonne : la mémoire utilisée est celle d'une colonne, jamais
+    celle de toutes les données. Les vocabulaires des catégories sont
+    réunis ; une colonne absente d'un stockage y vaut NaN (ou None).
+    """
+    stores = [FlowStore(source) for source in sources]
+    os.makedirs(directory, exist_ok=True)
+    n_rows = sum(len(store) for store in stores)
+    names = []
+    for store in stores:
+        names += [name for name in store.columns if name not in names]
+
+    columns = []
+    for position, name in enumerate(names):
+        file_name = f"{position:04d}"
+        column = {"name": name, "file": file_name}
+        present = [store for store in stores if name in store.schema]
+        if any(store.schema[name]["kind"] == "array" for store in present):
+            # Colonne sans aucune valeur dans un chunk (catégorie vide) : absente
+            present = [
+                store
+                for store in present
+                if store.schema[name]["kind"] == "array" or store.categories(name)
+            ]
+        kinds = {store.schema[name]["kind"] for store in present}
+
+        if kinds == {"array"}:
+            column["kind"] = "array"
+            dtype = np.result_type(*(store.array(name).dtype for store in present))
+            if len(present) < len(stores) and dtype.kind in "biu":
+                # Valeurs manquantes : comme pandas, les entiers passent en flottants
+                dtype = np.result_type(dtype, np.float64)
+            values = np.lib.format.open_memmap(
+                os.path.join(directory, f"{file_name}.npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=(n_rows,),
+            )
+            row = 0
+            for store in stores:
+                if any(store is other for other in present):
+                    values[row : row + len(store)] = store.array(name)
+                else:
+                    values[row : row + len(store)] = (
+                        np.datetime64("NaT") if dtype.kind == "M" else np.nan
+                    )
+                row += len(store)
+            values.flush()
+            del values
+
+        elif kinds == {"category"}:
+            column["kind"] = "category"
+            column["categorical"] = all(
+                store.schema[name]["categorical"] for store in present
+            )
+            categories = _merged_categories(stores, name)
+            positions = {value: code for code, value in enumerate(categories)}
+            codes = np.lib.format.open_memmap(
+                os.path.join(directory, f"{file_name}.npy"),
+                mode="w+",
+                dtype=_smallest_code_dtype(len(categories)),
+                shape=(n_rows,),
+            )
+            row = 0
+            for store in stores:
+                if name in store.schema:
+                    # Dernière case : code -1 (valeur manquante) conservé
+                    lookup = np.array(
+                        [positions[value] for value in store.categories(name)] + [-1]
+                    )
+                    codes[row : row + len(store)] = lookup[store.array(name)]
+                else:
+                    codes[row : row + len(store)] = -1
+                row += len(store)
+            column["categories"] = categories
+            codes.flush()
+            del codes
+
+        elif kinds <= {"category", "text"}:
+            column["kind"] = "text"
+            _merge_text(stores, name, directory, file_name)
+
+        else:
+            raise ValueError(f"Column {name} has incompatible kinds: {sorted(kinds)}")
+        columns.append(column)
+
+    # schema.json en dernier, comme write_flow_store
+    schema = {"version": STORE_VERSION, "n_rows": n_rows, "columns": columns}
+    with open(os.path.join(directory, SCHEMA_FILE), "w") as file:
+        json.dump(schema, file)
@@ -7,15 +7,97 @@ Date: 01/2024
 """
 
 import xml.etree.ElementTree as ET
+import argparse
+import json
+import os
+import shutil
+import numpy as np
 import pandas as pd
-import ipaddress
-import pickle
+from flow_features import (
+    TCP_FLAGS,
+    compact_dtypes,
+    datetime_parts,
+    decode_tcp_flags,
+    flow_duration,
+    map_ip_to_interval,
+)
+from flow_encoder import FlowEncoder
+from flow_store import SCHEMA_FILE, FlowStore, read_flow_store, write_flow_store
 
 pd.set_option("display.max_columns", None)
 pd.set_option("display.max_rows", None)
 
+# Encodeur appris sur les données d'entraînement, réutilisé pour les challenges
+encoder_file = "data/flow_encoder.json"
 
-def preprocess_data(df):
+# Stockages colonnaires des flux bruts et des flux prétraités
+flow_store_dir = "data/flow_store"
+preprocessed_store_dir = "data/df_preprocessed"
+
+# Caches par fichier XML : analyse (écrit par data_loading.py --cache) et prétraitement
+parse_cache_dir = "data/parse_cache"
+preprocess_cache_dir = "data/preprocess_cache"
+MANIFEST_FILE = "manifest.json"
+
+# Version du prétraitement : à incrémenter dès que preprocess_data change,
+# pour invalider le cache de prétraitement
+PREPROCESS_VERSION = 2
+
+# Liste des noms de colonnes catégorielles
+categorical_columns = [
+    "sourceCategory",
+    "destinationCategory",
+    "sourcePortCategory",
+    "destinationPortCategory",
+    "totalSourceBytesCategory",
+    "totalDestinationBytesCategory",
+    "totalSourcePacketsCategory",
+    "totalDestinationPacketsCategory",
+]
+
+# Colonnes encodées en one-hot
+columns_to_encode = ["direction", "protocolName"] + categorical_columns
+
+# Composantes de date ajoutées comme caractéristiques, parmi
+# flow_features.DATETIME_PARTS (ex. ["hour", "dayofweek"]) ; aucune par défaut
+date_columns = {"startDateTime": "start", "stopDateTime": "stop"}
+date_parts = []
+
+# Flags TCP décodés en indicateurs
+unique_flags = TCP_FLAGS
+
+# Colonnes supprimées une fois les caractéristiques calculées
+columns_to_drop = [
+    "source",
+    "destination",
+    "sourcePort",
+    "destinationPort",
+    "totalSourceBytes",
+    "totalDestinationBytes",
+    "totalSourcePackets",
+    "totalDestinationPackets",
+    # "duration",
+    "startDateTime",
+    "stopDateTime",
+    "sourcePayloadAsBase64",
+    "sourcePayloadAsUTF",
+    "destinationPayloadAsBase64",
+    "destinationPayloadAsUTF",
+    "sourceTCPFlagsDescription",
+    "destinationTCPFlagsDescription",
+    "Tag",
+    "sensorInterfaceId",
+    "startTime",
+]
+
+
+def derive_features(df):
+    """
+    Conversions, intervalles, tag et flags TCP calculés avant l'encodage ;
+    les colonnes brutes (columns_to_drop) sont ensuite supprimées. Les
+    colonnes restantes, hors columns_to_encode, sont celles que l'encodeur
+    conserve : sa liste output_columns_ est la disposition finale.
+    """
     # Perform conversions on the data
     columns_to_convert = [
         "sourcePort",
@@ -31,21 +113,10 @@ def preprocess_data(df):
     # Convert startDateTime and stopDateTime into datetime objects and calculate duration
     df["startDateTime"] = pd.to_datetime(df["startDateTime"])
     df["stopDateTime"] = pd.to_datetime(df["stopDateTime"])
-    df["duration"] = df["stopDateTime"] - df["startDateTime"]
-    df["duration"] = df["duration"].apply(lambda x: int(x.total_seconds()))
+    df["duration"] = flow_duration(df["startDateTime"], df["stopDateTime"])
 
     # Perform encoding on Categorical Data
-    # Créer des intervalles pour les adresses IP
-    def map_ip_to_interval(ip):
-        ip = ipaddress.IPv4Address(ip)
-        if ip <= ipaddress.IPv4Address("128.0.0.0"):
-            return "PrivateNetwork"
-        elif ip <= ipaddress.IPv4Address("192.0.0.0"):
-            return "PublicNetwork"
-        elif ip <= ipaddress.IPv4Address("224.0.0.0"):
-            return "MulticastNetwork"
-        else:
-            return "UnknownNetwork"
+    # Les intervalles pour les adresses IP sont calculés par flow_features.map_ip_to_interval
 
     # Créer des intervalles de ports
     port_bins = [0, 1023, 49151, 65535]
@@ -69,22 +140,10 @@ def preprocess_data(df):
     ]
     packets_labels = ["Low", "Medium", "High"]
 
-    # Liste des noms de colonnes catégorielles
-    categorical_columns = [
-        "sourceCategory",
-        "destinationCategory",
-        "sourcePortCategory",
-        "destinationPortCategory",
-        "totalSourceBytesCategory",
-        "totalDestinationBytesCategory",
-        "totalSourcePacketsCategory",
-        "totalDestinationPacketsCategory",
-    ]
-
     for column in categorical_columns:
         field_name = column.replace("Category", "")
         if column == "sourceCategory" or column == "destinationCategory":
-            df[column] = df[field_name].apply(map_ip_to_interval)
+            df[column] = map_ip_to_interval(df[field_name])
         if column == "sourcePortCategory" or column == "destinationPortCategory":
             df[column] = pd.cut(
                 df[field_name], bins=port_bins, labels=port_labels, include_lowest=True
@@ -110,77 +169,219 @@ def preprocess_data(df):
                 include_lowest=True,
             )
 
-    # Extract year, month, day from startDateTime and stopDateTime
-    # df["start_year"] = df["startDateTime"].dt.year
-    # df["stop_year"] = df["stopDateTime"].dt.year
-    # df["start_month"] = df["startDateTime"].dt.month
-    # df["stop_month"] = df["stopDateTime"].dt.month
-    # df["start_day"] = df["startDateTime"].dt.day
-    # df["stop_day"] = df["stopDateTime"].dt.day
-
-    # Perform One-Hot Encoding on Categorical Data
-    columns_to_encode = ["direction", "protocolName"]
-    columns_to_encode.extend(categorical_columns)
-    df = pd.get_dummies(df, columns=columns_to_encode)
+    # Extract date parts (date_parts) from startDateTime and stopDateTime
+    for column, values in datetime_parts(df, date_columns, date_parts).items():
+        df[column] = values
 
     # Modify the tag
-    df["tag_Attack"] = df["Tag"].apply(lambda x: 1 if x == "Attack" else 0)
+    df["tag_Attack"] = (df["Tag"] == "Attack").astype(np.uint8)
 
     # Modify sourceTCPFlagsDescription and destinationTCPFlagsDescription
-    unique_flags = ["F", "S", "R", "P", "A", "N/A"]
+    source_flags = decode_tcp_flags(
+        df["sourceTCPFlagsDescription"], "sourceTCPFlag_", unique_flags
+    )
+    destination_flags = decode_tcp_flags(
+        df["destinationTCPFlagsDescription"], "destinationTCPFlag_", unique_flags
+    )
     for flag in unique_flags:
-        df[f"sourceTCPFlag_{flag}"] = df["sourceTCPFlagsDescription"].apply(
-            lambda x: int(flag in x.split(",")) if pd.notna(x) else 0
-        )
-        df[f"destinationTCPFlag_{flag}"] = df["destinationTCPFlagsDescription"].apply(
-            lambda x: int(flag in x.split(",")) if pd.notna(x) else 0
-        )
+        df[f"sourceTCPFlag_{flag}"] = source_flags[f"sourceTCPFlag_{flag}"]
+        df[f"destinationTCPFlag_{flag}"] = destination_flags[
+            f"destinationTCPFlag_{flag}"
+        ]
 
     # Drop unnecessary columns
-    columns_to_drop = [
-        "source",
-        "destination",
-        "sourcePort",
-        "destinationPort",
-        "totalSourceBytes",
-        "totalDestinationBytes",
-        "totalSourcePackets",
-        "totalDestinationPackets",
-        # "duration",
-        "startDateTime",
-        "stopDateTime",
-        "sourcePayloadAsBase64",
-        "sourcePayloadAsUTF",
-        "destinationPayloadAsBase64",
-        "destinationPayloadAsUTF",
-        "sourceTCPFlagsDescription",
-        "destinationTCPFlagsDescription",
-        "Tag",
-        "sensorInterfaceId",
-        "startTime",
-    ]
     df.drop(columns=columns_to_drop, inplace=True, errors="ignore")
 
     return df
 
 
-# Récupération des données
-df = pd.read_pickle("data/flow_df.pkl")
+def passthrough_columns(frames):
+    # Colonnes conservées par l'encodeur : union ordonnée des colonnes des
+    # DataFrames dérivés (derive_features), hors colonnes encodées
+    columns = {}
+    for df in frames:
+        for column in df.columns:
+            if column not in columns_to_encode:
+                columns[column] = None
+    return list(columns)
+
+
+def encode_features(df, encoder):
+    # Encodage one-hot (encodeur déjà appris), dans la disposition output_columns_
+    # Perform One-Hot Encoding on Categorical Data
+    return encoder.transform_frame(df)
+
+
+def preprocessed_schema(encoder):
+    # Schéma déclaré du DataFrame prétraité, pour compact_dtypes
+    schema = {
+        "appName": "category",
+        "origin": "category",
+        "duration": "count",
+        "tag_Attack": "indicator",
+    }
+    for column in encoder.feature_names_:
+        schema[column] = "indicator"
+    for part in date_parts:
+        for prefix in date_columns.values():
+            schema[f"{prefix}_{part}"] = "count"
+    for flag in unique_flags:
+        schema[f"sourceTCPFlag_{flag}"] = "indicator"
+        schema[f"destinationTCPFlag_{flag}"] = "indicator"
+    return schema
+
+
+def preprocess_data(df, encoder=None, report=False):
+    """
+    Prétraitement des flux. Si l'encodeur one-hot n'est pas fourni ou pas
+    encore appris, il est appris sur df ; sinon ses colonnes sont réutilisées
+    telles quelles (inférence). Les colonnes sont ensuite converties dans
+    leurs types compacts (voir preprocessed_schema).
+    """
+    if encoder is None:
+        encoder = FlowEncoder(columns_to_encode)
+    df = derive_features(df)
+    if not encoder.fitted:
+        encoder.fit(df, passthrough=passthrough_columns([df]))
+    df = encode_features(df, encoder)
+    return compact_dtypes(df, preprocessed_schema(encoder), report=report)
+
+
+def _read_parse_cache(entry):
+    # Flux bruts d'un fichier depuis le cache d'analyse, sans les payloads
+    store = FlowStore(os.path.join(parse_cache_dir, entry["key"]))
+    df = store.to_frame(columns=[c for c in store.columns if "Payload" not in c])
+    df["origin"] = entry["file"]
+    return df
+
+
+def preprocess_incremental(parse_manifest, encoder):
+    """
+    Prétraitement fichier par fichier à partir du cache d'analyse. Le résultat
+    de chaque fichier est conservé sous une clé (clé d'analyse,
+    PREPROCESS_VERSION, empreinte de l'encodeur) : seuls les fichiers nouveaux
+    ou modifiés sont prétraités. L'encodeur est réappris (et tout est
+    recalculé) si un fichier apporte une catégorie inconnue ou si un fichier a
+    été retiré depuis l'exécution précédente.
+    Renvoie le DataFrame prétraité et le manifeste du prétraitement.
+    """
+    entries = parse_manifest["files"]
+    manifest_file = os.path.join(preprocess_cache_dir, MANIFEST_FILE)
+    previous_keys = set()
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as file:
+            previous_keys = {entry["key"] for entry in json.load(file)["files"]}
+
+    def cache_dir(entry, encoder):
+        parts = "".join(f"-{part}" for part in date_parts)
+        name = f"{entry['key']}-v{PREPROCESS_VERSION}{parts}-e{encoder.digest()[:16]}"
+        return os.path.join(preprocess_cache_dir, name)
+
+    def cached(entry, encoder):
+        return os.path.exists(os.path.join(cache_dir(entry, encoder), SCHEMA_FILE))
+
+    # Caractéristiques intermédiaires, calculées seulement si nécessaire
+    derived = {}
+    keys = {entry["key"] for entry in entries}
+    refit = not encoder.fitted or not previous_keys <= keys
+    if not refit:
+        for entry in entries:
+            if not cached(entry, encoder):
+                derived[entry["key"]] = derive_features(_read_parse_cache(entry))
+                if encoder.unknown_categories(derived[entry["key"]]):
+                    refit = True
+
+    if refit:
+        for entry in entries:
+            if entry["key"] not in derived:
+                derived[entry["key"]] = derive_features(_read_parse_cache(entry))
+        # Colonnes conservées : union de celles de tous les fichiers, une
+        # colonne absente d'un fichier y est ajoutée vide
+        encoder.fit(
+            pd.concat(
+                [df[encoder.columns] for df in derived.values()], ignore_index=True
+            ),
+            passthrough=passthrough_columns(derived.values()),
+        )
+
+    frames = []
+    report = []
+    for entry in entries:
+        store_dir = cache_dir(entry, encoder)
+        if cached(entry, encoder):
+            frame = read_flow_store(store_dir)
+            status = "reused"
+        else:
+            frame = encode_features(derived.pop(entry["key"]), encoder)
+            tmp_dir = f"{store_dir}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            write_flow_store(frame, tmp_dir)
+            os.replace(tmp_dir, store_dir)
+            status = "computed"
+        frames.append(frame)
+        report.append({"file": entry["file"], "key": entry["key"], "status": status})
+
+    manifest = {
+        "preprocess_version": PREPROCESS_VERSION,
+        "encoder": encoder.digest(),
+        "refit": refit,
+        "files": report,
+    }
+    os.makedirs(preprocess_cache_dir, exist_ok=True)
+    with open(manifest_file, "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    df = pd.concat(frames, ignore_index=True)
+    return compact_dtypes(df, preprocessed_schema(encoder), report=True), manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prétraitement des flux")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"Ne prétraiter que les fichiers nouveaux ou modifiés (cache d'analyse {parse_cache_dir})",
+    )
+    args = parser.parse_args()
+
+    if args.incremental:
+        # Manifeste écrit par data_loading.py --cache
+        with open(os.path.join(parse_cache_dir, MANIFEST_FILE), "r") as file:
+            parse_manifest = json.load(file)
+        if os.path.exists(encoder_file):
+            encoder = FlowEncoder.load(encoder_file)
+        else:
+            encoder = FlowEncoder(columns_to_encode)
+
+        df_preprocessed, manifest = preprocess_incremental(parse_manifest, encoder)
+        reused = sum(entry["status"] == "reused" for entry in manifest["files"])
+        print(
+            f"Fichiers réutilisés depuis le cache : {reused}/{len(manifest['files'])}"
+        )
+    else:
+        # Récupération des données
+        # Les payloads sont supprimés par preprocess_data : inutile de les lire
+        store = FlowStore(flow_store_dir)
+        df = store.to_frame(columns=[c for c in store.columns if "Payload" not in c])
+
+        # Split the dataframe into two based on the "protocolName" column
+        df_HTTPWeb = df[df["appName"] == "HTTPWeb"]
+        df_SSH = df[df["appName"] == "SSH"]
+
+        # # Print the shapes of the resulting dataframes
+        print(f"Shape of HTTPWeb dataframe: {df_HTTPWeb.shape}")
+        print(f"Shape of SSH dataframe: {df_SSH.shape}")
 
-# Split the dataframe into two based on the "protocolName" column
-df_HTTPWeb = df[df["appName"] == "HTTPWeb"]
-df_SSH = df[df["appName"] == "SSH"]
+        print(df_HTTPWeb.head())
 
-# # Print the shapes of the resulting dataframes
-print(f"Shape of HTTPWeb dataframe: {df_HTTPWeb.shape}")
-print(f"Shape of SSH dataframe: {df_SSH.shape}")
+        # Parsing des fichiers XML
+        encoder = FlowEncoder(columns_to_encode)
+        df_preprocessed = preprocess_data(df, encoder, report=True)
 
-print(df_HTTPWeb.head())
+    print(df_preprocessed.head())
 
-# Parsing des fichiers XML
-df_preprocessed = preprocess_data(df)
-print(df_preprocessed.head())
+    # Sauvegarder l'encodeur pour l'inférence
+    encoder.save(encoder_file)
 
-# Sauvegarder le DataFrame avec les features manquantes
-with open("data/df_preprocessed.pkl", "wb") as file:
-    pickle.dump(df_preprocessed, file)
+    # Sauvegarder le DataFrame avec les features manquantes
+    write_flow_store(df_preprocessed, preprocessed_store_dir)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Les modules du projet sont à la racine et dans elasticsearch/ (lancés comme scripts)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "elasticsearch"))
@@ -0,0 +1,37 @@
+import json
+import os
+
+import api_metrics
+from api_metrics import ApiMetrics
+
+
+def test_slow_queries_written_by_writer_thread(tmp_path):
+    log = tmp_path / "logs" / "slow.jsonl"
+    metrics = ApiMetrics(slow_query_seconds=0.5, slow_query_log=str(log))
+    metrics.search_done("/summary", 0.1, 50, {"size": 0})
+    metrics.search_done("/summary", 0.8, 700, {"size": 0, "aggs": {}})
+    metrics.search_done("/timeline", 1.2, 1100, {"query": {"match_all": {}}})
+    metrics.close()
+
+    records = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [record["route"] for record in records] == ["/summary", "/timeline"]
+    assert records[0]["took"] == 0.7
+    assert records[1]["body"] == {"query": {"match_all": {}}}
+    assert 'api_es_took_seconds_count{route="/summary"} 2' in metrics.render()
+
+
+def test_slow_query_log_relative_to_module():
+    metrics = ApiMetrics()
+    assert metrics.slow_query_log == os.path.join(
+        os.path.dirname(os.path.abspath(api_metrics.__file__)),
+        "data",
+        "slow_queries.jsonl",
+    )
+
+
+def test_disabled_slow_log_starts_no_writer(tmp_path):
+    metrics = ApiMetrics(slow_query_log=str(tmp_path / "slow.jsonl"))
+    metrics.search_done("/summary", 10.0, 10000, {})
+    assert metrics.writer is None
+    metrics.close()
+    assert not (tmp_path / "slow.jsonl").exists()
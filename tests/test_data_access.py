@@ -0,0 +1,88 @@
+import json
+
+import pandas as pd
+import pytest
+
+import benchmark_api
+import data_access
+from flow_engine import FlowEngine
+from flow_store import write_flow_store
+
+
+class PitTracker:
+    # Moteur embarqué qui compte les points-in-time ouverts et fermés
+    def __init__(self, engine, fail_after=None):
+        self.engine = engine
+        self.fail_after = fail_after
+        self.searches = 0
+        self.opened = 0
+        self.closed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def search(self, **kwargs):
+        self.searches += 1
+        if self.fail_after is not None and self.searches > self.fail_after:
+            raise ConnectionError("search failed")
+        return self.engine.search(**kwargs)
+
+    def open_point_in_time(self, **kwargs):
+        self.opened += 1
+        return self.engine.open_point_in_time(**kwargs)
+
+    def close_point_in_time(self, **kwargs):
+        self.closed += 1
+        return self.engine.close_point_in_time(**kwargs)
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("flows")
+    write_flow_store(pd.DataFrame(benchmark_api.synthetic_flows(200)), directory)
+    return FlowEngine(str(directory))
+
+
+@pytest.fixture
+def stream(engine, monkeypatch):
+    def make(**kwargs):
+        es = PitTracker(engine, **kwargs)
+        monkeypatch.setattr(data_access, "es", es)
+        return es
+
+    monkeypatch.setattr(data_access.queries, "STREAM_PAGE_SIZE", 20)
+    return make
+
+
+def test_stream_closes_pit_at_the_end(stream):
+    es = stream()
+    with data_access.app.test_client() as client:
+        lines = client.get("/flows_stream").get_data(as_text=True).splitlines()
+    assert len(lines) == 200
+    assert es.opened == es.closed == 1
+
+
+def test_stream_keeps_pit_for_the_cursor(stream):
+    es = stream()
+    with data_access.app.test_client() as client:
+        lines = client.get("/flows_stream?limit=30").get_data(as_text=True)
+    assert "_next" in json.loads(lines.splitlines()[-1])
+    assert es.opened == 1 and es.closed == 0
+
+
+def test_stream_closes_pit_on_disconnect(stream):
+    es = stream()
+    with data_access.app.test_client() as client:
+        response = client.get("/flows_stream", buffered=False)
+        next(iter(response.response))
+        # Client déconnecté après la première page
+        response.close()
+    assert es.opened == es.closed == 1
+
+
+def test_stream_closes_pit_on_search_error(stream):
+    es = stream(fail_after=2)
+    with data_access.app.test_client() as client:
+        lines = client.get("/flows_stream").get_data(as_text=True).splitlines()
+    assert json.loads(lines[-1]) == {"_error": "search failed"}
+    assert es.opened == es.closed == 1
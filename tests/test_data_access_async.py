@@ -0,0 +1,196 @@
+import asyncio
+import json
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("quart")
+
+import benchmark_api
+import data_access
+import data_access_async
+from flow_engine import FlowEngine
+from flow_store import write_flow_store
+
+
+class AsyncIndices:
+    def __init__(self, client):
+        self.client = client
+
+    async def stats(self, **kwargs):
+        self.client.stats_calls += 1
+        return self.client.engine.indices.stats(**kwargs)
+
+    async def get(self, **kwargs):
+        return self.client.engine.indices.get(**kwargs)
+
+
+class AsyncEngine:
+    # AsyncElasticsearch devant le moteur embarqué (mêmes réponses)
+    def __init__(self, engine, latency=0.0):
+        self.engine = engine
+        self.latency = latency
+        self.indices = AsyncIndices(self)
+        self.stats_calls = 0
+        self.searches = 0
+        self.fail_after = None
+        self.opened = 0
+        self.pits_closed = 0
+        self.closed = False
+
+    async def search(self, **kwargs):
+        self.searches += 1
+        if self.fail_after is not None and self.searches > self.fail_after:
+            raise ConnectionError("search failed")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.engine.search(**kwargs)
+
+    async def open_point_in_time(self, **kwargs):
+        self.opened += 1
+        return self.engine.open_point_in_time(**kwargs)
+
+    async def close_point_in_time(self, **kwargs):
+        self.pits_closed += 1
+        return self.engine.close_point_in_time(**kwargs)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("flows")
+    write_flow_store(pd.DataFrame(benchmark_api.synthetic_flows(2000)), directory)
+    return FlowEngine(str(directory))
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    # Client créé par startup() : remplacé par le moteur embarqué
+    clients = []
+
+    def make_client(**kwargs):
+        clients.append(AsyncEngine(engine))
+        return clients[-1]
+
+    monkeypatch.setattr(data_access_async, "AsyncElasticsearch", make_client)
+    monkeypatch.setattr(data_access_async, "GENERATION_INTERVAL", 0.01)
+    data_access_async.cache.clear()
+    data_access_async.cache.set_generation(None)
+    return clients
+
+
+def flask_response(engine, monkeypatch, url):
+    monkeypatch.setattr(data_access, "es", engine)
+    data_access.cache.clear()
+    with data_access.app.test_client() as flask_client:
+        response = flask_client.get(url)
+        return response.status_code, response.get_json()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/summary",
+        "/summary?fields=source_bytes&size=3",
+        "/summary_by_protocol",
+        "/flows_count_by_application",
+        "/timeline?protocol=tcp_ip&points=50",
+    ],
+)
+def test_same_responses_as_flask(engine, client, monkeypatch, url):
+    async def scenario():
+        async with data_access_async.app.test_app() as app:
+            response = await app.test_client().get(url)
+            return response.status_code, await response.get_json()
+
+    assert run(scenario()) == flask_response(engine, monkeypatch, url)
+
+
+def test_summary_runs_dimension_searches_concurrently(client):
+    async def scenario():
+        async with data_access_async.app.test_app() as app:
+            es = client[0]
+            es.latency = 0.2
+            started = asyncio.get_running_loop().time()
+            response = await app.test_client().get("/summary")
+            elapsed = asyncio.get_running_loop().time() - started
+            return response.status_code, await response.get_json(), elapsed, es
+
+    status, body, elapsed, es = run(scenario())
+    assert status == 200
+    assert set(body) == set(data_access_async.queries.DIMENSION_FIELDS)
+    assert es.searches == 4
+    # Quatre recherches de 0,2 s en parallèle, pas 0,8 s
+    assert elapsed < 0.6
+
+
+def test_request_timeout_returns_504(client, monkeypatch):
+    monkeypatch.setattr(data_access_async, "REQUEST_TIMEOUT", 0.05)
+
+    async def scenario():
+        async with data_access_async.app.test_app() as app:
+            client[0].latency = 1.0
+            response = await app.test_client().get("/distinct_protocols")
+            return response.status_code, await response.get_json()
+
+    status, body = run(scenario())
+    assert status == 504
+    assert body == {"error": "Request timed out"}
+    assert data_access_async.cache.stats()["entries"] == 0
+
+
+def test_generation_watcher_lifecycle(client, engine):
+    async def scenario():
+        async with data_access_async.app.test_app() as app:
+            await asyncio.sleep(0.05)
+            task = data_access_async.generation_task
+            generation = data_access_async.cache.stats()["generation"]
+            first = await app.test_client().get("/distinct_protocols")
+            second = await app.test_client().get("/distinct_protocols")
+            searches = client[0].searches
+        await asyncio.sleep(0)
+        return task, generation, first, second, searches
+
+    task, generation, first, second, searches = run(scenario())
+    es = client[0]
+    assert es.stats_calls >= 2
+    assert generation is not None
+    assert json.loads(json.dumps(generation))[0] == [engine.uuid]
+    assert first.status_code == second.status_code == 200
+    # Seconde réponse servie par le cache
+    assert searches == 1
+    # Arrêt : tâche de fond annulée et client fermé
+    assert task.cancelled() or task.done()
+    assert es.closed
+
+
+@pytest.mark.parametrize(
+    "url, fail_after, closed",
+    [
+        ("/flows_stream", None, 1),
+        ("/flows_stream", 2, 1),
+        ("/flows_stream?limit=30", None, 0),
+    ],
+)
+def test_stream_closes_pit(client, monkeypatch, url, fail_after, closed):
+    monkeypatch.setattr(data_access_async.queries, "STREAM_PAGE_SIZE", 20)
+
+    async def scenario():
+        async with data_access_async.app.test_app() as app:
+            client[0].fail_after = fail_after
+            response = await app.test_client().get(url)
+            return (await response.get_data(as_text=True)).splitlines()
+
+    lines = run(scenario())
+    es = client[0]
+    if fail_after is not None:
+        assert json.loads(lines[-1]) == {"_error": "search failed"}
+    # Point-in-time fermé, sauf s'il reste à lire avec le curseur _next
+    assert es.opened == 1
+    assert es.pits_closed == closed
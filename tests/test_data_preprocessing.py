@@ -0,0 +1,43 @@
+import queue
+import threading
+
+import data_preprocessing
+from data_preprocessing import EncodingCheckpoint
+
+
+class RotatingPit:
+    # Elasticsearch qui renvoie un nouvel identifiant de PIT à chaque réponse
+    def __init__(self, n_hits):
+        self.n_hits = n_hits
+        self.pit_ids = []
+
+    def search(self, pit, search_after=None, size=10, **kwargs):
+        self.pit_ids.append(pit["id"])
+        start = 0 if search_after is None else search_after[0] + 1
+        hits = [
+            {"_id": str(i), "_source": {"i": i}, "sort": [i]}
+            for i in range(start, min(start + size, self.n_hits))
+        ]
+        return {"pit_id": f"pit-{len(self.pit_ids)}", "hits": {"hits": hits}}
+
+
+class Stats:
+    def add(self, n_docs, seconds):
+        pass
+
+
+def test_reader_follows_the_returned_pit_id(tmp_path, monkeypatch):
+    es = RotatingPit(n_hits=5)
+    monkeypatch.setattr(data_preprocessing, "es", es)
+    file_name = str(tmp_path / "checkpoint.json")
+    checkpoint = EncodingCheckpoint.new(file_name, "source", "target", 1)
+    checkpoint.state["pit_id"] = "pit-0"
+    raw_queue = queue.Queue()
+
+    data_preprocessing._read_slice(
+        0, checkpoint, raw_queue, threading.Event(), Stats(), batch_size=2
+    )
+    # Chaque recherche utilise l'identifiant renvoyé par la précédente
+    assert es.pit_ids == ["pit-0", "pit-1", "pit-2", "pit-3"]
+    assert checkpoint.state["pit_id"] == "pit-4"
+    assert EncodingCheckpoint.load(file_name).state["pit_id"] == "pit-4"
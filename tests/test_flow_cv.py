@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import ShuffleSplit, StratifiedKFold, cross_val_predict
+
+import flow_cv
+
+
+class ViewCheck(ClassifierMixin, BaseEstimator):
+    # Enregistre si les lignes d'apprentissage sont une vue du mmap partagé
+    def fit(self, X, y):
+        self.shared_ = np.shares_memory(X, flow_cv._shared["X"])
+        self.classes_ = np.unique(y)
+        return self
+
+    def predict_proba(self, X):
+        proba = np.zeros((len(X), len(self.classes_)))
+        proba[:, -1] = float(self.shared_)
+        proba[:, 0] += 0.5
+        return proba
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.integers(0, 8, size=(300, 4)).astype(float))
+    y = pd.Series((X[0] + X[1] + rng.integers(0, 3, size=300) > 8).astype(int))
+    return X, y
+
+
+def test_fold_layout_slices_match_splits(data):
+    X, y = data
+    splits = list(StratifiedKFold(n_splits=4).split(X, y))
+    order, bounds = flow_cv.fold_layout(splits, len(y))
+    doubled = np.tile(order, 2)
+    for fold, (train_index, test_index) in enumerate(splits):
+        train, test = flow_cv.fold_slices(bounds, fold)
+        assert np.array_equal(doubled[test], test_index)
+        assert np.array_equal(np.sort(doubled[train]), train_index)
+
+
+def test_fold_layout_rejects_overlapping_tests(data):
+    X, y = data
+    splits = list(ShuffleSplit(n_splits=3, random_state=0).split(X))
+    assert flow_cv.fold_layout(splits, len(y)) is None
+
+
+def test_folds_fit_on_views(data):
+    X, y = data
+    table, predictions = flow_cv.cross_validate(
+        ViewCheck(), X, y, n_jobs=2, return_predictions=True
+    )
+    assert (table["n_train"] + table["n_test"] == len(y)).all()
+    # Score 1 : chaque fold a appris sur une vue du mmap, sans copie
+    assert (predictions["y_score"] == 1.0).all()
+
+
+def test_predictions_match_scikit_learn(data):
+    X, y = data
+    cv = StratifiedKFold(n_splits=5)
+    classifier = LogisticRegression()
+    table, predictions = flow_cv.cross_validate(
+        classifier, X, y, cv=cv, n_jobs=2, return_predictions=True
+    )
+    expected = cross_val_predict(
+        classifier, X.astype(np.float32), y, cv=cv, method="predict_proba"
+    )[:, 1]
+    assert list(table["fold"]) == [1, 2, 3, 4, 5]
+    assert predictions.index.equals(y.index)
+    assert (predictions["y_true"] == y).all()
+    np.testing.assert_allclose(predictions["y_score"], expected, atol=1e-3)
+
+
+def test_overlapping_splits_fall_back_to_indices(data):
+    X, y = data
+    cv = ShuffleSplit(n_splits=3, test_size=0.2, random_state=0)
+    table = flow_cv.cross_validate(LogisticRegression(), X, y, cv=cv, n_jobs=2)
+    assert list(table["n_test"]) == [60, 60, 60]
+    assert list(table["n_train"]) == [240, 240, 240]
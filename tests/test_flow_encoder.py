@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from flow_encoder import FlowEncoder
+
+
+@pytest.fixture
+def train():
+    return pd.DataFrame(
+        {
+            "duration": [1, 2, 3],
+            "protocolName": ["tcp_ip", "udp_ip", "tcp_ip"],
+            "direction": ["L2R", "R2L", "L2L"],
+            "Tag": ["Normal", "Attack", "Normal"],
+        }
+    )
+
+
+def test_transform_frame_matches_get_dummies(train):
+    encoder = FlowEncoder(["protocolName", "direction"]).fit(train)
+    expected = pd.get_dummies(
+        train, columns=["protocolName", "direction"], dtype=np.uint8
+    )
+    result = encoder.transform_frame(train)
+    assert list(result.columns) == encoder.output_columns_
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_transform_frame_keeps_training_layout(train):
+    encoder = FlowEncoder(["protocolName", "direction"]).fit(train)
+    # Autre ordre, colonne en plus, catégorie inconnue
+    test = train[["Tag", "direction", "protocolName", "duration"]].copy()
+    test["sourcePayloadAsUTF"] = "x"
+    test.loc[0, "protocolName"] = "icmp_ip"
+    result = encoder.transform_frame(test)
+    assert list(result.columns) == encoder.output_columns_
+    assert result.loc[0, ["protocolName_tcp_ip", "protocolName_udp_ip"]].sum() == 0
+
+
+def test_transform_frame_reindexes_missing_passthrough(train):
+    encoder = FlowEncoder(["protocolName", "direction"]).fit(train)
+    result = encoder.transform_frame(train.drop(columns=["Tag"]))
+    assert list(result.columns) == encoder.output_columns_
+    assert result["Tag"].isna().all()
+
+
+def test_save_load_round_trip(train, tmp_path):
+    encoder = FlowEncoder(["protocolName", "direction"]).fit(train)
+    file_name = tmp_path / "encoder.json"
+    encoder.save(file_name)
+    loaded = FlowEncoder.load(file_name)
+    assert loaded.output_columns_ == encoder.output_columns_
+    assert loaded.digest() == encoder.digest()
+    pd.testing.assert_frame_equal(
+        loaded.transform_frame(train), encoder.transform_frame(train)
+    )
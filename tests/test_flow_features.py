@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark_features import (
+    decode_tcp_flags_rowwise,
+    map_ip_to_interval_rowwise,
+    random_ips,
+    random_tcp_flags,
+)
+from flow_features import (
+    TCP_FLAGS,
+    decode_tcp_flags,
+    ip_interval,
+    ipv4_to_uint32,
+    map_ip_to_interval,
+    tcp_flags_bitmask,
+)
+
+
+def test_map_ip_to_interval_matches_rowwise():
+    ips = random_ips(20_000, n_distinct=2_000)
+    expected = ips.apply(map_ip_to_interval_rowwise)
+    assert map_ip_to_interval(ips).equals(expected)
+
+
+@pytest.mark.parametrize(
+    "ip",
+    [
+        "0.0.0.0",
+        "127.255.255.255",
+        "128.0.0.0",
+        "128.0.0.1",
+        "192.0.0.0",
+        "192.0.0.1",
+        "224.0.0.0",
+        "224.0.0.1",
+        "255.255.255.255",
+        "::1",
+        "not-an-ip",
+        "01.2.3.4",
+        "256.1.1.1",
+        "1.2.3",
+        "",
+        None,
+    ],
+)
+def test_ip_interval_boundaries(ip):
+    expected = map_ip_to_interval_rowwise(ip)
+    assert map_ip_to_interval(pd.Series([ip], dtype=object)).tolist() == [expected]
+    assert ip_interval(ip) == expected
+
+
+def test_ipv4_to_uint32_boundaries():
+    addresses, valid = ipv4_to_uint32(
+        ["128.0.0.0", "0.0.0.0", "255.255.255.255", "10.1.2.3"]
+    )
+    assert addresses.dtype == np.uint32
+    assert addresses.tolist() == [
+        2**31,
+        0,
+        2**32 - 1,
+        (10 << 24) | (1 << 16) | (2 << 8) | 3,
+    ]
+    assert valid.all()
+
+
+def test_ipv4_to_uint32_invalid_values():
+    addresses, valid = ipv4_to_uint32(["::1", None, np.nan, "1.2.3.4.5", 42, "1.2.3.4"])
+    assert valid.tolist() == [False, False, False, False, False, True]
+    assert addresses[:5].tolist() == [0] * 5
+
+
+def test_ipv4_to_uint32_empty():
+    addresses, valid = ipv4_to_uint32([])
+    assert len(addresses) == 0 and len(valid) == 0
+
+
+def test_decode_tcp_flags_byte_identical_to_rowwise():
+    values = random_tcp_flags(5_000)
+    expected = decode_tcp_flags_rowwise(values, "sourceTCPFlag_")
+    result = decode_tcp_flags(values, "sourceTCPFlag_")
+    assert list(result) == list(expected)
+    for column, column_values in expected.items():
+        assert result[column].dtype == column_values.dtype
+        assert result[column].tobytes() == column_values.tobytes()
+
+
+def test_decode_tcp_flags_challenge2_format():
+    # Flags ".AP.SF" : un flag est présent s'il apparaît dans la chaîne
+    values = pd.Series([".AP.SF", "....S.", ".A....", "......", "RA"])
+    flags = ["A", "F", "S", "R", "P"]
+    result = decode_tcp_flags(values, "flags_", flags=flags, separator=None)
+    for flag in flags:
+        expected = values.str.contains(flag, regex=False).astype(int).to_numpy()
+        assert result[f"flags_{flag}"].tobytes() == expected.tobytes()
+
+
+def test_tcp_flags_bitmask_tokens():
+    # "N/A" est un jeton exact : "A" n'y est pas présent
+    mask = tcp_flags_bitmask(pd.Series(["N/A", "F,S", None, ""]))
+    assert mask.dtype == np.uint8
+    assert mask.tolist() == [1 << TCP_FLAGS.index("N/A"), 0b11, 0, 0]
@@ -0,0 +1,43 @@
+import pytest
+
+import flow_queries as queries
+
+
+def test_stream_cursor_rebuilds_query_from_filters():
+    cursor = queries.encode_cursor({"pit": "abc", "after": [41]})
+    limit, source, decoded, query = queries.stream_args(
+        {"cursor": cursor, "protocol": "tcp_ip", "limit": "10"}
+    )
+    assert limit == 10
+    assert decoded == {"pit": "abc", "after": [41]}
+    assert query == {"bool": {"filter": [{"term": {"protocolName": "tcp_ip"}}]}}
+
+
+def test_stream_cursor_ignores_embedded_query():
+    cursor = queries.encode_cursor(
+        {"pit": "abc", "after": [41], "query": {"match_all": {}}}
+    )
+    _, _, decoded, query = queries.stream_args({"cursor": cursor})
+    assert "query" not in decoded
+    assert query == {"bool": {"filter": []}}
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"pit": "abc"},
+        {"pit": "", "after": [1]},
+        {"pit": "abc", "after": []},
+        {"pit": "abc", "after": ["x"]},
+        {"pit": "abc", "after": [{"script": "1"}]},
+        ["abc", [1]],
+    ],
+)
+def test_stream_cursor_rejects_invalid(value):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        queries.stream_args({"cursor": queries.encode_cursor(value)})
+
+
+def test_stream_cursor_rejects_garbage():
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        queries.stream_args({"cursor": "not base64!"})
@@ -0,0 +1,134 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from elasticsearch import Elasticsearch
+
+from flow_rollup import COUNT_FIELD, ROLLUP_INDEX, FlowRollup, rollup_usable
+
+
+def flow(protocol, start="2010-06-13T23:15:00", packets="3"):
+    return {
+        "protocolName": protocol,
+        "appName": "HTTPWeb",
+        "origin": "TestbedSunJun13Flows.xml",
+        "direction": "L2R",
+        "Tag": "Normal",
+        "startDateTime": start,
+        "totalSourcePackets": packets,
+    }
+
+
+@pytest.fixture
+def bulk_server():
+    # Faux _bulk : status (ou items refusés), requêtes reçues
+    state = {"status": 200, "reject": 0, "requests": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            lines = [json.loads(line) for line in body.splitlines() if line]
+            state["requests"].append(lines)
+            items = []
+            for i, line in enumerate(lines[::2]):
+                status = 400 if i < state["reject"] else 200
+                item = {"_id": line["update"]["_id"], "status": status}
+                if status == 400:
+                    item["error"] = {"type": "illegal_argument_exception"}
+                items.append({"update": item})
+            payload = json.dumps({"errors": state["reject"] > 0, "items": items})
+            payload = payload.encode("utf-8")
+            self.send_response(state["status"])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_PUT = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    es = Elasticsearch(hosts=[f"http://127.0.0.1:{server.server_port}"])
+    yield es.options(max_retries=5, retry_on_timeout=True), state
+    server.shutdown()
+
+
+def test_groups_and_batch_ids():
+    rollup = FlowRollup()
+    rollup.add(flow("tcp_ip"))
+    rollup.add(flow("tcp_ip", start="2010-06-13T23:59:59", packets="4"))
+    rollup.add(flow("udp_ip"))
+    actions = list(rollup.actions("run-1"))
+    assert len(actions) == 2
+    assert {action["script"]["params"]["batch"] for action in actions} == {"run-1"}
+    counters = actions[0]["script"]["params"]["add"]
+    assert counters[COUNT_FIELD] == 2
+    assert counters["totalSourcePackets"] == 7
+
+
+def test_flush_batches_are_distinct(bulk_server):
+    es, state = bulk_server
+    rollup = FlowRollup()
+    rollup.add(flow("tcp_ip"))
+    rollup.flush(es)
+    rollup.add(flow("tcp_ip"))
+    rollup.flush(es)
+    batches = [request[1]["script"]["params"]["batch"] for request in state["requests"]]
+    assert len(set(batches)) == 2
+    assert rollup.total == 2 and rollup.failed == 0
+
+
+def test_flush_reports_rejected_groups(bulk_server):
+    es, state = bulk_server
+    state["reject"] = 1
+    rollup = FlowRollup()
+    rollup.add(flow("tcp_ip"))
+    rollup.add(flow("udp_ip"))
+    rollup.flush(es)
+    assert rollup.failed == 1
+    assert rollup.groups == {}
+
+
+def test_flush_is_not_retried(bulk_server):
+    es, state = bulk_server
+    state["status"] = 503
+    rollup = FlowRollup()
+    rollup.add(flow("tcp_ip"))
+    rollup.add(flow("udp_ip"))
+    rollup.flush(es)
+    # Une seule requête malgré max_retries=5 sur le client ; aucune exception
+    assert len(state["requests"]) == 1
+    assert rollup.failed == 2
+
+
+def indices(meta=None, source_uuid="abc", rollup=True):
+    response = {"flow_data_index_v2": {"settings": {"index": {"uuid": source_uuid}}}}
+    if rollup:
+        mappings = {} if meta is None else {"_meta": meta}
+        response[ROLLUP_INDEX] = {"mappings": mappings, "settings": {}}
+    return response
+
+
+@pytest.mark.parametrize(
+    "response, usable",
+    [
+        (indices({"complete": True, "source_uuid": "abc"}), True),
+        # Index des flux recréé depuis le calcul de la synthèse
+        (indices({"complete": True, "source_uuid": "old"}), False),
+        # Chargement en cours ou groupes refusés
+        (indices({"complete": False}), False),
+        # Synthèse créée avant l'enregistrement de l'index source
+        (indices(), False),
+        (indices(rollup=False), False),
+    ],
+)
+def test_rollup_usable(response, usable):
+    assert rollup_usable(response) is usable
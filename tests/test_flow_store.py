@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from flow_store import FlowStore, write_flow_store
+
+
+def test_to_frame_references_the_mmap(tmp_path, monkeypatch):
+    df = pd.DataFrame(
+        {
+            "a": np.arange(10.0),
+            "b": np.arange(10.0) * 2,
+            "c": np.arange(10),
+            "appName": ["SSH", "HTTPWeb"] * 5,
+        }
+    )
+    write_flow_store(df, tmp_path)
+    store = FlowStore(tmp_path)
+    loaded = {}
+    load = store._load
+
+    def record(file_name):
+        loaded[file_name] = load(file_name)
+        return loaded[file_name]
+
+    monkeypatch.setattr(store, "_load", record)
+    frame = store.to_frame()
+    pd.testing.assert_frame_equal(frame, df)
+    for name in ["a", "b", "c"]:
+        array = loaded[f"{store.schema[name]['file']}.npy"]
+        assert np.shares_memory(frame[name].to_numpy(), array)
+
+
+def test_filter_on_text_column(tmp_path):
+    # Une ligne : appName stocké en texte (valeurs toutes distinctes)
+    write_flow_store(pd.DataFrame({"appName": ["SSH"], "a": [1]}), tmp_path)
+    store = FlowStore(tmp_path)
+    assert store.schema["appName"]["kind"] == "text"
+    assert list(store.to_frame(filters={"appName": "SSH"})["a"]) == [1]
+    assert len(store.to_frame(filters={"appName": ["HTTPWeb"]})) == 0
@@ -0,0 +1,64 @@
+import pandas as pd
+
+import preprocess_df
+from flow_encoder import FlowEncoder
+
+
+def raw_flows(n, origin=None, **extra):
+    # Flux bruts tels que lus depuis les captures XML
+    df = pd.DataFrame(
+        {
+            "appName": ["SSH"] * n,
+            "totalSourceBytes": [str(100 * i) for i in range(n)],
+            "totalDestinationBytes": ["20000"] * n,
+            "totalSourcePackets": ["10"] * n,
+            "totalDestinationPackets": ["600"] * n,
+            "sourcePayloadAsBase64": [None] * n,
+            "sourcePayloadAsUTF": [None] * n,
+            "destinationPayloadAsBase64": [None] * n,
+            "destinationPayloadAsUTF": [None] * n,
+            "direction": ["L2R", "R2L"] * (n // 2),
+            "sourceTCPFlagsDescription": ["S,A"] * n,
+            "destinationTCPFlagsDescription": [None] * n,
+            "source": ["192.168.5.122"] * n,
+            "protocolName": ["tcp_ip"] * n,
+            "sourcePort": ["22"] * n,
+            "destination": ["10.0.0.1"] * n,
+            "destinationPort": ["50000"] * n,
+            "startDateTime": ["2010-06-13T00:00:00"] * n,
+            "stopDateTime": ["2010-06-13T00:00:05"] * n,
+            "Tag": ["Normal", "Attack"] * (n // 2),
+            **extra,
+        }
+    )
+    if origin is not None:
+        df["origin"] = origin
+    return df
+
+
+def test_encoder_layout_is_the_output_layout():
+    encoder = FlowEncoder(preprocess_df.columns_to_encode)
+    df = preprocess_df.preprocess_data(
+        raw_flows(4, origin="a.xml", sensorInterfaceId=["1"] * 4), encoder
+    )
+    assert list(df.columns) == encoder.output_columns_
+    assert "tag_Attack" in encoder.passthrough_
+    assert not set(preprocess_df.columns_to_drop) & set(encoder.output_columns_)
+
+
+def test_inference_without_origin():
+    encoder = FlowEncoder(preprocess_df.columns_to_encode)
+    preprocess_df.preprocess_data(raw_flows(4, origin="a.xml"), encoder)
+    df = preprocess_df.preprocess_data(raw_flows(2), encoder)
+    assert list(df.columns) == encoder.output_columns_
+    assert df["origin"].isna().all()
+    assert list(df["tag_Attack"]) == [0, 1]
+
+
+def test_passthrough_is_the_union_of_files():
+    first = preprocess_df.derive_features(raw_flows(2, origin="a.xml"))
+    second = preprocess_df.derive_features(raw_flows(2, origin="b.xml"))
+    second["start_hour"] = 0
+    columns = preprocess_df.passthrough_columns([first.drop(columns="origin"), second])
+    assert "origin" in columns and "start_hour" in columns
+    assert not set(preprocess_df.columns_to_encode) & set(columns)
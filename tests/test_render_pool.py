@@ -0,0 +1,15 @@
+from render_pool import RenderPool
+
+
+def test_same_key_shares_one_rendering():
+    pool = RenderPool(max_workers=1)
+    try:
+        first = pool.submit("key", sum, [1, 2, 3])
+        second = pool.submit("key", sum, [1, 2, 3])
+        assert first is second
+        assert first.result(timeout=60) == 6
+        assert pool.submit("other", sum, [4]).result(timeout=60) == 4
+    finally:
+        pool.shutdown()
+    # Rendus terminés : plus aucun rendu partagé en attente
+    assert not pool.pending
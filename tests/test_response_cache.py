@@ -0,0 +1,85 @@
+import threading
+
+from response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_generation_change_invalidates():
+    clock = Clock()
+    generations = iter([1, 1, 2])
+    cache = ResponseCache(lambda: next(generations), clock=clock)
+    assert cache.get("a") is None
+    cache.put("a", "response")
+    clock.now += 1.0
+    assert cache.get("a") == "response"
+    clock.now += 1.0
+    assert cache.get("a") is None
+    assert cache.stats()["generation"] == 2
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_failed_generation_read_is_rate_limited():
+    clock = Clock()
+    calls = []
+
+    def generation():
+        calls.append(clock.now)
+        raise ConnectionError
+
+    cache = ResponseCache(generation, clock=clock)
+    for _ in range(3):
+        assert cache.get("a") is None
+        cache.put("a", "response")
+    assert len(calls) == 1
+    clock.now += 1.0
+    assert cache.get("a") is None
+    assert len(calls) == 2
+
+
+def test_generation_read_outside_lock():
+    clock = Clock()
+    started = threading.Event()
+    release = threading.Event()
+
+    def generation():
+        started.set()
+        release.wait(5)
+        return 1
+
+    cache = ResponseCache(generation, clock=clock)
+    reader = threading.Thread(target=cache.get, args=("a",))
+    reader.start()
+    assert started.wait(5)
+    # Lecture en cours : les autres requêtes ne l'attendent pas
+    assert cache.get("b") is None
+    assert cache.stats()["misses"] == 1
+    release.set()
+    reader.join()
+    assert cache.stats()["generation"] == 1
+
+
+def test_put_skipped_when_generation_changed():
+    clock = Clock()
+    generations = iter([1, 2])
+    cache = ResponseCache(lambda: next(generations), clock=clock)
+    # Requête lente : calcul commencé sous la génération 1
+    cached, generation = cache.lookup("a")
+    assert cached is None and generation == 1
+    # Index modifié, une autre requête fait passer le cache à la génération 2
+    clock.now += 1.0
+    assert cache.get("b") is None
+    assert cache.stats()["generation"] == 2
+    # Réponse de l'ancienne génération : non conservée
+    cache.put("a", "stale", generation)
+    assert cache.get("a") is None
+    assert cache.stats()["stale_puts"] == 1
+    cached, generation = cache.lookup("a")
+    cache.put("a", "fresh", generation)
+    assert cache.get("a") == "fresh"